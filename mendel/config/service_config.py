@@ -28,6 +28,12 @@ class ServiceConfig(GlobalConfig):
     DEFAULT_BUNDLE_TYPE = "remote_jar"
     DEFAULT_PROJECT_TYPE = "java"
     DEFAULT_VERSION_CONTROL = "git"
+    DEFAULT_PARALLEL = 1
+    DEFAULT_RELAY_SEEDS = 1
+    DEFAULT_FACTS_TTL = 24 * 60 * 60
+    DEFAULT_NOTIFICATIONS = "per_host"
+    DEFAULT_APT_UPDATE_MAX_AGE = 10 * 60
+    DEFAULT_RESTART_STRATEGY = "stop-start"
 
     def __init__(self, **kwargs):
         """
@@ -61,6 +67,24 @@ class ServiceConfig(GlobalConfig):
         self.slack_emoji = kwargs.get('slack_emoji') or self.DEFAULT_SLACK_EMOJI
         self.track_event_endpoint = kwargs.get('track_event_endpoint') or self.GLOBAL_TRACK_EVENT_ENDPOINT
         self.host_configs = kwargs.get('host_configs') or []
+        self.parallel = kwargs.get('parallel') or self.DEFAULT_PARALLEL
+        self.batch_size = kwargs.get('batch_size')
+        self.max_unavailable = kwargs.get('max_unavailable')
+        self.batch_pause = kwargs.get('batch_pause')
+        self.upload_relay = kwargs.get('upload_relay') or False
+        self.relay_seeds = kwargs.get('relay_seeds') or self.DEFAULT_RELAY_SEEDS
+        self.artifact_proxy = kwargs.get('artifact_proxy') or False
+        self.bundle_cache = kwargs.get('bundle_cache') or False
+        self.delta_upload = kwargs.get('delta_upload') or False
+        self.facts_ttl = kwargs['facts_ttl'] if kwargs.get('facts_ttl') is not None else self.DEFAULT_FACTS_TTL
+        self.notifications = kwargs.get('notifications') or self.DEFAULT_NOTIFICATIONS
+        self.apt_source_list = kwargs.get('apt_source_list')
+        self.keep_releases = kwargs.get('keep_releases')
+        self.release_max_age = kwargs.get('release_max_age')
+        self.apt_update_max_age = kwargs.get('apt_update_max_age') or self.DEFAULT_APT_UPDATE_MAX_AGE
+        self.readiness = kwargs.get('readiness')
+        self.restart_strategy = kwargs.get('restart_strategy') or self.DEFAULT_RESTART_STRATEGY
+        self.restart_command = kwargs.get('restart_command')
         self.use_init = False
         self.use_upstart = True
 
@@ -83,7 +107,11 @@ class ServiceConfig(GlobalConfig):
 
         # Attrs that are simply set if they are present
         simple_attrs = ['bundle_type', 'project_type', 'cwd', 'classifier', 'nexus_user', 'nexus_host', 'nexus_port',
-                        'nexus_repository', 'graphite_host', 'slack_url', 'slack_emoji']
+                        'nexus_repository', 'graphite_host', 'slack_url', 'slack_emoji', 'parallel',
+                        'batch_size', 'max_unavailable', 'batch_pause', 'upload_relay', 'relay_seeds',
+                        'artifact_proxy', 'bundle_cache', 'delta_upload', 'facts_ttl', 'notifications',
+                        'apt_source_list', 'apt_update_max_age', 'keep_releases', 'release_max_age',
+                        'readiness', 'restart_strategy', 'restart_command']
         for attr in simple_attrs:
             if dict_config.get(attr):
                 setattr(config, attr, dict_config[attr])
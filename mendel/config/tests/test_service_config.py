@@ -68,3 +68,8 @@ class ServiceConfigTests(TestCase):
             self.assertEqual(host_configs[1].port, 22)
             self.assertEqual(set(host_configs[1].hosts), {'dev-123'})
             self.assertEqual(set(config.available_host_groups.keys()), {'stage', 'prod'})
+
+    def test_facts_ttl(self, arg_parser):
+        self.assertEqual(ServiceConfig(service_name='hello-world').facts_ttl, ServiceConfig.DEFAULT_FACTS_TTL)
+        # 0 means always detect the host's facts again, not the default
+        self.assertEqual(ServiceConfig(service_name='hello-world', facts_ttl=0).facts_ttl, 0)
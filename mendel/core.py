@@ -18,6 +18,7 @@ from .deployer.jar import JarDeployer
 from .deployer.remote_deb import RemoteDebDeployer
 from .deployer.remote_jar import RemoteJarDeployer
 from .deployer.tgz import TarballDeployer
+from .executor import FleetTask
 
 
 class Mendel(object):
@@ -55,10 +56,12 @@ class Mendel(object):
     tasks property to instantiate all of them
     """
 
-    def __init__(self, config, hosts=None):
+    def __init__(self, config, hosts=None, refresh_facts=False):
         super().__init__()
         self.bundle_type = config.bundle_type
         self.deployer = self.DEPLOYER_MAP[self.bundle_type](service_name=config.service_name, config=config)
+        # Detect facts about the hosts (e.g. init system) again, rather than using what's cached
+        self.deployer.facts.refresh = refresh_facts
         # Define target hosts
         # Option a) provide hosts in the constructor
         self.hosts = hosts
@@ -104,18 +107,25 @@ class Mendel(object):
     def tasks(self):
         """
         Generate Fabric Task instances for each of the Mendel functionalities
+        Fleet methods are handed all of the hosts at once, the rest run once per host.
         :return: list of Task instances
         """
+        fleet_methods = [
+            self.deployer.deploy,
+            self.deployer.rollback,
+            self.deployer.stage,
+            self.deployer.activate,
+        ]
         methods = [
             self.deployer.upload,
-            self.deployer.deploy,
             self.deployer.install,
             self.deployer.build,
             self.deployer.tail,
-            self.deployer.rollback,
             self.deployer.service_wrapper,
-            self.deployer.link_latest_release
+            self.deployer.link_latest_release,
+            self.deployer.prune
         ]
 
         # todo do we need to cd into cwd on each of theses tasks?
-        return [Task(hosts=self.hosts, body=m) for m in methods]
+        return [FleetTask(hosts=self.hosts, body=m) for m in fleet_methods] + \
+            [Task(hosts=self.hosts, body=m) for m in methods]
@@ -0,0 +1,137 @@
+"""
+Serve an artifact from nexus to many hosts while only downloading it from nexus once.
+The artifact is downloaded to the deploying machine, checked against the sha1 nexus publishes for it,
+and served over http on localhost; hosts reach it through an ssh reverse tunnel.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+from mendel.util.colors import blue
+from mendel.util.colors import yellow
+from mendel.util.misc import mendel_dir
+from mendel.util.misc import sha256_of
+
+
+class ArtifactProxyError(Exception):
+    """
+    raised when the artifact can't be downloaded from nexus, or doesn't match its checksum
+    """
+    pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ArtifactProxy(object):
+    """
+    Downloads an artifact once, and serves it to hosts over http
+
+        proxy = ArtifactProxy(url)
+        proxy.start()
+        with connection.forward_remote(proxy.port, local_port=proxy.port):
+            connection.run(f'wget http://127.0.0.1:{proxy.port}/{proxy.name}')
+        proxy.stop()
+
+    Downloads are kept in ~/.mendel/artifacts, so released artifacts aren't downloaded again by later deploys.
+    """
+    CHUNK_SIZE = 1024 * 1024
+    DEFAULT_TIMEOUT = 30
+
+    def __init__(self, url, cache_dir=None, timeout=None):
+        super().__init__()
+        self.url = url
+        self.name = url.rstrip('/').split('/')[-1]
+        self.cache_dir = cache_dir or mendel_dir('artifacts')
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self.path = os.path.join(self.cache_dir, self.name)
+        self.sha256 = None
+        self._server = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1] if self._server else None
+
+    def start(self):
+        """
+        Download the artifact (unless a verified copy of a release is already cached) and start serving it
+        :return: nothing
+        :raises ArtifactProxyError: if it couldn't be downloaded or verified
+        """
+        if 'SNAPSHOT' in self.name or not os.path.isfile(self.path):
+            self._download()
+        self.sha256 = sha256_of(self.path)
+
+        path, name = self.path, self.name
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.lstrip('/') != name:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/java-archive')
+                self.send_header('Content-Length', str(os.path.getsize(path)))
+                self.end_headers()
+                with open(path, 'rb') as f:
+                    shutil.copyfileobj(f, self.wfile)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Server(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print(blue(f'Serving {self.name} to hosts from port {self.port}'))
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def _download(self):
+        """
+        Download the artifact next to where it's kept, check it, and only then move it into place
+        """
+        print(blue(f'Downloading {self.url} once for all hosts'))
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix='.' + self.name)
+        digest = hashlib.sha1()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                with requests.get(self.url, stream=True, timeout=self.timeout) as resp:
+                    resp.raise_for_status()
+                    for chunk in resp.iter_content(self.CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+            expected = self._published_sha1()
+            if expected and expected != digest.hexdigest():
+                raise ArtifactProxyError(f'{self.name} from nexus does not match its sha1 '
+                                         f'({digest.hexdigest()} != {expected})')
+            os.replace(tmp_path, self.path)
+        except requests.RequestException as e:
+            raise ArtifactProxyError(f'unable to download {self.url}: {e}')
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _published_sha1(self):
+        """
+        :return: str hex sha1 digest nexus publishes next to the artifact, or None if it doesn't
+        """
+        try:
+            resp = requests.get(self.url + '.sha1', timeout=self.timeout)
+        except requests.RequestException:
+            resp = None
+        if resp is None or resp.status_code != 200 or not resp.text.strip():
+            print(yellow(f'No sha1 published for {self.name}, unable to verify it'))
+            return None
+        return resp.text.split()[0].strip().lower()
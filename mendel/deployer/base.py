@@ -1,38 +1,106 @@
 import datetime
+import json
 import os
+import shlex
 import sys
+import threading
+import time
+from functools import partial
 
 from patchwork.files import exists
 
 from mendel.config.service_config import ServiceConfig
-from mendel.deployer.tracking.api import track_event_api
-from mendel.deployer.tracking.graphite import track_event_graphite
-from mendel.deployer.tracking.slack import track_event_slack
+from mendel.deployer.fleet import HostResult
+from mendel.deployer.fleet import as_connections
+from mendel.deployer.fleet import print_host_results
+from mendel.deployer.fleet import run_on_hosts
+from mendel.deployer.fleet import run_rolling
+from mendel.deployer.plan import DeploymentPlan
+from mendel.deployer.delta import rsync_file
+from mendel.deployer.artifact_proxy import ArtifactProxy
+from mendel.deployer.artifact_proxy import ArtifactProxyError
+from mendel.deployer.facts import HostFacts
+from mendel.deployer.manifest import MANIFEST_NAME
+from mendel.deployer.manifest import ReleaseManifest
+from mendel.deployer.manifest import read_command
+from mendel.deployer.manifest import write_command
+from mendel.deployer.readiness import ReadinessProbe
+from mendel.deployer.readiness import parse_wait
+from mendel.deployer.relay import RelayError
+from mendel.deployer.relay import relay_file
+from mendel.deployer.restart import RESTART_MARKER
+from mendel.deployer.restart import measured_command
+from mendel.deployer.restart import parse_restart
+from mendel.deployer.restart import restart_command
+from mendel.deployer.retention import cached_to_prune
+from mendel.deployer.retention import list_command
+from mendel.deployer.retention import parse_cached
+from mendel.deployer.retention import parse_listing
+from mendel.deployer.retention import prune_command
+from mendel.deployer.retention import releases_to_prune
+from mendel.deployer.script import RemoteScriptError
+from mendel.deployer.script import print_step_results
+from mendel.deployer.tracking.dispatcher import TrackingDispatcher
 from mendel.util.colors import blue
 from mendel.util.colors import green
 from mendel.util.colors import magenta
 from mendel.util.colors import red
+from mendel.util.colors import yellow
+from mendel.util.git import GitMetadataError
+from mendel.util.git import SHORT_HASH_LENGTH
+from mendel.util.git import git_metadata
+from mendel.util.misc import sha256_of
+from mendel.util.trace import tracer
 
 
 class Deployer(object):
     INSTALL_SUCCESS_MESSAGE = "Successfully installed new release of %s service"
     UPLOAD_SUCCESS_MESSAGE = "Uploaded new release of %s to %s"
+    # keep a manifest of the release dirs on each host. only for deployers with SymlinkRollbackMixin
+    RELEASE_MANIFEST = False
 
     def __init__(self, service_name: str = None, config: ServiceConfig = None):
         assert service_name or getattr(config, 'service_name')
         self.config = config
         self._already_built = False
-        self.project_version = None
+        self.project_version = None  # the version asked for, if any. what's actually deployed is in the plan
+        self.plan = None
+        self._relayed_hosts = set()
+        self._cutting_over = set()  # hosts a deploy is installing on, which record the release once restarted
+        self._artifact_proxy = None  # serves the artifact to hosts, rather than each of them downloading it
+        self._bundle_checksums = {}
+        self._bytes_saved = 0
+        self._lock = threading.RLock()  # guards work that happens once per run, when deploying to many hosts at once
+        self.facts = HostFacts(ttl=config.facts_ttl if config else None)
+        self.readiness = ReadinessProbe.from_config(config) if config else None
+        self._ready_times = {}  # host to how many seconds the service took to be ready after its last restart
+        self._unavailable_times = {}  # host to how many seconds the service was unavailable for during its restart
+        self.tracker = TrackingDispatcher()
+        self._summarizing = False  # send one summary of the deploy, rather than an event per host
 
     def already_built(self, connection):
         # so we dont build multiple times for each host we're deploying to.
         return self._already_built
 
     # Common deployment path
-    def deploy(self, connection, version=None):
+    def deploy(self, connection, version=None, parallel=None, batch_size=None, max_unavailable=None,
+               batch_pause=None, relay=False, proxy=False):
         """
         [core]\t\tbuilds, installs, and deploys to all the specified hosts
+        :param connection: Connection, or Group of Connections to deploy to all of them at once
+        :param version: str version to deploy instead of the current working version
+        :param parallel: int number of hosts to deploy to concurrently. defaults to `parallel` in mendel.yml, or 1
+        :param batch_size: str hosts per batch for a rolling deploy, as a count or percentage (e.g. `25%`)
+        :param max_unavailable: str most hosts allowed to be down at once in a rolling deploy, count or percentage
+        :param batch_pause: float seconds to wait between batches of a rolling deploy
+        :param relay: bool upload the bundle once, and have the hosts copy it to each other
+        :param proxy: bool download the artifact from nexus once, and serve it to the hosts through ssh tunnels
+        All of these default to their values in mendel.yml
         """
+        start = time.time()
+        connections = as_connections(connection)
+        connection = connections[0]
+
         # this is checked upstream when mendel is initialized. But, sanity check again
         if not connection.host:
             self._log_error_and_exit(connection,
@@ -53,11 +121,384 @@ class Deployer(object):
             self._log_error_and_exit(connection,
                                      message='Graphite host is not present in mendel configuration or is not responsive')
 
-        self.build(connection)
-        self.upload(connection)  # Polymorphic, done in subclasses
-        self.install(connection)  # Polymorphic, done in subclasses
-        self._start_or_restart(connection)
-        self._track_event(connection, event='deployed')
+        with tracer.span('build'):
+            self.build(connection)  # only once, no matter how many hosts
+        with tracer.span('plan'):
+            self._get_plan(connection)  # work out what's being deployed before any host needs to know
+        self._distribute_bundle(connections, relay=relay, proxy=proxy)
+
+        parallel = parallel or self.config.parallel
+        batch_size = batch_size or self.config.batch_size
+        self._summarizing = self.config.notifications == 'summary'
+        if batch_size:
+            # uploading doesn't affect availability, so get it out of the way before rolling through the batches
+            results = run_on_hosts(connections, self.upload, parallel=parallel)
+            if all(r.ok for r in results):
+                results = run_rolling(connections, self._cut_over_host,
+                                      batch_size=batch_size,
+                                      max_unavailable=max_unavailable or self.config.max_unavailable,
+                                      pause=float(batch_pause or self.config.batch_pause or 0),
+                                      gate=self._is_ready)
+        else:
+            results = run_on_hosts(connections, self._deploy_to_host, parallel=parallel)
+
+        if self._artifact_proxy:
+            self._artifact_proxy.stop()
+            self._artifact_proxy = None
+        if self.config.keep_releases or self.config.release_max_age:
+            # old releases are cleaned up only where the deploy worked, so there's always something to go back to
+            deployed = [c for c, r in zip(connections, results) if r.ok]
+            with tracer.span('prune'):
+                run_on_hosts(deployed, self._prune_releases, parallel=len(deployed) or 1)
+        if self._summarizing:
+            self._summarizing = False
+            self._track_summary(connection, 'deployed', results, time.time() - start)
+        if len(results) > 1:
+            print_host_results(results)
+        if self._bytes_saved:
+            print(green(f'Saved uploading {self._bytes_saved / 1024 / 1024:.1f}MB of bundles'))
+        if not all(r.ok for r in results):
+            sys.exit(1)
+
+    def _deploy_to_host(self, connection):
+        """
+        The per-host phases of a deploy, run once the build is done
+        :param connection: Connection
+        :return: nothing
+        """
+        with tracer.span('upload', host=connection.host):
+            self.upload(connection)  # Polymorphic, done in subclasses
+        self._cut_over_host(connection)
+
+    def _distribute_bundle(self, connections, relay=False, proxy=False):
+        """
+        Relay the bundle between the hosts and/or serve them the artifact through a local proxy,
+        as asked for or set in mendel.yml. Neither is worth it for a single host.
+        :param connections: list of Connections
+        :param relay: bool upload the bundle once, and have the hosts copy it to each other
+        :param proxy: bool download the artifact from nexus once, and serve it to the hosts through ssh tunnels
+        :return: nothing
+        """
+        if (relay or self.config.upload_relay) and len(connections) > 1:
+            with tracer.span('relay'):
+                self._relay_bundle(connections)
+        if (proxy or self.config.artifact_proxy) and len(connections) > 1:
+            with tracer.span('artifact proxy'):
+                self._start_artifact_proxy(connections[0])
+
+    def _relay_bundle(self, connections):
+        """
+        Get the bundle onto all of the hosts while only uploading it to `relay_seeds` of them.
+        Hosts it couldn't be relayed to have it uploaded as usual.
+        :param connections: list of Connections
+        :return: nothing
+        """
+        try:
+            local_path = self._get_local_bundle_path(connections[0], self._get_plan(connections[0]).bundle_name)
+        except NotImplementedError:
+            print(yellow(f'{self.config.bundle_type} bundles are not uploaded by mendel, nothing to relay'))
+            return
+        try:
+            hosts = relay_file(connections, local_path, self._tpath(), seeds=self.config.relay_seeds)
+        except RelayError as e:
+            self._log_error_and_exit(connections[0], str(e))
+        self._relayed_hosts.update(hosts)
+
+    def _start_artifact_proxy(self, connection):
+        """
+        Download the artifact the hosts would each download from nexus once, and serve it to them instead
+        :param connection: Connection
+        :return: nothing
+        """
+        url = self._get_plan(connection).artifact_url
+        if not url:
+            print(yellow(f'{self.config.bundle_type} bundles are not downloaded from nexus, nothing to proxy'))
+            return
+        proxy = ArtifactProxy(url)
+        try:
+            proxy.start()
+        except ArtifactProxyError as e:
+            self._log_error_and_exit(connection, str(e))
+        self._artifact_proxy = proxy
+
+    def _put_bundle(self, connection, local_path):
+        """
+        Put the bundle into the remote temp dir, unless it was already relayed there,
+        or (with `bundle_cache` on) the host already has a copy of the exact same bundle.
+        With `delta_upload` on, only the parts that changed since the current release are uploaded.
+        :param connection: Connection
+        :param local_path: str path to the local bundle
+        :return: str path to the remote bundle
+        """
+        remote_path = self._tpath(os.path.basename(local_path))
+        if connection.host in self._relayed_hosts:
+            print(blue(f'{os.path.basename(local_path)} was already relayed to {connection.host}'))
+            self._count_bytes_saved(local_path)
+        elif self.config.bundle_cache and self._restore_bundle_from_cache(connection, local_path, remote_path):
+            print(blue(f'{os.path.basename(local_path)} was already cached on {connection.host}'))
+            self._count_bytes_saved(local_path)
+            return remote_path
+        elif not (self.config.delta_upload and self._put_bundle_delta(connection, local_path, remote_path)):
+            connection.put(local_path, self._tpath())
+
+        if self.config.bundle_cache:
+            self._add_bundle_to_cache(connection, local_path, remote_path)
+        return remote_path
+
+    def _count_bytes_saved(self, local_path, bytes_sent=0):
+        """
+        Keep track of how much we didn't have to upload
+        :param local_path: str path to the local bundle that didn't have to be uploaded in full
+        :param bytes_sent: int how much was uploaded instead
+        :return: nothing
+        """
+        with self._lock:
+            self._bytes_saved += max(os.path.getsize(local_path) - bytes_sent, 0)
+
+    def _put_bundle_delta(self, connection, local_path, remote_path):
+        """
+        Upload only the blocks of the bundle that differ from the bundle in the current release
+        :param connection: Connection
+        :param local_path: str path to the local bundle
+        :param remote_path: str path to put the bundle on the remote host
+        :return: bool whether the bundle was uploaded. if not, it needs to be uploaded in full
+        """
+        try:
+            base_path = self._get_delta_base(connection)
+            if not base_path:
+                return False
+            bytes_sent = rsync_file(connection, local_path, base_path, remote_path)
+        except Exception as e:
+            print(yellow(f'Unable to delta upload to {connection.host} ({e}), uploading the whole bundle'))
+            return False
+        print(blue(f'Delta uploaded {os.path.basename(local_path)} to {connection.host}, sent {bytes_sent} bytes'))
+        self._count_bytes_saved(local_path, bytes_sent)
+        return True
+
+    def _get_delta_base(self, connection):
+        """
+        Deployers which support delta uploads of their bundle say which file on the remote host to start from
+        :param connection: Connection
+        :return: str path to the remote file, or None if delta uploads aren't supported
+        """
+        return None
+
+    def _bundle_cache_path(self, local_path):
+        """
+        Bundles are cached on the remote hosts by their sha256, so the same bytes are never uploaded twice
+        :param local_path: str path to the local bundle
+        :return: str path to where the bundle is cached on remote hosts
+        """
+        return self._rpath('releases', '.cache', self._bundle_checksum(local_path))
+
+    def _bundle_checksum(self, local_path):
+        """
+        :param local_path: str path to the local bundle
+        :return: str hex sha256 digest of the bundle, from the plan if it's the bundle being deployed
+        """
+        plan = self.plan
+        if plan and os.path.basename(local_path) in plan.checksums:
+            return plan.checksums[os.path.basename(local_path)]
+        with self._lock:
+            if local_path not in self._bundle_checksums:
+                self._bundle_checksums[local_path] = sha256_of(local_path)
+        return self._bundle_checksums[local_path]
+
+    def _restore_bundle_from_cache(self, connection, local_path, remote_path):
+        """
+        Copy the bundle out of the remote bundle cache, in one round trip. It's copied rather than hard linked,
+        the cached bundle belonging to the service user rather than whoever we ssh in as.
+        :param connection: Connection
+        :param local_path: str path to the local bundle
+        :param remote_path: str path to put the bundle on the remote host
+        :return: bool whether the bundle was in the cache
+        """
+        cached = self._bundle_cache_path(local_path)
+        result = connection.run(f'cp {cached} {remote_path} 2>/dev/null && echo hit || echo miss',
+                                hide='both', warn=True)
+        return result.stdout.strip() == 'hit'
+
+    def _add_bundle_to_cache(self, connection, local_path, remote_path):
+        """
+        Copy an uploaded bundle into the remote bundle cache
+        :param connection: Connection
+        :param local_path: str path to the local bundle
+        :param remote_path: str path to the uploaded bundle on the remote host
+        :return: nothing
+        """
+        cached = self._bundle_cache_path(local_path)
+        connection.sudo(f'mkdir -p {os.path.dirname(cached)} && cp {remote_path} {cached}',
+                        user=self.config.user, hide='both', warn=True)
+
+    def _cut_over_host(self, connection):
+        """
+        The per-host phases of a deploy that affect the running service
+        :param connection: Connection
+        :return: nothing
+        """
+        with self._lock:
+            self._cutting_over.add(connection.host)
+        try:
+            with tracer.span('install', host=connection.host):
+                self.install(connection)  # Polymorphic, done in subclasses
+        finally:
+            with self._lock:
+                self._cutting_over.discard(connection.host)
+        ok = False
+        try:
+            self._start_or_restart(connection)
+            ok = True
+        finally:
+            self._record_release(connection, ok=ok)
+        if not self._summarizing:
+            self._track_event(connection, event='deployed')
+
+    def stage(self, connection, version=None, parallel=None, relay=False, proxy=False):
+        """
+        [core]\t\tputs a new release on all the hosts, ready to `activate`, without touching the running service
+        :param connection: Connection, or Group of Connections
+        :param version: str version to stage instead of the current working version
+        :param parallel: int number of hosts to stage on concurrently, all of them if not given
+        :param relay: bool upload the bundle once, and have the hosts copy it to each other
+        :param proxy: bool download the artifact from nexus once, and serve it to the hosts through ssh tunnels
+        """
+        connections = as_connections(connection)
+        connection = connections[0]
+        if not self.RELEASE_MANIFEST:
+            self._log_error_and_exit(connection, f'{self.config.bundle_type} releases can\'t be staged')
+
+        if version and version.strip():
+            self.project_version = version.strip()
+            print("Version was set to be %s." % self.project_version)
+
+        with tracer.span('build'):
+            self.build(connection)  # only once, no matter how many hosts
+        with tracer.span('plan'):
+            plan = self._get_plan(connection)
+        self._distribute_bundle(connections, relay=relay, proxy=proxy)
+
+        # staging doesn't affect the running service, so every host can do it at once
+        results = run_on_hosts(connections, self._stage_host, parallel=parallel or len(connections))
+
+        if self._artifact_proxy:
+            self._artifact_proxy.stop()
+            self._artifact_proxy = None
+        if len(results) > 1:
+            print_host_results(results)
+        if not all(r.ok for r in results):
+            sys.exit(1)
+        print(green(f'Staged {plan.release_dir}, `activate` to switch {self.config.service_name} over to it'))
+
+    def _stage_host(self, connection):
+        """
+        Upload and unpack the release on one host, and record it as staged in the host's manifest
+        :param connection: Connection
+        :return: nothing
+        """
+        with tracer.span('upload', host=connection.host):
+            self.upload(connection)  # Polymorphic, done in subclasses
+        with tracer.span('stage', host=connection.host):
+            self._stage_release(connection)
+        self._record_release(connection, ok=None, staged=True)
+
+    def activate(self, connection, release=None, parallel=None, batch_size=None, max_unavailable=None,
+                 batch_pause=None):
+        """
+        [core]\t\tswitches all the hosts over to a release put there by `stage`, and restarts the service
+        :param connection: Connection, or Group of Connections
+        :param release: str name of the staged release, the latest one staged on the first host if not given
+        :param parallel: int number of hosts to switch over concurrently. defaults to `parallel` in mendel.yml, or 1
+        :param batch_size: str hosts per batch for a rolling switch over, as a count or percentage (e.g. `25%`)
+        :param max_unavailable: str most hosts allowed to be down at once in a rolling switch over
+        :param batch_pause: float seconds to wait between batches of a rolling switch over
+        All of these default to their values in mendel.yml, as they do for `deploy`
+        """
+        start = time.time()
+        connections = as_connections(connection)
+        connection = connections[0]
+        manifests = {}
+
+        def read_manifest(host_connection):
+            manifests[host_connection.host] = self._read_manifest(host_connection)
+
+        run_on_hosts(connections, read_manifest, parallel=len(connections))
+        release = release or (manifests.get(connection.host) and manifests[connection.host].latest_staged())
+        if not release:
+            self._log_error_and_exit(connection, f'Nothing is staged on {connection.host}, run `stage` first')
+
+        # every host is checked before any of them is switched over
+        print(blue(f'Checking {release} is staged on every host'))
+        results = run_on_hosts(connections, partial(self._check_staged, release=release, manifests=manifests),
+                               parallel=len(connections))
+        if not all(r.ok for r in results):
+            print_host_results(results)
+            self._log_error_and_exit(connection, f'{release} is not staged on every host, not activating it')
+
+        # events report what was staged, not what the local checkout is at now
+        staged = manifests[connection.host].get(release)
+        self.plan = DeploymentPlan(version=staged.get('version'), commit_hash=staged.get('commit'),
+                                   release_dir=release)
+
+        activate_host = partial(self._activate_host, release=release, manifests=manifests)
+        batch_size = batch_size or self.config.batch_size
+        self._summarizing = self.config.notifications == 'summary'
+        if batch_size:
+            results = run_rolling(connections, activate_host,
+                                  batch_size=batch_size,
+                                  max_unavailable=max_unavailable or self.config.max_unavailable,
+                                  pause=float(batch_pause or self.config.batch_pause or 0),
+                                  gate=self._is_ready)
+        else:
+            results = run_on_hosts(connections, activate_host, parallel=parallel or self.config.parallel)
+
+        if self._summarizing:
+            self._summarizing = False
+            self._track_summary(connection, 'deployed', results, time.time() - start)
+        if len(results) > 1:
+            print_host_results(results)
+        if not all(r.ok for r in results):
+            sys.exit(1)
+        print(green(f'Activated {release} in {time.time() - start:.1f}s'))
+
+    def _check_staged(self, connection, release, manifests):
+        """
+        Make sure a staged release is all there on a host before switching over to it
+        :param connection: Connection
+        :param release: str name of the staged release
+        :param manifests: dict of host to the host's ReleaseManifest
+        :return: nothing
+        """
+        manifest = manifests.get(connection.host)
+        entry = manifest and manifest.get(release)
+        if not entry:
+            raise Exception(f'{release} was not staged on {connection.host}')
+        command = self._staged_check_command(self._rpath('releases', release), entry)
+        result = connection.sudo(f'bash -c {shlex.quote(command)}', user=self.config.user, hide='both', warn=True)
+        if result.failed:
+            raise Exception(f'{release} is incomplete on {connection.host}')
+
+    def _activate_host(self, connection, release, manifests):
+        """
+        Switch one host over to a staged release, and restart the service on it
+        :param connection: Connection
+        :param release: str name of the staged release
+        :param manifests: dict of host to the host's ReleaseManifest
+        :return: nothing
+        """
+        release_path = self._rpath('releases', release)
+        with tracer.span('activate', host=connection.host):
+            self._change_symlink_to(connection, self._release_link_target(connection, release_path))
+        ok = False
+        try:
+            self._start_or_restart(connection)
+            ok = True
+        finally:
+            manifest = manifests[connection.host]
+            manifest.activate(release, ok=ok, ready_seconds=self._ready_times.get(connection.host),
+                              unavailable_seconds=self._unavailable_times.get(connection.host))
+            self._write_manifest(connection, manifest)
+        if not self._summarizing:
+            self._track_event(connection, event='deployed')
 
     def build(self, connection):
         """
@@ -85,12 +526,13 @@ class Deployer(object):
             else:
                 raise Exception(f"Unsupported project type: {self.config.project_type}")
             self._already_built = True
-            track_event_slack(slack_url=self.config.slack_url,
-                              slack_emoji=self.config.slack_emoji,
-                              event='built',
-                              service_name=self.config.api_service_name or self.config.service_name,
-                              deployment_host=connection.host,
-                              deployment_user=self.config.user)
+            self.tracker.submit('slack',
+                                slack_url=self.config.slack_url,
+                                slack_emoji=self.config.slack_emoji,
+                                event='built',
+                                service_name=self.config.api_service_name or self.config.service_name,
+                                deployment_host=connection.host,
+                                deployment_user=self.config.user)
 
     # Interface
 
@@ -103,15 +545,63 @@ class Deployer(object):
         """
         raise NotImplementedError("Must be implemented in subclasses")
 
-    def rollback(self, connection):
+    def rollback(self, connection, to=None, parallel=None):
         """
         [core]\t\tchoose a version to rollback to from all available releases
+        :param connection: Connection, or Group of Connections
+        :param to: str `previous` or a release, to roll every host back to it without asking
+        :param parallel: int number of hosts to roll back at once with `to`
         """
         raise NotImplementedError("Must be implemented in subclasses")
 
     def _get_bundle_name(self, connection):
         raise NotImplementedError("Must be implemented in subclasses")
 
+    def _stage_release(self, connection):
+        """
+        Put an uploaded release in place on the host, doing everything install does short of linking it into current.
+        Only needed for deployers that keep a manifest of their releases.
+        :param connection: Connection
+        :return: nothing
+        """
+        raise NotImplementedError("Must be implemented in subclasses")
+
+    def _staged_check_command(self, release_path, entry):
+        """
+        :param release_path: str path to the staged release dir
+        :param entry: dict entry for the release in the host's manifest
+        :return: str command which fails unless the staged release is all there
+        """
+        return f'test -d {release_path}'
+
+    @staticmethod
+    def _jar_check_command(jar_path, checksum=None):
+        """
+        :param jar_path: str path to a staged jar
+        :param checksum: str hex sha256 digest the jar must have, if known
+        :return: str command which fails unless the jar is there, and matches the checksum
+        """
+        command = f'test -s {jar_path}'
+        if checksum:
+            command += f' && echo {shlex.quote(f"{checksum}  {jar_path}")} | sha256sum -c --quiet'
+        return command
+
+    def _release_link_target(self, connection, release_path):
+        """
+        :param connection: Connection
+        :param release_path: str path to a release dir
+        :return: str path `current` is linked to for the release
+        """
+        return release_path
+
+    def _get_local_bundle_path(self, connection, bundle_name=None):
+        """
+        :param connection: Connection
+        :param bundle_name: str file name of the bundle, looked up if not given
+        :return: str path to the bundle that was built locally
+        """
+        return self._lpath(self.config.build_target_path, bundle_name or self._get_bundle_name(connection))
+
     # common/shared methods
 
     def tail(self, connection, log_name="output.log"):
@@ -138,17 +628,8 @@ class Deployer(object):
             print(red('unknown command, try one of %s' % ','.join(allowed)))
             sys.exit(1)
 
-        linux_version = 0.0
-        try:
-            release = connection.run('lsb_release -a | grep Release', hide='both')
-            linux_args = release.stdout.split()
-            linux_version = float(linux_args[1])
-            service_mgmt = 'systemd' if linux_version >= 16 else 'upstart'
-            print(f"Linux version is {linux_version}, using {service_mgmt}")
-        except Exception as e:
-            print(f"Unable to determine linux version ({str(e)}), assuming `upstart`")
-
-        if linux_version >= 16:
+        service_mgmt = self._init_system(connection)
+        if service_mgmt == 'systemd':
             if print_output:
                 print(blue(f'executing systemd:{cmd}'))
             result = connection.run(f"sudo systemctl {cmd} {self.config.service_name} --no-pager",
@@ -165,15 +646,143 @@ class Deployer(object):
             print(green(out))
         return out
 
+    def _init_system(self, connection):
+        """
+        :param connection: Connection
+        :return: str init system of the remote host, systemd or upstart
+        """
+        try:
+            return self.facts.get(connection)['init_system']
+        except Exception as e:
+            print(f"Unable to determine linux version ({str(e)}), assuming `upstart`")
+            return 'upstart'
+
     def link_latest_release(self, connection):
         """
         [advanced]\t"Cowboy" deploy - switch symlink of release folder to the most recent one
         :param: connection: Connection
         :return: nothing
         """
-        release_dir = self._get_latest_release(connection)
+        manifest = self._read_manifest(connection)
+        release_dir = manifest and manifest.latest_ok() or self._get_latest_release(connection)
         print(green("Linking release %s into current" % magenta(release_dir)))
         self._change_symlink_to(connection, self._rpath('releases', release_dir))
+        if manifest:
+            manifest.current = release_dir
+            self._write_manifest(connection, manifest)
+
+    def prune(self, connection):
+        """
+        [advanced]\t delete old releases, keeping `keep_releases` and those newer than `release_max_age`
+        :param connection: Connection
+        :return: nothing
+        """
+        if not (self.config.keep_releases or self.config.release_max_age):
+            self._log_error_and_exit(connection, 'set keep_releases and/or release_max_age in mendel.yml to prune')
+        self._prune_releases(connection)
+
+    def _prune_releases(self, connection):
+        """
+        Delete the releases the retention policy doesn't keep from the host.
+        The current release and the one before it are always kept. So are the cached bundles of the releases
+        that are kept, if the host has a manifest to tell which ones those are.
+        :param connection: Connection
+        :return: list of str names of the releases being deleted
+        """
+        releases_dir, current_link = self._rpath('releases'), self._rpath('current')
+        result = connection.sudo(list_command(releases_dir, current_link), hide='both', warn=True)
+        current, releases = parse_listing(result.stdout)
+        names = releases_to_prune(releases, current,
+                                  keep=self.config.keep_releases, max_age=self.config.release_max_age)
+        manifest = self._read_manifest(connection)
+        used = None
+        if manifest:
+            kept = {name for name, _ in releases} - set(names)
+            used = {r.get('checksum') for r in manifest.releases if r['name'] in kept}
+        cached = cached_to_prune(parse_cached(result.stdout), used=used,
+                                 keep=self.config.keep_releases, max_age=self.config.release_max_age)
+        if not (names or cached):
+            return names
+        if names:
+            print(blue(f'[{connection.host}] deleting {len(names)} old release(s), '
+                       f'keeping {len(releases) - len(names)}'))
+        if cached:
+            print(blue(f'[{connection.host}] deleting {len(cached)} cached bundle(s) no kept release uses'))
+        pruned = connection.sudo(prune_command(releases_dir, current_link, names, cached=cached),
+                                 hide='both', warn=True)
+        if pruned.failed:
+            print(yellow(f'[{connection.host}] unable to delete some old releases: '
+                         f'{(pruned.stderr or pruned.stdout).strip()}'))
+        if names and manifest:
+            manifest.remove(names)
+            self._write_manifest(connection, manifest)
+        return names
+
+    def _read_manifest(self, connection):
+        """
+        :param connection: Connection
+        :return: ReleaseManifest of the releases on the host, None if it doesn't have one
+                 (or this bundle type doesn't keep one)
+        """
+        if not self.RELEASE_MANIFEST:
+            return None
+        result = connection.sudo(read_command(self._rpath(MANIFEST_NAME)), user=self.config.user,
+                                 hide='both', warn=True)
+        return ReleaseManifest.parse(result.stdout)
+
+    def _write_manifest(self, connection, manifest):
+        """
+        Replace the host's manifest. The manifest is only an index, so failing to write it is not an error.
+        :param connection: Connection
+        :param manifest: ReleaseManifest
+        :return: nothing
+        """
+        result = connection.sudo(write_command(self._rpath(MANIFEST_NAME), manifest), user=self.config.user,
+                                 hide='both', warn=True)
+        if result.failed:
+            print(yellow(f'[{connection.host}] unable to update {MANIFEST_NAME}: {result.stderr.strip()}'))
+
+    def _record_release(self, connection, ok, staged=False):
+        """
+        Add the release just deployed to the host's manifest, as the current release
+        :param connection: Connection
+        :param ok: bool whether the service was restarted on it
+        :param staged: bool the release was only staged, and isn't current yet
+        :return: nothing
+        """
+        if not self.RELEASE_MANIFEST:
+            return
+        plan = self._get_plan(connection)
+        manifest = self._read_manifest(connection)
+        if manifest is None:
+            # start the manifest off with the releases that are already there
+            existing = self._get_all_releases(connection)
+            manifest = ReleaseManifest(releases=[dict(name=name, ok=None) for name in existing])
+        checksum = plan.checksums.get(plan.bundle_name) if plan.bundle_name else None
+        if self._artifact_proxy:
+            checksum = self._artifact_proxy.sha256
+        size = None
+        if plan.bundle_name:
+            local_path = self._get_local_bundle_path(connection, plan.bundle_name)
+            size = os.path.getsize(local_path) if os.path.isfile(local_path) else None
+        manifest.record(plan.release_dir, version=plan.version, commit=plan.commit_hash, checksum=checksum,
+                        size=size, ok=ok, staged=staged, ready_seconds=self._ready_times.get(connection.host),
+                        unavailable_seconds=self._unavailable_times.get(connection.host))
+        if not staged:
+            manifest.current = plan.release_dir
+        self._write_manifest(connection, manifest)
+
+    def _record_install(self, connection):
+        """
+        `install` on its own links the release into current, so the host's manifest has to say so.
+        A deploy records the release after restarting the service on it instead.
+        :param connection: Connection
+        :return: nothing
+        """
+        with self._lock:
+            if connection.host in self._cutting_over:
+                return
+        self._record_release(connection, ok=None)
 
     def _get_latest_release(self, connection):
         """
@@ -187,18 +796,81 @@ class Deployer(object):
     def _start_or_restart(self, connection):
         """
         Start service on the remote host
-        If already started, stop it first, then start it.
+        If already started, restart it the way `restart_strategy` (or `restart_command`) in mendel.yml says to.
+        With readiness probes configured, wait for it to be ready, within their deadline counted from the restart.
         :param connection: Connection
         :return: nothing
         """
-        if self.config.use_init or self.config.use_upstart:
-            if self._is_running(connection):
-                print(green(f'Restarting {self.config.service_name} on {connection.host}'))
-                self.service_wrapper(connection, 'stop')
-                self.service_wrapper(connection, 'start')
-            else:
-                print(green(f'Starting {self.config.service_name} on {connection.host}'))
-                self.service_wrapper(connection, 'start')
+        start = time.time()
+        log_offset = None
+        if self.readiness and self.readiness.log:
+            result = connection.sudo(self.readiness.log_size_command(), user=self.config.user, hide='both', warn=True)
+            log_offset = int(result.stdout.strip() or 0) if result.stdout.strip().isdigit() else 0
+        with tracer.span('restart', host=connection.host):
+            self._restart(connection)
+        if self.readiness:
+            with tracer.span('readiness', host=connection.host):
+                self._wait_until_ready(connection, start, log_offset)
+
+    def _restart(self, connection):
+        """
+        (Re)start the service in one remote invocation, with `restart_command` or `restart_strategy` from mendel.yml,
+        and measure how long it was unavailable for, if its readiness probes can tell
+        :param connection: Connection
+        :return: nothing
+        """
+        if self.config.restart_command:
+            strategy, command = 'restart_command', f'bash -c {shlex.quote(self.config.restart_command)}'
+        elif self.config.use_init or self.config.use_upstart:
+            strategy = self.config.restart_strategy
+            try:
+                command = restart_command(strategy, self.config.service_name, self._init_system(connection))
+            except ValueError as e:
+                self._log_error_and_exit(connection, str(e))
+        else:
+            return
+
+        check = None
+        if self.readiness and self.readiness.samples_availability:
+            check = self.readiness.check_command()
+        print(green(f'Restarting {self.config.service_name} on {connection.host} ({strategy})'))
+        script = measured_command(command, check, deadline=self.readiness.deadline if check else 0,
+                                  user=self.config.user)
+        result = connection.sudo(f'bash -c {shlex.quote(script)}', hide='both', warn=True)
+        status, seconds, unavailable = parse_restart(result.stdout)
+        if status != 0:
+            output = '\n'.join(line for line in result.stdout.splitlines() if RESTART_MARKER not in line)
+            self._log_error_and_exit(connection, f'Unable to restart {self.config.service_name} on {connection.host} '
+                                                 f'({strategy}): {output.strip() or result.stderr.strip()}')
+        message = f'[{connection.host}] {strategy} took {seconds:.1f}s'
+        if unavailable is not None:
+            with self._lock:
+                self._unavailable_times[connection.host] = round(unavailable, 1)
+            message += f', {self.config.service_name} was unavailable for {unavailable:.1f}s'
+        print(blue(message))
+
+    def _wait_until_ready(self, connection, start, log_offset=None):
+        """
+        Poll the readiness probes on the host until they all pass, and remember how long that took
+        :param connection: Connection
+        :param start: float time the restart began
+        :param log_offset: int size of the service's log before the restart
+        :return: nothing
+        """
+        # the deadline counts from the restart, which may have spent some of it waiting for the service to come back
+        deadline = max(self.readiness.deadline - int(time.time() - start), 0)
+        print(blue(f'Waiting up to {deadline}s for {self.config.service_name} on {connection.host} to be ready'))
+        command = self.readiness.wait_command(log_offset, deadline=deadline)
+        result = connection.sudo(f'bash -c {shlex.quote(command)}', user=self.config.user, hide='both', warn=True)
+        ready, attempts = parse_wait(result.stdout)
+        seconds = time.time() - start
+        if not ready:
+            self._log_error_and_exit(connection, f'{self.config.service_name} on {connection.host} was not ready '
+                                                 f'{seconds:.1f}s after restarting it ({attempts} checks)')
+        with self._lock:
+            self._ready_times[connection.host] = round(seconds, 1)
+        print(green(f'{self.config.service_name} on {connection.host} was ready {seconds:.1f}s after restarting it '
+                    f'({attempts} checks)'))
 
     def _is_running(self, connection):
         """
@@ -209,6 +881,21 @@ class Deployer(object):
         result = self.service_wrapper(connection, 'status', print_output=True, warn_only=False)
         return 'start/running' in result or 'active (running)' in result
 
+    def _is_ready(self, connection):
+        """
+        Check if service is ready to serve on the remote host after a restart, by its readiness probes if it has any.
+        Otherwise, services that mendel doesn't start are assumed to be ready.
+        :param connection: Connection
+        :return: bool whether service is ready
+        """
+        if self.readiness:
+            result = connection.sudo(f'bash -c {shlex.quote(self.readiness.check_command())}', user=self.config.user,
+                                     hide='both', warn=True)
+            return result.ok
+        if self.config.use_init or self.config.use_upstart:
+            return self._is_running(connection)
+        return True
+
     def _lpath(self, *args):
         """
         Local path
@@ -252,11 +939,33 @@ class Deployer(object):
         :param release_path: str release dir to symlink to
         :return: nothing
         """
-        releases = self._rpath()
         print(blue("Linking release %s into current" % release_path))
-        connection.sudo(f'ln -sfT {release_path} {releases}/current',
+        connection.sudo(f'bash -c {shlex.quote(self._symlink_command(release_path))}',
                         user=self.config.user)  # Note: skipping group
 
+    def _symlink_command(self, release_path):
+        """
+        :param release_path: str release dir to symlink to
+        :return: str command which symlinks `current` dir to the given release, to be run as the service user
+        """
+        releases = self._rpath()
+        # rename a new link over `current`, so there's never a moment without one
+        return f'ln -sfT {release_path} {releases}/.current.tmp && mv -T {releases}/.current.tmp {releases}/current'
+
+    def _run_script(self, connection, script):
+        """
+        Run a RemoteScript on the remote host in one go, and abort if any of its steps fail
+        :param connection: Connection
+        :param script: RemoteScript
+        :return: list of StepResults
+        """
+        try:
+            results = script.run(connection)
+        except RemoteScriptError as e:
+            self._log_error_and_exit(connection, str(e))
+        print_step_results(connection, results)
+        return results
+
     def _log_error_and_exit(self, connection, message):
         """
         Report errors and exit any current tasks
@@ -266,13 +975,17 @@ class Deployer(object):
         """
         print(red(message))
         print(red('Aborting deployment'))
-        track_event_slack(slack_url=self.config.slack_url,
-                          slack_emoji=self.config.slack_emoji,
-                          event=message,
-                          service_name=self.config.api_service_name or self.config.service_name,
-                          deployment_host=connection.host,
-                          deployment_user=self.config.user,
-                          failure=True)
+        if self._summarizing:
+            # the failure is reported in the summary of the deploy
+            sys.exit(1)
+        self.tracker.submit('slack',
+                            slack_url=self.config.slack_url,
+                            slack_emoji=self.config.slack_emoji,
+                            event=message,
+                            service_name=self.config.api_service_name or self.config.service_name,
+                            deployment_host=connection.host,
+                            deployment_user=self.config.user,
+                            failure=True)
         sys.exit(1)
 
     def _get_commit_hash(self, connection, shorten=False):
@@ -284,21 +997,19 @@ class Deployer(object):
         :param shorten: bool short or full commit hash
         :return: str commit hash, ex. `f333c776c8cf9d56a4604ff29640326f50f00c19`
         """
-        if shorten:
-            result = connection.local('git rev-parse --short=7 HEAD', hide='stdout', warn=True)
-        else:
-            result = connection.local('git rev-parse HEAD', hide='stdout', warn=True)
-
-        if result.failed or result.stdout.strip() == '':
+        try:
+            git = git_metadata(connection, self.config.cwd)
+        except GitMetadataError:
             self._log_error_and_exit(connection, "failed to obtain commit hash")
 
-        return result.stdout.strip()
+        return git.short_hash if shorten else git.head
 
     def _new_release_dir(self, connection):
         """
         Generate a new release dir for the remote hosts, this needs to be the same across hosts
         to make it clearer that they all have the same release/build. yes this is semi-brittle,
         but for most situations it should be adequate.
+        :param connection: Connection
         :return: str release dir
         """
         timestamp = datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S')
@@ -306,6 +1017,75 @@ class Deployer(object):
 
         return f'{timestamp}-{self.config.deployment_user}-{commit_hash}'
 
+    def _get_plan(self, connection):
+        """
+        Get the plan for this run, making it the first time it's asked for.
+        Safe to call from many hosts at once, they all get the same plan.
+        :param connection: Connection
+        :return: DeploymentPlan
+        """
+        with self._lock:
+            if self.plan is None:
+                self.plan = self._new_plan(connection)
+                print(blue(f"Release directory set to {self.plan.release_dir}"))
+        return self.plan
+
+    def _new_plan(self, connection):
+        """
+        Work out everything about this deploy that's the same for every host
+        :param connection: Connection
+        :return: DeploymentPlan
+        """
+        version = self._resolve_version(connection)
+        try:
+            bundle_name = self._get_bundle_name(connection)
+        except NotImplementedError:
+            bundle_name = None  # not built locally
+        except Exception as e:
+            self._log_error_and_exit(connection, message=str(e))
+
+        checksums = {}
+        if bundle_name and os.path.isfile(self._get_local_bundle_path(connection, bundle_name)):
+            checksums[bundle_name] = sha256_of(self._get_local_bundle_path(connection, bundle_name))
+
+        return DeploymentPlan(version=version,
+                              commit_hash=self._get_commit_hash(connection),
+                              release_dir=self._new_release_dir(connection),
+                              bundle_name=bundle_name,
+                              artifact_url=self._get_artifact_url(connection, version),
+                              checksums=checksums)
+
+    def _resolve_version(self, connection):
+        """
+        :param connection: Connection
+        :return: str version to deploy, None if there's nothing to go on
+        """
+        return self.project_version
+
+    def _get_artifact_url(self, connection, version):
+        """
+        :param connection: Connection
+        :param version: str version to deploy
+        :return: str url the hosts download the bundle from, None if it gets uploaded to them
+        """
+        return None
+
+    def _get_version(self):
+        """
+        :return: str version being deployed, as far as it's known
+        """
+        return self.plan.version if self.plan else self.project_version
+
+    def _get_deployed_commit_hash(self, connection):
+        """
+        :param connection: Connection
+        :return: str short hash of the commit being deployed, the one in the plan if there is one,
+                 otherwise the one the repository is currently at
+        """
+        if self.plan and self.plan.commit_hash:
+            return self.plan.commit_hash[:SHORT_HASH_LENGTH]
+        return self._get_commit_hash(connection, shorten=True)
+
     def _get_current_release(self, connection):
         """
         Get name of the current release on the remote host
@@ -320,25 +1100,84 @@ class Deployer(object):
     def _track_event(self, connection, event):
         """
         Dispatch deploy/failure events across third party systems
+        Events are delivered in the background, so this doesn't wait for them.
         :param connection: Connection object
         :param event: string event name
         :return: nothing
         """
-        track_event_graphite(graphite_host=self.config.graphite_host,
-                             event=event,
-                             service_name=self.config.api_service_name or self.config.service_name,
-                             deployment_host=connection.host,
-                             deployment_user=self.config.deployment_user)
-        track_event_api(track_event_endpoint=self.config.track_event_endpoint,
-                        event=event,
-                        service_name=self.config.api_service_name or self.config.service_name,
-                        deployment_host=connection.host,
-                        deployment_user=self.config.deployment_user)
-        track_event_slack(slack_url=self.config.slack_url,
-                          slack_emoji=self.config.slack_emoji,
-                          event=event,
-                          commit_hash=self._get_commit_hash(connection, shorten=True),
-                          project_version=self.project_version,
-                          service_name=self.config.api_service_name or self.config.service_name,
-                          deployment_host=connection.host,
-                          deployment_user=self.config.deployment_user)
+        self.tracker.submit('graphite',
+                            graphite_host=self.config.graphite_host,
+                            event=event,
+                            service_name=self.config.api_service_name or self.config.service_name,
+                            deployment_host=connection.host,
+                            deployment_user=self.config.deployment_user)
+        self.tracker.submit('api',
+                            track_event_endpoint=self.config.track_event_endpoint,
+                            event=event,
+                            service_name=self.config.api_service_name or self.config.service_name,
+                            deployment_host=connection.host,
+                            deployment_user=self.config.deployment_user)
+        self.tracker.submit('slack',
+                            slack_url=self.config.slack_url,
+                            slack_emoji=self.config.slack_emoji,
+                            event=event,
+                            commit_hash=self._get_deployed_commit_hash(connection),
+                            project_version=self._get_version(),
+                            service_name=self.config.api_service_name or self.config.service_name,
+                            deployment_host=connection.host,
+                            deployment_user=self.config.deployment_user)
+
+    def _track_summary(self, connection, event, results, duration):
+        """
+        Dispatch one event per third party system summarizing how a deploy to many hosts went,
+        rather than one event per host
+        :param connection: Connection object
+        :param event: string event name
+        :param results: list of HostResults
+        :param duration: float seconds the deploy took
+        :return: nothing
+        """
+        succeeded = [str(r.host) for r in results if r.ok]
+        failed = [str(r.host) if r.status == HostResult.FAILED else f'{r.host} ({r.status})'
+                  for r in results if not r.ok]
+        service_name = self.config.api_service_name or self.config.service_name
+        commit_hash = self._get_deployed_commit_hash(connection)
+        summary = dict(succeeded=succeeded, failed=failed, commit=commit_hash, duration=round(duration, 1))
+        ready_times = {str(r.host): self._ready_times[r.host] for r in results if r.host in self._ready_times}
+        hosts = [dict(host=str(r.host), status=r.status) for r in results]
+        for key, times in (('time_to_ready', self._ready_times), ('unavailable', self._unavailable_times)):
+            measured = {str(r.host): times[r.host] for r in results if r.host in times}
+            if measured:
+                summary[key] = measured
+                for host in hosts:
+                    host[key] = measured.get(host['host'])
+
+        self.tracker.submit('graphite',
+                            graphite_host=self.config.graphite_host,
+                            event=event,
+                            service_name=service_name,
+                            deployment_host=', '.join(succeeded) or 'no hosts',
+                            deployment_user=self.config.deployment_user,
+                            project_version=self._get_version(),
+                            data=json.dumps(summary))
+        self.tracker.submit('api',
+                            track_event_endpoint=self.config.track_event_endpoint,
+                            event=event,
+                            service_name=service_name,
+                            hosts=hosts,
+                            deployment_user=self.config.deployment_user,
+                            project_version=self._get_version(),
+                            commit_hash=commit_hash,
+                            duration=round(duration, 1))
+        self.tracker.submit('slack',
+                            slack_url=self.config.slack_url,
+                            slack_emoji=self.config.slack_emoji,
+                            event=event,
+                            commit_hash=commit_hash,
+                            project_version=self._get_version(),
+                            service_name=service_name,
+                            deployment_host=', '.join(succeeded) or 'no hosts',
+                            deployment_user=self.config.deployment_user,
+                            failed_hosts=failed,
+                            duration=duration,
+                            time_to_ready=max(ready_times.values()) if ready_times else None)
@@ -17,14 +17,10 @@ class DebDeployer(Deployer):
         """
         upload a deb to /tmp,  return path
         """
-        try:
-            bundle_name = self._get_bundle_name(connection)
-        except Exception as e:
-            self._log_error_and_exit(connection, message=str(e))
-
+        bundle_name = self._get_plan(connection).bundle_name
         dest = self._tpath()
         fq_bundle_file = self._lpath(self.config.build_target_path, bundle_name)
-        connection.put(fq_bundle_file, dest)
+        self._put_bundle(connection, fq_bundle_file)
 
         print(green(self.UPLOAD_SUCCESS_MESSAGE % (bundle_name, dest)))
 
@@ -36,11 +32,7 @@ class DebDeployer(Deployer):
         :param connection: Connection
         :return: nothing
         """
-        try:
-            bundle_name = self._get_bundle_name(connection)
-        except Exception as e:
-            self._log_error_and_exit(connection, message=str(e))
-
+        bundle_name = self._get_plan(connection).bundle_name
         self._backup_current_release(connection)
         fq_bundle_file = self._tpath(bundle_name)
         connection.sudo(f'dpkg --force-confold -i {fq_bundle_file}', hide='stdout')
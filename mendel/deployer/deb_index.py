@@ -0,0 +1,170 @@
+"""
+A local index (sqlite, ~/.mendel/debs.sqlite) of the versions of each package in a debian repository, so
+listing and checking versions for a rollback doesn't mean downloading the repository's whole Packages index.
+It's brought up to date with a conditional request, and is still used, read-only, when the repository is slow or down.
+"""
+import hashlib
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import requests
+
+from mendel.util.colors import yellow
+from mendel.util.misc import mendel_dir
+from .packages_index import CHUNK_SIZE
+from .packages_index import iter_lines
+from .packages_index import iter_stanzas
+from .packages_index import open_index
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS packages (
+    repository TEXT NOT NULL,
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    filename TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (repository, package, version)
+);
+CREATE TABLE IF NOT EXISTS refreshes (
+    repository TEXT NOT NULL,
+    package TEXT NOT NULL,
+    index_name TEXT,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    refreshed_at REAL NOT NULL,
+    PRIMARY KEY (repository, package)
+);
+'''
+
+
+class DebIndexError(Exception):
+    """
+    raised when the versions of a package can't be found, in the repository or the local index
+    """
+    pass
+
+
+class DebIndex(object):
+    """
+    Versions of packages in debian repositories, as of the last time they were looked up.
+
+        index = DebIndex()
+        if not index.is_fresh(url, 'my-service'):
+            index.refresh(url, 'my-service', auth=(user, password))
+        index.versions(url, 'my-service')  # [{'Package', 'Version', 'Filename', 'Size', 'SHA256'}, ...]
+
+    Only the stanzas of the packages asked about are kept, each package is brought up to date separately.
+    """
+    DEFAULT_MAX_AGE = 5 * 60
+    DEFAULT_TIMEOUT = 10
+
+    def __init__(self, path=None, max_age=None, timeout=None):
+        super().__init__()
+        self.path = path or mendel_dir('debs.sqlite')
+        self.max_age = max_age if max_age is not None else self.DEFAULT_MAX_AGE
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+
+    @contextmanager
+    def _connect(self):
+        """
+        :return: context manager of a sqlite3 connection, committed (or rolled back) and closed on the way out
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=self.timeout)
+        try:
+            with db:
+                db.executescript(SCHEMA)
+                yield db
+        finally:
+            db.close()
+
+    def _last_refresh(self, db, repository, package):
+        return db.execute('SELECT index_name, etag, last_modified, content_hash, refreshed_at FROM refreshes '
+                          'WHERE repository = ? AND package = ?', (repository, package)).fetchone()
+
+    def is_fresh(self, repository, package):
+        """
+        :param repository: str url of the directory the repository's Packages index is in
+        :param package: str package name
+        :return: bool whether the package's versions were looked up less than max_age seconds ago
+        """
+        with self._connect() as db:
+            last = self._last_refresh(db, repository, package)
+        return bool(last) and time.time() - last[4] < float(self.max_age)
+
+    def refresh(self, repository, package, auth=None, session=requests):
+        """
+        Bring the versions of a package up to date. The index is only downloaded if the repository says it's
+        changed since last time, and the local index is only rewritten if its content actually changed.
+        If the repository can't be reached in time, what's already known is kept.
+        :param repository: str url of the directory the repository's Packages index is in
+        :param package: str package name
+        :param auth: tuple of (user, password), if the repository needs it
+        :param session: requests.Session or the requests module
+        :return: bool whether the repository was reached
+        """
+        with self._connect() as db:
+            last = self._last_refresh(db, repository, package)
+        headers = {}
+        if last and last[1]:
+            headers['If-None-Match'] = last[1]
+        if last and last[2]:
+            headers['If-Modified-Since'] = last[2]
+
+        digest = hashlib.sha256()
+
+        def hashed(chunks):
+            for chunk in chunks:
+                digest.update(chunk)
+                yield chunk
+
+        try:
+            name, resp = open_index(session, repository, auth=auth, timeout=self.timeout, headers=headers)
+            with resp:
+                if resp.status_code == 304 and last:
+                    stanzas = None
+                else:
+                    resp.raise_for_status()
+                    stanzas = list(iter_stanzas(iter_lines(hashed(resp.iter_content(CHUNK_SIZE)), name), package))
+                etag = resp.headers.get('ETag')
+                last_modified = resp.headers.get('Last-Modified')
+        except requests.RequestException as e:
+            print(yellow(f'Unable to refresh the versions of {package} from {repository}, '
+                         f'using what is known locally: {e}'))
+            return False
+
+        with self._connect() as db:
+            if stanzas is not None and (not last or digest.hexdigest() != last[3]):
+                db.execute('DELETE FROM packages WHERE repository = ? AND package = ?', (repository, package))
+                db.executemany('INSERT OR REPLACE INTO packages VALUES (?, ?, ?, ?, ?, ?, ?)', [
+                    (repository, package, stanza.get('Version'), stanza.get('Filename'),
+                     int(stanza.get('Size') or 0) or None, stanza.get('SHA256'), position)
+                    for position, stanza in enumerate(stanzas)
+                ])
+            content_hash = digest.hexdigest() if stanzas is not None else last[3]
+            db.execute('INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       (repository, package, name, etag or (last and last[1]),
+                        last_modified or (last and last[2]), content_hash, time.time()))
+        return True
+
+    def versions(self, repository, package):
+        """
+        :param repository: str url of the directory the repository's Packages index is in
+        :param package: str package name
+        :return: list of dicts with the Package, Version, Filename, Size and SHA256 of each version,
+                 in the order they're in the repository's index
+        :raises DebIndexError: if the package's versions have never been looked up
+        """
+        with self._connect() as db:
+            if not self._last_refresh(db, repository, package):
+                raise DebIndexError(f'no versions of {package} are known, and {repository} could not be reached')
+            rows = db.execute('SELECT version, filename, size, sha256 FROM packages '
+                              'WHERE repository = ? AND package = ? ORDER BY position',
+                              (repository, package)).fetchall()
+        return [dict(Package=package, Version=version, Filename=filename, Size=size, SHA256=sha256)
+                for version, filename, size, sha256 in rows]
@@ -0,0 +1,73 @@
+"""
+Upload bundles by only sending what changed since a release that's already on the host.
+Uses rsync's delta transfer, so rsync must be installed locally and on the hosts.
+"""
+import re
+
+from mendel.util.misc import sha256_of
+
+
+def _rsync_target(connection, remote_path):
+    """
+    :param connection: Connection
+    :param remote_path: str path on the remote host
+    :return: str rsync flags to get to the host the same way the connection does, and the rsync destination
+    """
+    ssh = f'ssh -p {connection.port} -o BatchMode=yes'
+    key_filenames = connection.connect_kwargs.get('key_filename') or []
+    if isinstance(key_filenames, str):
+        key_filenames = [key_filenames]
+    for key_filename in key_filenames:
+        ssh += f' -i {key_filename}'
+    return f'-e "{ssh}" {connection.user}@{connection.host}:{remote_path}'
+
+
+def _bytes_sent(rsync_output):
+    """
+    :param rsync_output: str output of rsync --stats
+    :return: int bytes rsync sent over the wire
+    """
+    match = re.search(r'Total bytes sent: ([\d,.]+)', rsync_output)
+    return int(re.sub(r'[,.]', '', match.group(1))) if match else 0
+
+
+def rsync_file(connection, local_path, base_path, remote_path):
+    """
+    Upload a file to the host, starting from a copy of a similar file already on the host,
+    so only the blocks that differ get sent. The result is checked against the local file's sha256.
+    :param connection: Connection
+    :param local_path: str path to the local file
+    :param base_path: str path to a similar file on the host, e.g. the one in the current release
+    :param remote_path: str path to upload the file to
+    :return: int bytes sent
+    """
+    connection.run(f'cp {base_path} {remote_path}', hide='both')
+    result = connection.local(f'rsync --compress --no-whole-file --stats {local_path} '
+                              f'{_rsync_target(connection, remote_path)}', hide='both')
+    checksum = connection.run(f'sha256sum {remote_path}', hide='both').stdout.split()[0]
+    if checksum != sha256_of(local_path):
+        raise Exception(f'checksum mismatch for {remote_path} after delta upload')
+    return _bytes_sent(result.stdout)
+
+
+def rsync_tree(connection, local_dir, base_dir, remote_dir):
+    """
+    Upload a directory tree to the host, starting from a copy of a similar tree already on the host,
+    so only the files (and blocks within them) that differ get sent. The result is then compared with the
+    local tree by checksum.
+    :param connection: Connection
+    :param local_dir: str path to the local directory
+    :param base_dir: str path to a similar directory on the host, e.g. the current release
+    :param remote_dir: str path to upload the directory to
+    :return: int bytes sent
+    """
+    connection.run(f'rm -rf {remote_dir} && mkdir -p {remote_dir} && '
+                   f'cp -R --preserve=mode,timestamps,links {base_dir}/. {remote_dir}/', hide='both')
+    target = _rsync_target(connection, remote_dir.rstrip('/') + '/')
+    result = connection.local(f'rsync --recursive --links --perms --times --delete --compress --stats '
+                              f'{local_dir.rstrip("/")}/ {target}', hide='both')
+    verify = connection.local(f'rsync --recursive --links --checksum --delete --dry-run --itemize-changes '
+                              f'{local_dir.rstrip("/")}/ {target}', hide='both')
+    if verify.stdout.strip():
+        raise Exception(f'{remote_dir} does not match {local_dir} after delta upload')
+    return _bytes_sent(result.stdout)
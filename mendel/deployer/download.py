@@ -0,0 +1,80 @@
+"""
+Have a host download an artifact in a way that survives a dropped connection: partial downloads are resumed,
+attempts are retried with backoff, and the file is verified against its checksum (the one nexus publishes next to it,
+unless a checksum is given). The latest verified download is kept, so running the same install again reuses it.
+Artifacts without a checksum are always downloaded from scratch.
+"""
+import re
+import shlex
+
+DOWNLOAD_MARKER = '__MENDEL_DOWNLOAD__'
+
+
+def download_command(url, directory, checksum=None, attempts=5, timeout=30):
+    """
+    :param url: str url of the artifact
+    :param directory: str dir on the host to keep downloads in; the file keeps the name it has in the url
+    :param checksum: str hex sha256 digest the file must have, otherwise the `.sha256` or `.sha1` published
+                     next to it in nexus is used, if there is one
+    :param attempts: int number of times to try downloading before giving up
+    :param timeout: int seconds wget waits for the server to respond, or to send more of the file
+    :return: str bash commands, which report how many bytes they downloaded for `parse_download`
+    """
+    name = url.rstrip('/').split('/')[-1]
+    return '\n'.join([
+        f'dir={shlex.quote(directory)}; name={shlex.quote(name)}; url={shlex.quote(url)}',
+        f'expected={shlex.quote(checksum or "")}; algo=sha256',
+        'mkdir -p "$dir" && cd "$dir" || exit 1',
+        'if [ -z "$expected" ]; then',
+        '  for algo in sha256 sha1; do',
+        '    expected=$(wget -q -O- "$url.$algo" 2>/dev/null | awk \'{print $1}\')',
+        '    [ -n "$expected" ] && break',
+        '  done',
+        'fi',
+        '[ -n "$expected" ] || echo "no checksum published for $name, it will not be verified"',
+        'verify() { [ -z "$expected" ] || echo "$expected  $name" | ${algo}sum -c --quiet >/dev/null 2>&1; }',
+        f'if [ -f "$name" ] && [ -n "$expected" ] && verify; then echo "{DOWNLOAD_MARKER} reused 0"; exit 0; fi',
+        # only the latest download is kept
+        'find . -maxdepth 1 -type f ! -name "$name" -delete',
+        'had=$(stat -c %s "$name" 2>/dev/null || echo 0)',
+        f'for attempt in $(seq 1 {int(attempts)}); do',
+        # without a checksum, an earlier or partial download can't be told from a changed artifact of the same name
+        '  [ -n "$expected" ] || { rm -f "$name"; had=0; }',
+        f'  if wget -q -c --tries=1 --timeout={int(timeout)} "$url"; then',
+        '    if verify; then',
+        f'      echo "{DOWNLOAD_MARKER} downloaded $(( $(stat -c %s "$name") - had ))"; exit 0',
+        '    fi',
+        '    echo "$name does not match its $algo checksum, downloading it again"',
+        '    rm -f "$name"; had=0',
+        '  fi',
+        f'  [ $attempt -lt {int(attempts)} ] && sleep $(( 2 ** attempt ))',
+        'done',
+        f'echo "unable to download $url after {int(attempts)} attempts"; exit 1',
+    ])
+
+
+def parse_download(output):
+    """
+    :param output: str output of the download step
+    :return: tuple of (bool whether a verified earlier download was reused, int bytes downloaded this time)
+    """
+    match = re.search(f'{DOWNLOAD_MARKER} (reused|downloaded) (\\d+)', output or '')
+    if not match:
+        return False, 0
+    return match.group(1) == 'reused', int(match.group(2))
+
+
+def print_download_result(connection, result):
+    """
+    Print how much was downloaded and how fast
+    :param connection: Connection
+    :param result: StepResult of the download step
+    :return: nothing
+    """
+    reused, size = parse_download(result.output)
+    if reused:
+        print(f'[{connection.host}] reused an already downloaded and verified artifact')
+    else:
+        seconds = max(result.duration_ms, 1) / 1000.0
+        print(f'[{connection.host}] downloaded {size / 1024 / 1024:.1f}MB in {seconds:.1f}s '
+              f'({size / 1024 / 1024 / seconds:.1f}MB/s)')
@@ -0,0 +1,91 @@
+"""
+Facts about target hosts (OS release, init system) which are slow to look up and rarely change,
+detected once per host and cached on local disk for a while.
+"""
+import threading
+import time
+
+from mendel.util.misc import load_json_cache
+from mendel.util.misc import mendel_dir
+from mendel.util.misc import save_json_cache
+
+DETECT_COMMAND = ('(. /etc/os-release 2>/dev/null; echo "os_id=$ID"; echo "os_version=$VERSION_ID"); '
+                  'echo "pid1=$(ps -p 1 -o comm= 2>/dev/null)"')
+
+
+def parse_facts(output):
+    """
+    :param output: str output of DETECT_COMMAND
+    :return: dict of facts: os_id, os_version (float, 0.0 if unknown) and init_system (systemd or upstart)
+    """
+    values = {}
+    for line in output.splitlines():
+        key, sep, value = line.strip().partition('=')
+        if sep:
+            values[key] = value.strip()
+
+    try:
+        os_version = float(values.get('os_version') or 0)
+    except ValueError:
+        os_version = 0.0
+
+    if values.get('pid1') == 'systemd' or os_version >= 16:
+        init_system = 'systemd'
+    else:
+        # mendel has always assumed upstart when it can't tell
+        init_system = 'upstart'
+    return dict(os_id=values.get('os_id') or None, os_version=os_version, init_system=init_system)
+
+
+class HostFacts(object):
+    """
+    Detects facts about each host the first time they're asked for, and keeps them in a json file
+    (~/.mendel/facts.json) for `ttl` seconds so later runs don't have to ask the host again.
+    `refresh` ignores what was cached before this run and detects everything again.
+    """
+    DEFAULT_TTL = 24 * 60 * 60
+
+    def __init__(self, path=None, ttl=None, refresh=False):
+        super().__init__()
+        self.path = path or mendel_dir('facts.json')
+        self.ttl = ttl if ttl is not None else self.DEFAULT_TTL
+        self.refresh = refresh
+        self._cache = None
+        self._started = time.time()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(connection):
+        return f"{getattr(connection, 'user', None)}@{connection.host}:{getattr(connection, 'port', None)}"
+
+    def get(self, connection):
+        """
+        :param connection: Connection
+        :return: dict of facts about the host
+        """
+        key = self._key(connection)
+        with self._lock:
+            entry = self._load().get(key)
+            detected_at = entry.get('detected_at', 0) if entry else 0
+            is_stale = time.time() - detected_at >= float(self.ttl) or (self.refresh and detected_at < self._started)
+            if entry and not is_stale:
+                return entry['facts']
+
+        result = connection.run(DETECT_COMMAND, hide='both', warn=True)
+        facts = parse_facts(result.stdout)
+        print(f"[{connection.host}] Linux version is {facts['os_version']}, using {facts['init_system']}")
+
+        if facts['os_id']:
+            # don't remember a guess
+            with self._lock:
+                self._load()[key] = dict(facts=facts, detected_at=time.time())
+                self._save()
+        return facts
+
+    def _load(self):
+        if self._cache is None:
+            self._cache = load_json_cache(self.path)
+        return self._cache
+
+    def _save(self):
+        save_json_cache(self.path, self._cache)
@@ -0,0 +1,166 @@
+"""
+Run per-host work across many hosts on a bounded pool of worker threads
+"""
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from mendel.util.colors import blue
+from mendel.util.colors import green
+from mendel.util.colors import red
+from mendel.util.colors import yellow
+
+
+class HostResult(object):
+    """
+    Outcome of running some work against a single host
+    """
+    OK = 'ok'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, host, status, duration=0.0, error=None):
+        super().__init__()
+        self.host = host
+        self.status = status
+        self.duration = duration
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.status == self.OK
+
+    def __repr__(self):
+        return "HostResult for %s: %s" % (self.host, self.status)
+
+
+def as_connections(connection):
+    """
+    Normalize a single Connection or a Group (a list) of Connections to a list of Connections
+    :param connection: Connection or Group
+    :return: list of Connections
+    """
+    if isinstance(connection, (list, tuple)):
+        return list(connection)
+    return [connection]
+
+
+def run_on_hosts(connections, func, parallel=1):
+    """
+    Call `func(connection)` for each connection, with at most `parallel` calls in flight at once.
+    Hosts are started in order. Once any host fails, no new hosts are started; hosts already in flight
+    are allowed to finish, and the remainder are reported as skipped.
+    :param connections: list of Connections
+    :param func: callable taking a Connection
+    :param parallel: int maximum number of hosts worked on concurrently
+    :return: list of HostResults, in the same order as connections
+    """
+    def timed(connection):
+        start = time.time()
+        try:
+            func(connection)
+        except BaseException as e:  # sys.exit() is how deployers abort, so SystemExit counts as a failure too
+            return HostResult(connection.host, HostResult.FAILED, time.time() - start, error=e)
+        return HostResult(connection.host, HostResult.OK, time.time() - start)
+
+    workers = max(int(parallel or 1), 1)
+    results = {}
+    pending = list(enumerate(connections))
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or in_flight:
+            failed = any(not r.ok for r in results.values())
+            while pending and not failed and len(in_flight) < workers:
+                index, connection = pending.pop(0)
+                in_flight[pool.submit(timed, connection)] = index
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[in_flight.pop(future)] = future.result()
+
+    for index, connection in pending:
+        results[index] = HostResult(connection.host, HostResult.SKIPPED)
+    return [results[i] for i in range(len(connections))]
+
+
+def host_count_for(value, host_count):
+    """
+    Resolve a number of hosts given either as a count (`3`) or as a percentage of all hosts (`25%`)
+    Percentages round up, so there is always at least 1 host.
+    :param value: str or int count or percentage
+    :param host_count: int total number of hosts
+    :return: int number of hosts, between 1 and host_count
+    """
+    value = str(value).strip()
+    if value.endswith('%'):
+        count = math.ceil(host_count * float(value[:-1]) / 100)
+    else:
+        count = int(value)
+    return min(max(count, 1), max(host_count, 1))
+
+
+def run_rolling(connections, func, batch_size, max_unavailable=None, pause=0, gate=None):
+    """
+    Call `func(connection)` on the hosts in batches. All hosts in a batch are worked on at once,
+    and each must pass the readiness `gate` before the next batch starts.
+
+    A host is unavailable while its batch is in flight, and stays unavailable once it fails, so
+    batches shrink as hosts fail to keep no more than `max_unavailable` hosts down at any time.
+    Without `max_unavailable`, batches are never shrunk and the first failed batch stops the rollout.
+    :param connections: list of Connections
+    :param func: callable taking a Connection
+    :param batch_size: str or int hosts per batch, as a count or a percentage of all hosts
+    :param max_unavailable: str or int hosts allowed to be unavailable at once, as a count or a percentage
+    :param pause: float seconds to wait between batches
+    :param gate: callable taking a Connection, returning bool whether the host is ready to serve
+    :return: list of HostResults, in the same order as connections
+    """
+    def work(connection):
+        func(connection)
+        if gate and not gate(connection):
+            raise Exception('did not pass readiness gate')
+
+    size = host_count_for(batch_size, len(connections))
+    budget = host_count_for(max_unavailable, len(connections)) if max_unavailable else None
+    results, remaining, batch_number = [], list(connections), 0
+    while remaining:
+        failed = sum(1 for r in results if not r.ok)
+        if budget is None:
+            room = 0 if failed else size
+        else:
+            room = min(size, budget - failed)
+        if room <= 0:
+            break
+        batch, remaining = remaining[:room], remaining[room:]
+        if batch_number and pause:
+            print(blue(f'Waiting {pause}s before the next batch'))
+            time.sleep(float(pause))
+        batch_number += 1
+        print(blue(f"Batch {batch_number}: {', '.join(str(c.host) for c in batch)}"))
+        results.extend(run_on_hosts(batch, work, parallel=len(batch)))
+
+    results.extend(HostResult(c.host, HostResult.SKIPPED) for c in remaining)
+    return results
+
+
+def print_host_results(results):
+    """
+    Print a table with one row per host
+    :param results: list of HostResults
+    :return: nothing
+    """
+    width = max([len('host')] + [len(str(r.host)) for r in results])
+    print()
+    print(f"{'host'.ljust(width)}  {'status'.ljust(8)}  {'duration':>9}")
+    for r in results:
+        row = f"{str(r.host).ljust(width)}  {r.status.ljust(8)}  {r.duration:>8.1f}s"
+        if isinstance(r.error, SystemExit):
+            row += '  aborted'
+        elif r.error is not None:
+            row += f"  {r.error.__class__.__name__}: {r.error}"
+        color = {HostResult.OK: green, HostResult.FAILED: red}.get(r.status, yellow)
+        print(color(row))
+    print()
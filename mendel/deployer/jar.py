@@ -3,53 +3,80 @@ Deploy a jar
 """
 
 from mendel.config.service_config import ServiceConfig
+from mendel.util.colors import blue
 from mendel.util.colors import green
 from .base import Deployer
 from .mixins.rollback import SymlinkRollbackMixin
+from .script import RemoteScript
 
 
 class JarDeployer(Deployer, SymlinkRollbackMixin):
+    RELEASE_MANIFEST = True
+
     def __init__(self, service_name: str = None, config: ServiceConfig = None):
         super().__init__(service_name, config)
-        self.release_dir = None
 
     def install(self, connection):
-        if not self.release_dir:
-            self.release_dir = self._new_release_dir(connection)
-        release_path = self._rpath('releases', self.release_dir)
-        connection.sudo(f'chown {self.config.user}:{self.config.group} {release_path}/{self.config.jar_name}.jar')
-
-        self._change_symlink_to(connection, release_path=self._rpath('releases', self.release_dir))
+        release_path = self._rpath('releases', self._get_plan(connection).release_dir)
+        print(blue("Linking release %s into current" % release_path))
+        script = self._release_script(release_path)
+        script.add('symlink', self._symlink_command(release_path), user=self.config.user)  # Note: skipping group
+        self._run_script(connection, script)
+        self._record_install(connection)
         print(green(self.INSTALL_SUCCESS_MESSAGE % self.config.service_name))
 
+    def _stage_release(self, connection):
+        release_path = self._rpath('releases', self._get_plan(connection).release_dir)
+        self._run_script(connection, self._release_script(release_path))
+
+    def _release_script(self, release_path):
+        """
+        :param release_path: str path to the release dir the jar was uploaded to
+        :return: RemoteScript putting the release in place, short of linking it into current
+        """
+        script = RemoteScript()
+        script.add('chown', f'chown {self.config.user}:{self.config.group} {release_path}/{self.config.jar_name}.jar')
+        return script
+
+    def _staged_check_command(self, release_path, entry):
+        return self._jar_check_command(f'{release_path}/{self.config.jar_name}.jar', entry.get('checksum'))
+
     def upload(self, connection, bundle_name=None):
         """
         Create a new release dir and upload jar
         """
-        try:
-            bundle_name = self._get_bundle_name(connection)
-        except Exception as e:
-            self._log_error_and_exit(connection, message=str(e))
+        plan = self._get_plan(connection)
+        bundle_name = plan.bundle_name
 
         self._create_if_missing(connection, path=self._rpath('releases'))
-        self.release_dir = self._new_release_dir(connection)
-        self._create_if_missing(connection, path=self._rpath('releases', self.release_dir))
+        self._create_if_missing(connection, path=self._rpath('releases', plan.release_dir))
         fq_jar_name = self._lpath(self.config.build_target_path, bundle_name)
 
         # There is no way in fabric 2 to put with sudo, workaround used https://github.com/fabric/fabric/issues/1750
-        connection.put(fq_jar_name, self._tpath())
-        release_target = self._rpath('releases', self.release_dir)
+        self._put_bundle(connection, fq_jar_name)
+        release_target = self._rpath('releases', plan.release_dir)
         connection.sudo(f'mv {self._tpath()}/{bundle_name} {release_target}')
 
-        print(green(self.UPLOAD_SUCCESS_MESSAGE % (bundle_name, self.release_dir)))
+        print(green(self.UPLOAD_SUCCESS_MESSAGE % (bundle_name, plan.release_dir)))
 
-        return self.release_dir
+        return plan.release_dir
 
-    def rollback(self, connection):
+    def rollback(self, connection, to=None, parallel=None):
         """
         [core]\t\tchoose a version to rollback to from all available releases
+        :param connection: Connection, or Group of Connections to roll them all back at once
+        :param to: str `previous` or a release name, to roll every host back to it without asking
+        :param parallel: int number of hosts to restart at once with `to`, all of them if not given
+        """
+        return self.symlink_rollback(connection, to=to, parallel=parallel)
+
+    def _get_delta_base(self, connection):
+        """
+        Delta uploads start from the jar in the current release
+        :param connection: Connection
+        :return: str path to the current release's jar
         """
-        return self.symlink_rollback(connection)
+        return self._rpath('releases', self._get_current_release(connection), f'{self.config.jar_name}.jar')
 
     def _get_bundle_name(self, connection):
         build_path = self._lpath(self.config.build_target_path)
@@ -0,0 +1,138 @@
+"""
+A json manifest of the releases on a host (service_root/releases.json), so finding out what's there, what's live
+and what last deployed successfully takes reading one small file, rather than listing dirs and following symlinks.
+It's rewritten atomically (a temp file moved into place), so a reader never sees half of it.
+"""
+import json
+import shlex
+import time
+
+MANIFEST_NAME = 'releases.json'
+
+
+class ReleaseManifest(object):
+    """
+    The releases on a host, in the order they were made, and which one is current
+
+        {"current": "20190905-120000-kevin-eeee",
+         "releases": [{"name": "20190905-120000-kevin-eeee", "version": "1.2.0", "commit": "...",
+                       "timestamp": 1567684800.0, "checksum": "...", "size": 1024, "ok": true,
+                       "ready_seconds": 12.5, "unavailable_seconds": 0.4}, ...]}
+
+    `ok` is true once the release was installed and the service restarted on it, false if that failed,
+    and null for releases that were already on the host when the manifest was started, or are staged.
+    `ready_seconds` is how long the service took to pass its readiness probes after restarting on the release, and
+    `unavailable_seconds` how long they were failing for while it restarted.
+    `staged` is true for releases put on the host by `stage` that haven't been activated yet.
+    """
+
+    def __init__(self, current=None, releases=None):
+        super().__init__()
+        self.current = current
+        self.releases = list(releases or [])
+
+    @classmethod
+    def parse(cls, text):
+        """
+        :param text: str contents of a manifest
+        :return: ReleaseManifest, or None if there's no manifest or it can't be read
+        """
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get('releases'), list):
+            return None
+        return cls(current=data.get('current'), releases=[r for r in data['releases'] if r.get('name')])
+
+    def dumps(self):
+        return json.dumps(dict(current=self.current, releases=self.releases), sort_keys=True)
+
+    @property
+    def names(self):
+        """
+        :return: list of str release names, oldest first. Release dirs start with a timestamp, so that's name order.
+        """
+        return sorted(r['name'] for r in self.releases)
+
+    def get(self, name):
+        return next((r for r in self.releases if r['name'] == name), None)
+
+    def record(self, name, version=None, commit=None, checksum=None, size=None, ok=None, timestamp=None,
+               staged=False, ready_seconds=None, unavailable_seconds=None):
+        """
+        Add a release, or update it if it's already there
+        :return: dict entry for the release
+        """
+        entry = self.get(name)
+        if entry is None:
+            entry = dict(name=name)
+            self.releases.append(entry)
+        entry.update(version=version, commit=commit, checksum=checksum, size=size, ok=ok, staged=staged,
+                     ready_seconds=ready_seconds, unavailable_seconds=unavailable_seconds,
+                     timestamp=timestamp if timestamp is not None else time.time())
+        return entry
+
+    def activate(self, name, ok, ready_seconds=None, unavailable_seconds=None):
+        """
+        Make a staged release the current one
+        :param name: str name of the release
+        :param ok: bool whether the service was restarted on it
+        :param ready_seconds: float seconds the service took to be ready on it
+        :param unavailable_seconds: float seconds the service was unavailable for while it was restarted on it
+        :return: nothing
+        """
+        entry = self.get(name) or self.record(name)
+        entry.update(ok=ok, staged=False, ready_seconds=ready_seconds, unavailable_seconds=unavailable_seconds)
+        self.current = name
+
+    def remove(self, names):
+        """
+        :param names: iterable of str names of releases that no longer exist
+        :return: nothing
+        """
+        names = set(names)
+        self.releases = [r for r in self.releases if r['name'] not in names]
+
+    def latest_ok(self):
+        """
+        :return: str name of the most recent release that deployed successfully, or None
+        """
+        ok = [r['name'] for r in self.releases if r.get('ok')]
+        return max(ok) if ok else None
+
+    def previous(self, name):
+        """
+        :param name: str name of a release
+        :return: str name of the most recent release before it that didn't fail and isn't staged, or None
+        """
+        before = [r['name'] for r in self.releases
+                  if r['name'] < name and r.get('ok') is not False and not r.get('staged')]
+        return max(before) if before else None
+
+    def latest_staged(self):
+        """
+        :return: str name of the most recent release that's staged and not activated yet, or None
+        """
+        staged = [r['name'] for r in self.releases if r.get('staged')]
+        return max(staged) if staged else None
+
+
+def read_command(path):
+    """
+    :param path: str path to the manifest on the host
+    :return: str command printing the manifest, or nothing if there isn't one
+    """
+    return f'cat {shlex.quote(path)} 2>/dev/null || true'
+
+
+def write_command(path, manifest):
+    """
+    :param path: str path to the manifest on the host
+    :param manifest: ReleaseManifest
+    :return: str command replacing the manifest on the host in one step
+    """
+    path = shlex.quote(path)
+    write = (f'tmp=$(mktemp {path}.XXXXXX) && printf %s {shlex.quote(manifest.dumps())} > "$tmp" '
+             f'&& chmod 644 "$tmp" && mv -f "$tmp" {path}')
+    return f'bash -c {shlex.quote(write)}'
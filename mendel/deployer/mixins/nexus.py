@@ -1,14 +1,55 @@
 import os
 import re
+import threading
 from xml.etree.ElementTree import ElementTree
 from xml.etree.ElementTree import fromstring
 
+import requests
+
+from mendel.deployer.nexus_cache import NexusCache
+
+_poms = {}
+_poms_lock = threading.Lock()
+
+
+def parse_pom(path):
+    """
+    Parse a pom, once for as long as the file doesn't change
+    :param path: str path to the pom
+    :return: ElementTree of the pom
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        # let ElementTree complain about it
+        return ElementTree(file=path)
+    key = (os.path.realpath(path), stat.st_mtime, stat.st_size)
+    with _poms_lock:
+        if key not in _poms:
+            _poms[key] = ElementTree(file=path)
+        return _poms[key]
+
 
 class NexusMixin(object):
     """
     Common behavior for deployments that use nexus to find, download, and upload jars and packages
     """
 
+    @property
+    def nexus_cache(self):
+        """
+        :return: NexusCache of what nexus has said about artifacts, shared by every host in a deploy
+        """
+        if getattr(self, '_nexus_cache', None) is None:
+            self._nexus_cache = NexusCache()
+        return self._nexus_cache
+
+    def _pom(self):
+        """
+        :return: ElementTree of the project's pom
+        """
+        return parse_pom(os.path.join(self.config.cwd, "pom.xml"))
+
     def _generate_base_nexus_url(self, elem_tree: ElementTree):
         """
         Generate base url for where nexus releases live
@@ -28,31 +69,39 @@ class NexusMixin(object):
             nexus_url = "http://" + nexus_url
         return nexus_url
 
-    def _generate_nexus_url(self, connection):
+    def _resolve_nexus_version(self, connection, elem_tree: ElementTree):
+        """
+        Work out which version to deploy: the one asked for, the latest one in nexus if `nexus.latest`
+        was asked for, or else the one in the pom
+        :param connection: Connection
+        :param elem_tree: ElementTree of the pom
+        :return: str version
+        """
+        if not self.project_version:
+            version = elem_tree.findtext("{http://maven.apache.org/POM/4.0.0}version").rstrip()
+        elif self.project_version == 'nexus.latest':
+            version = self._find_latest_nexus_version(connection)
+        else:
+            return self.project_version
+        print(f"Setting project version to to be {version}")
+        return version
+
+    def _generate_nexus_url(self, connection, version=None):
         """
         Generate nexus URL for artifact download
         :param: connection: Connection
+        :param version: str version to download, worked out from the pom or nexus if not given
         :return: str url
-        As a side effect, it sets the project version on the Deployer instance
-        This side effect should be pulled out and be more explicit in the future so it's less spaghetti
         """
-        elem_tree = ElementTree(file=os.path.join(self.config.cwd, "pom.xml"))
-
-        if not self.project_version:
-            found = elem_tree.findtext("{http://maven.apache.org/POM/4.0.0}version")
-            self.project_version = found.rstrip()
-            print(f"Setting project version to to be {self.project_version}")
-        elif self.project_version == 'nexus.latest':
-            # slightly dirty to reuse same var, revisit later
-            self.project_version = self._find_latest_nexus_version(connection)
-            print(f"Setting project version to to be {self.project_version}")
+        elem_tree = self._pom()
+        version = version or self._resolve_nexus_version(connection, elem_tree)
 
         nexus_url = self._generate_base_nexus_url(elem_tree)
 
         nexus_url += '/'
-        nexus_url += self.project_version
+        nexus_url += version
         nexus_url += '/'
-        nexus_url += '{0}-{1}'.format(self.config.jar_name, self.project_version)
+        nexus_url += '{0}-{1}'.format(self.config.jar_name, version)
 
         if self.config.classifier is not None:
             nexus_url += '-{0}'.format(self.config.classifier)
@@ -63,16 +112,19 @@ class NexusMixin(object):
 
     def _find_latest_nexus_version(self, connection):
         """
-        Go to nexus and find latest version of the project
+        Go to nexus and find latest version of the project.
+        maven-metadata.xml is fetched from here and cached locally, and only fetched through the host
+        if nexus can't be reached from here.
         :param connection: Connection
         :return: str latest version
         """
         print("Finding latest version from Nexus...")
-        elem_tree = ElementTree(file=os.path.join(self.config.cwd, "pom.xml"))
-        nexus_url = self._generate_base_nexus_url(elem_tree) + '/maven-metadata.xml'
+        nexus_url = self._generate_base_nexus_url(self._pom()) + '/maven-metadata.xml'
         print(nexus_url)
-        maven_meta = connection.run('curl -s ' + str(nexus_url), hide='both')
-        print(maven_meta)
-        maven_meta_xml = fromstring(maven_meta.stdout)
+        try:
+            maven_meta = self.nexus_cache.metadata(nexus_url)
+        except requests.RequestException:
+            maven_meta = connection.run('curl -s ' + str(nexus_url), hide='both').stdout
+        maven_meta_xml = fromstring(maven_meta)
         versioning = maven_meta_xml.find("versioning")
         return versioning.findtext("latest") or versioning.findtext("release")
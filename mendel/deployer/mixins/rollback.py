@@ -1,5 +1,10 @@
+import sys
 from functools import partial
 
+from mendel.deployer.fleet import as_connections
+from mendel.deployer.fleet import print_host_results
+from mendel.deployer.fleet import run_on_hosts
+from mendel.util.colors import blue
 from mendel.util.colors import green
 
 
@@ -9,14 +14,114 @@ class SymlinkRollbackMixin(object):
     Must be mixedin to a subclass of Deployer as it relies on its methods
     """
 
-    def symlink_rollback(self, connection):
+    def symlink_rollback(self, connection, to=None, parallel=None):
         """
-        Rollback by switching symlinks. Allow user choice for which version to roll back to
+        Rollback by switching symlinks. Without `to`, the user chooses which release to roll back to on each host;
+        with it, every host is rolled back to that release at once, see fleet_symlink_rollback.
+        :param connection: Connection, or Group of Connections
+        :param to: str `previous`, or the name of the release to roll back to
+        :param parallel: int number of hosts to restart at once, all of them if not given
+        :return: nothing
+        """
+        if to:
+            return self.fleet_symlink_rollback(connection, to, parallel=parallel)
+        for host_connection in as_connections(connection):
+            self._interactive_symlink_rollback(host_connection)
+
+    def fleet_symlink_rollback(self, connection, to, parallel=None):
+        """
+        Roll every host back to the same release without asking: the release is worked out once, checked to
+        be on every host (all at once) before any host is touched, then every host switches over to it and
+        restarts at the same time. Hosts already on it are left alone.
+        :param connection: Connection, or Group of Connections
+        :param to: str `previous` (the last good release before the current one, which every host has to be on),
+                   or a release name
+        :param parallel: int number of hosts to restart at once, all of them if not given
+        :return: nothing
+        """
+        connections = as_connections(connection)
+        releases = {}
+
+        def read_releases(host_connection):
+            releases[host_connection.host] = self._get_releases(host_connection)
+
+        results = run_on_hosts(connections, read_releases, parallel=len(connections))
+        if not all(r.ok for r in results):
+            print_host_results(results)
+            self._log_error_and_exit(connections[0], 'Unable to read releases from every host, not rolling back')
+
+        target = to
+        if to == 'previous':
+            target = self._previous_release(connections, releases)
+
+        missing = [c.host for c in connections if target not in releases[c.host][1]]
+        if missing:
+            self._log_error_and_exit(connections[0], f'{target} is not on {", ".join(missing)}, not rolling back')
+        to_switch = [c for c in connections if releases[c.host][2] != target]
+        print(blue(f'Rolling {len(to_switch)} host(s) back to {target}'))
+
+        def switch(host_connection):
+            manifest = releases[host_connection.host][0]
+            self._change_symlink_to(host_connection, self._rpath('releases', target))
+            if manifest:
+                manifest.current = target
+                self._write_manifest(host_connection, manifest)
+            self._start_or_restart(host_connection)
+            self._track_event(host_connection, 'rolledback')
+
+        results = run_on_hosts(to_switch, switch, parallel=parallel or len(to_switch) or 1)
+        if len(results) > 1:
+            print_host_results(results)
+        if not all(r.ok for r in results):
+            sys.exit(1)
+        print(green(f'successfully rolled back {self.config.service_name} to {target}'))
+
+    def _previous_release(self, connections, releases):
+        """
+        The release before the one every host is on, skipping releases that failed to deploy or are only staged.
+        Exits if the hosts aren't all on the same release, as there's no one release to go back from.
+        :param connections: list of Connections
+        :param releases: dict of str host to the tuple _get_releases returned for it
+        :return: str name of the release to roll back to
+        """
+        hosts_on = {}
+        for host_connection in connections:
+            hosts_on.setdefault(releases[host_connection.host][2], []).append(host_connection.host)
+        if len(hosts_on) > 1:
+            on = '; '.join(f'{", ".join(hosts)} on {current}' for current, hosts in hosts_on.items())
+            self._log_error_and_exit(connections[0], f'Hosts are on different releases ({on}), '
+                                                     f'roll back to a named release instead')
+
+        manifest, all_releases, current_release = releases[connections[0].host]
+        if manifest:
+            previous = manifest.previous(current_release) if current_release else None
+        elif current_release in all_releases and all_releases.index(current_release) > 0:
+            previous = all_releases[all_releases.index(current_release) - 1]
+        else:
+            previous = None
+        if not previous:
+            self._log_error_and_exit(connections[0], f'No release before {current_release} on {connections[0].host}')
+        return previous
+
+    def _get_releases(self, connection):
+        """
+        The releases on a host, from its manifest, or by listing them if it doesn't have one yet
+        :param connection: Connection
+        :return: tuple of (ReleaseManifest or None, list of str release names oldest first, str current release)
+        """
+        manifest = self._read_manifest(connection)
+        if manifest:
+            return manifest, manifest.names, manifest.current
+        return None, self._get_all_releases(connection), self._get_current_release(connection)
+
+    def _interactive_symlink_rollback(self, connection):
+        """
+        Rollback one host by switching symlinks, to the release the user chooses
         :param connection: Connection
         :return: nothing
         """
         def validator(rollback_candidate, release_list):
-            if rollback_candidate == self._get_current_release(connection):
+            if rollback_candidate == current_release:
                 raise Exception(
                     'can\'t rollback to same version that is already deployed')
 
@@ -26,13 +131,13 @@ class SymlinkRollbackMixin(object):
 
             return rollback_candidate
 
-        all_releases = self._get_all_releases(connection)
+        manifest, all_releases, current_release = self._get_releases(connection)
         if len(all_releases) <= 1:
             self._log_error_and_exit(connection, 'Only 1 release available, nothing to rollback to :(')
 
         curr_index = self._display_releases_for_rollback_selection(
             all_releases,
-            self._get_current_release(connection)
+            current_release
         )
 
         # TODO use this?
@@ -46,6 +151,9 @@ class SymlinkRollbackMixin(object):
             self._log_error_and_exit(connection, str(e))
 
         self._change_symlink_to(connection, self._rpath('releases', rollback_to))
+        if manifest:
+            manifest.current = rollback_to
+            self._write_manifest(connection, manifest)
         self._start_or_restart(connection)
         print(green(f'successfully rolled back {self.config.service_name} to {rollback_to}'))
 
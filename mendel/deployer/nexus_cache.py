@@ -0,0 +1,105 @@
+"""
+What nexus has said about artifacts, kept on local disk so repeat deploys barely have to ask it again.
+maven-metadata.xml is revalidated with ETag / If-Modified-Since rather than downloaded again, and released
+artifacts, which nexus doesn't let change once they're uploaded, are only looked for until they're found.
+"""
+import threading
+import time
+
+import requests
+
+from mendel.util.misc import load_json_cache
+from mendel.util.misc import mendel_dir
+from mendel.util.misc import save_json_cache
+
+
+class NexusCache(object):
+    """
+    Answers from nexus, cached in a json file (~/.mendel/nexus.json) keyed by url, which is unique per
+    group, artifact and (for artifacts) version.
+
+        cache = NexusCache()
+        cache.metadata('http://nexus/.../my-service/maven-metadata.xml')  # str xml
+        cache.artifact_exists('http://nexus/.../my-service/1.2.0/my-service-1.2.0.jar')  # bool
+    """
+    DEFAULT_TIMEOUT = 3
+
+    def __init__(self, path=None, timeout=None):
+        super().__init__()
+        self.path = path or mendel_dir('nexus.json')
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def metadata(self, url):
+        """
+        Fetch a maven-metadata.xml, sending the validators of the cached copy so an unchanged one isn't sent again.
+        When nexus can't be reached, the cached copy is used if there is one.
+        :param url: str url of the maven-metadata.xml
+        :return: str xml
+        :raises requests.RequestException: if nexus couldn't be reached and nothing is cached
+        """
+        with self._lock:
+            entry = self._load().get('metadata', {}).get(url)
+
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        try:
+            resp = requests.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            if entry:
+                return entry['body']
+            raise
+        if resp.status_code == 304 and entry:
+            return entry['body']
+        resp.raise_for_status()
+
+        if resp.headers.get('ETag') or resp.headers.get('Last-Modified'):
+            with self._lock:
+                self._load().setdefault('metadata', {})[url] = dict(etag=resp.headers.get('ETag'),
+                                                                     last_modified=resp.headers.get('Last-Modified'),
+                                                                     body=resp.text,
+                                                                     fetched_at=time.time())
+                self._save()
+        return resp.text
+
+    def artifact_exists(self, url):
+        """
+        Whether nexus has an artifact. Once a released artifact has been found it's not looked for again;
+        snapshots can be replaced, so they're always looked for.
+        :param url: str url of the artifact
+        :return: bool
+        """
+        with self._lock:
+            if url in self._load().get('artifacts', {}):
+                return True
+
+        resp = requests.head(url=url, timeout=self.timeout)
+        if resp.status_code != 200:
+            return False
+        self.remember_artifact(url)
+        return True
+
+    def remember_artifact(self, url):
+        """
+        Record that nexus has a released artifact, e.g. right after uploading it. Snapshots aren't recorded.
+        :param url: str url of the artifact
+        :return: nothing
+        """
+        if 'SNAPSHOT' in url:
+            return
+        with self._lock:
+            self._load().setdefault('artifacts', {})[url] = time.time()
+            self._save()
+
+    def _load(self):
+        if self._cache is None:
+            self._cache = load_json_cache(self.path)
+        return self._cache
+
+    def _save(self):
+        save_json_cache(self.path, self._cache)
@@ -0,0 +1,87 @@
+"""
+Read a debian repository's Packages index as it downloads, keeping only the stanzas for one package.
+A shared repository's index can have tens of thousands of stanzas, so it's never held in memory whole,
+and stanzas for other packages are skipped without being parsed.
+"""
+import lzma
+import zlib
+
+from debian import deb822
+
+# most compact first; a repository doesn't have to provide all of them
+INDEX_NAMES = ('Packages.xz', 'Packages.gz', 'Packages')
+CHUNK_SIZE = 64 * 1024
+
+
+def decompressor(name):
+    """
+    :param name: str file name of the index
+    :return: a zlib/lzma style decompressor for it, or None if it isn't compressed
+    """
+    if name.endswith('.xz'):
+        return lzma.LZMADecompressor()
+    if name.endswith('.gz'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    return None
+
+
+def iter_lines(chunks, name=''):
+    """
+    :param chunks: iterable of bytes, the index as it's downloaded
+    :param name: str file name of the index, which says how it's compressed
+    :return: generator of str lines, without line endings
+    """
+    d = decompressor(name)
+    pending = b''
+    for chunk in chunks:
+        pending += d.decompress(chunk) if d else chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8', 'replace').rstrip('\r')
+    if pending:
+        yield pending.decode('utf-8', 'replace').rstrip('\r')
+
+
+def iter_stanzas(lines, package):
+    """
+    :param lines: iterable of str lines of a Packages index
+    :param package: str name of the package to keep stanzas for
+    :return: generator of deb822.Packages, one for each stanza of `package`
+    """
+    stanza = []
+    skipping = False
+    for line in lines:
+        if not line.strip():
+            if stanza and not skipping:
+                yield deb822.Packages('\n'.join(stanza))
+            stanza = []
+            skipping = False
+            continue
+        if skipping:
+            continue
+        if line.startswith('Package:') and line[len('Package:'):].strip() != package:
+            # not ours, don't hold on to any of it
+            stanza = []
+            skipping = True
+            continue
+        stanza.append(line)
+    if stanza and not skipping:
+        yield deb822.Packages('\n'.join(stanza))
+
+
+def open_index(session, base_url, auth=None, timeout=30, headers=None):
+    """
+    Start downloading the first Packages index the repository has: xz, gz, then uncompressed
+    :param session: requests.Session or the requests module
+    :param base_url: str url of the directory the index is in
+    :param auth: tuple of (user, password), if the repository needs it
+    :param timeout: float seconds to wait for the repository to respond
+    :param headers: dict of extra request headers, e.g. to make it a conditional request
+    :return: tuple of (str file name, streaming requests.Response), for the caller to close
+    """
+    for name in INDEX_NAMES:
+        resp = session.get(f'{base_url.rstrip("/")}/{name}', auth=auth, stream=True, timeout=timeout,
+                           headers=headers or {})
+        if resp.status_code != 404 or name == INDEX_NAMES[-1]:
+            return name, resp
+        resp.close()
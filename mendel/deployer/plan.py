@@ -0,0 +1,25 @@
+"""
+Everything about a deploy that's the same for every host, worked out once before any host is touched
+"""
+from collections import namedtuple
+from types import MappingProxyType
+
+
+class DeploymentPlan(namedtuple('DeploymentPlan', ['version', 'commit_hash', 'release_dir', 'bundle_name',
+                                                   'artifact_url', 'checksums'])):
+    """
+    Read-only, so it can be shared by hosts being deployed to at the same time.
+
+    version: str version being deployed, None if the bundle type doesn't have one
+    commit_hash: str full hash of the commit being deployed
+    release_dir: str name of the release dir on the hosts
+    bundle_name: str file name of the locally built bundle, None if it isn't built locally
+    artifact_url: str url the hosts download the bundle from, None if it's uploaded to them
+    checksums: mapping of bundle file name to hex sha256 digest
+    """
+    __slots__ = ()
+
+    def __new__(cls, version=None, commit_hash=None, release_dir=None, bundle_name=None, artifact_url=None,
+                checksums=None):
+        return super().__new__(cls, version, commit_hash, release_dir, bundle_name, artifact_url,
+                               MappingProxyType(dict(checksums or {})))
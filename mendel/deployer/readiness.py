@@ -0,0 +1,126 @@
+"""
+Wait for a service to be ready to serve after it's restarted, rather than only started. Readiness is configured
+per service in mendel.yml, as any of an http endpoint, a tcp port, a line in the service's log and a command, and
+all of the configured probes have to pass. They're polled on the host in one script, backing off exponentially
+up to a deadline.
+"""
+import re
+import shlex
+
+READY_MARKER = '__MENDEL_READY__'
+
+
+class ReadinessProbe(object):
+    """
+        readiness:
+          http: http://localhost:8080/health   # must answer with a 2xx
+          tcp: 8080                            # or host:port, must accept connections
+          log: Started Application             # must be logged after the restart
+          log_file: /var/log/myservice/app.log # defaults to /var/log/<service_name>/output.log
+          command: /srv/myservice/bin/check    # must exit 0, run as the service user
+          deadline: 300                        # seconds to wait for the service to be ready
+          interval: 1                          # seconds between the first checks, doubling up to max_interval
+          max_interval: 10
+    """
+    DEFAULT_DEADLINE = 300
+    DEFAULT_INTERVAL = 1
+    DEFAULT_MAX_INTERVAL = 10
+    KEYS = ('http', 'tcp', 'log', 'log_file', 'command', 'deadline', 'interval', 'max_interval')
+
+    def __init__(self, http=None, tcp=None, log=None, log_file=None, command=None, deadline=None, interval=None,
+                 max_interval=None):
+        super().__init__()
+        self.http = http
+        self.tcp = str(tcp) if tcp else None
+        self.log = log
+        self.log_file = log_file
+        self.command = command
+        self.deadline = int(deadline or self.DEFAULT_DEADLINE)
+        self.interval = max(int(interval or self.DEFAULT_INTERVAL), 1)
+        self.max_interval = max(int(max_interval or self.DEFAULT_MAX_INTERVAL), self.interval)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        :param config: ServiceConfig
+        :return: ReadinessProbe, or None if the service doesn't have any probes configured
+        """
+        readiness = config.readiness
+        if not readiness:
+            return None
+        if not isinstance(readiness, dict):
+            raise ValueError('readiness in mendel.yml must be a mapping of probes, e.g. `http: <url>`')
+        unknown = set(readiness) - set(cls.KEYS)
+        if unknown:
+            raise ValueError(f'unknown readiness settings in mendel.yml: {", ".join(sorted(unknown))}')
+        probe = cls(**readiness)
+        if not (probe.http or probe.tcp or probe.log or probe.command):
+            raise ValueError('readiness in mendel.yml needs at least one of http, tcp, log or command')
+        probe.log_file = probe.log_file or f'/var/log/{config.service_name}/output.log'
+        return probe
+
+    @property
+    def samples_availability(self):
+        """
+        :return: bool whether the probes can tell if the service is available at any moment, which the log can't
+        """
+        return bool(self.http or self.tcp or self.command)
+
+    def log_size_command(self):
+        """
+        :return: str command printing the size of the log, so only what's logged after it is searched
+        """
+        return f'stat -c %s {shlex.quote(self.log_file)} 2>/dev/null || echo 0'
+
+    def check_command(self, log_offset=None):
+        """
+        :param log_offset: int bytes of the log written before the restart. the log isn't checked if not given,
+                           there being no telling an old line from a new one
+        :return: str command which succeeds only if every probe passes
+        """
+        checks = []
+        if self.http:
+            checks.append(f'curl -fsS -o /dev/null --max-time 5 {shlex.quote(self.http)}')
+        if self.tcp:
+            host, _, port = self.tcp.rpartition(':')
+            connect = f'exec 3<>/dev/tcp/{host or "127.0.0.1"}/{int(port)}'
+            checks.append(f'timeout 5 bash -c {shlex.quote(connect)}')
+        if self.log and log_offset is not None:
+            log_file = shlex.quote(self.log_file)
+            # a log that shrank was rotated, so it's all new
+            checks.append(f'{{ from={int(log_offset) + 1}; [ $(stat -c %s {log_file}) -ge {int(log_offset)} ] '
+                          f'|| from=1; tail -c +$from {log_file} | grep -qF -- {shlex.quote(self.log)}; }}')
+        if self.command:
+            checks.append(f'bash -c {shlex.quote(self.command)}')
+        return ' && '.join(f'{check} >/dev/null 2>&1' for check in checks) or 'true'
+
+    def wait_command(self, log_offset=None, deadline=None):
+        """
+        :param log_offset: int bytes of the log written before the restart
+        :param deadline: int seconds to wait, if less than the probe's deadline. the probes are checked at least once
+        :return: str bash commands polling the probes until they pass or the deadline passes,
+                 which report how it went for `parse_wait`
+        """
+        deadline = self.deadline if deadline is None else max(int(deadline), 0)
+        return '\n'.join([
+            f'deadline=$(( SECONDS + {deadline} )); delay={self.interval}; attempts=0',
+            'while true; do',
+            '  attempts=$(( attempts + 1 ))',
+            f'  if {self.check_command(log_offset)}; then echo "{READY_MARKER} ready $attempts"; exit 0; fi',
+            '  [ $SECONDS -ge $deadline ] && break',
+            '  left=$(( deadline - SECONDS )); sleep $(( delay < left ? delay : left ))',
+            f'  delay=$(( delay * 2 < {self.max_interval} ? delay * 2 : {self.max_interval} ))',
+            'done',
+            f'echo "{READY_MARKER} timeout $attempts"; exit 1',
+        ])
+
+
+def parse_wait(output):
+    """
+    :param output: str output of the wait command
+    :return: tuple of (bool whether the service became ready, int number of times the probes were checked)
+    """
+    match = re.search(f'{READY_MARKER} (ready|timeout) (\\d+)', output or '')
+    if not match:
+        return False, 0
+    return match.group(1) == 'ready', int(match.group(2))
@@ -0,0 +1,73 @@
+"""
+Distribute a file to many hosts by uploading it once, then having the hosts copy it to each other
+"""
+from mendel.deployer.fleet import run_on_hosts
+from mendel.util.colors import blue
+from mendel.util.colors import yellow
+from mendel.util.misc import sha256_of
+
+
+class RelayError(Exception):
+    """
+    raised when the file can't be uploaded to the seed hosts, or a copy from a peer doesn't match its checksum
+    """
+    pass
+
+def copy_from_peer(connection, peer, remote_path, checksum):
+    """
+    Have the host pull a file from a peer host over ssh, and verify it arrived intact.
+    The host authenticates to the peer with your ssh agent, which is only forwarded for the copy.
+    :param connection: Connection to copy the file to
+    :param peer: Connection to copy the file from
+    :param remote_path: str path to the file, the same on both hosts
+    :param checksum: str expected hex sha256 digest of the file
+    :return: nothing
+    """
+    forward_agent = connection.forward_agent
+    connection.forward_agent = True
+    try:
+        connection.run(f'scp -o StrictHostKeyChecking=accept-new -o BatchMode=yes -P {peer.port} '
+                       f'{peer.user}@{peer.host}:{remote_path} {remote_path}', hide='both')
+    finally:
+        connection.forward_agent = forward_agent
+    result = connection.run(f'sha256sum {remote_path}', hide='both')
+    if result.stdout.split()[0] != checksum:
+        raise RelayError(f'checksum mismatch for {remote_path} copied from {peer.host}')
+
+
+def relay_file(connections, local_path, remote_dir, seeds=1):
+    """
+    Upload a file to the first `seeds` hosts, then spread it to the rest in rounds: in each round every host
+    that has the file passes it on to one host that doesn't, so the number of hosts with the file doubles.
+    :param connections: list of Connections
+    :param local_path: str path to the local file
+    :param remote_dir: str dir on the hosts to put the file in
+    :param seeds: int number of hosts to upload the file to directly
+    :return: list of hosts that have the file. Hosts missing from it couldn't get the file from a peer.
+    """
+    remote_path = remote_dir.rstrip('/') + '/' + local_path.split('/')[-1]
+    checksum = sha256_of(local_path)
+
+    seeds = max(int(seeds or 1), 1)
+    holders, remaining = connections[:seeds], connections[seeds:]
+    print(blue(f'Uploading {local_path} to seed host(s) {", ".join(str(c.host) for c in holders)}'))
+    results = run_on_hosts(holders, lambda c: c.put(local_path, remote_dir), parallel=len(holders))
+    if not all(r.ok for r in results):
+        raise RelayError(f'Unable to upload {local_path} to seed hosts')
+
+    while remaining:
+        pairs = list(zip(remaining, holders))
+        remaining = remaining[len(pairs):]
+        receivers = [receiver for receiver, _ in pairs]
+        peers = {id(receiver): peer for receiver, peer in pairs}
+        print(blue(f'Relaying {remote_path} to {", ".join(str(c.host) for c in receivers)}'))
+        results = run_on_hosts(receivers,
+                               lambda c: copy_from_peer(c, peers[id(c)], remote_path, checksum),
+                               parallel=len(receivers))
+        for receiver, result in zip(receivers, results):
+            if result.ok:
+                holders.append(receiver)
+            else:
+                print(yellow(f'Unable to relay {remote_path} to {receiver.host}: {result.error}'))
+
+    return [c.host for c in holders]
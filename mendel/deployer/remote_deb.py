@@ -3,14 +3,21 @@ Deploy a debian package housed remotely (Nexus)
 """
 import getpass
 import os
+import shlex
+import sys
+from functools import partial
 
-import requests
 from debian import deb822
 from fabric.connection import Connection
 
 from mendel.util.colors import blue
 from mendel.util.colors import green
 from .base import Deployer
+from .deb_index import DebIndex
+from .deb_index import DebIndexError
+from .fleet import as_connections
+from .fleet import print_host_results
+from .fleet import run_on_hosts
 from .mixins.nexus import NexusMixin
 
 
@@ -18,6 +25,9 @@ class RemoteDebDeployer(Deployer, NexusMixin):
 
     def __init__(self, service_name, config):
         super().__init__(service_name, config)
+        self._already_uploaded = False
+        self._apt_refreshed_hosts = set()
+        self.deb_index = DebIndex()
 
     def install(self, connection):
         self._apt_install_latest(connection)
@@ -30,36 +40,94 @@ class RemoteDebDeployer(Deployer, NexusMixin):
 
     def upload(self, connection):
         """
-        upload a deb to nexus
+        upload a deb to nexus, then have the host download it ahead of installing it
+        Note: only uploads once, no matter how many hosts!
         """
-        if self.config.project_type == "java":
-            connection.local('mvn clean -U deploy')
-        else:
-            raise Exception(f"Unsupported project type for remote deb: {self.config.project_type}")
+        with self._lock:
+            if not self._already_uploaded:
+                if self.config.project_type == "java":
+                    connection.local('mvn clean -U deploy')
+                    self._already_uploaded = True
+                else:
+                    raise Exception(f"Unsupported project type for remote deb: {self.config.project_type}")
+        self._apt_prefetch(connection)
+
+    def rollback(self, connection, to=None, parallel=None):
+        """
+        [core]\t\tchoose a version to rollback to from all available versions
+        :param connection: Connection, or Group of Connections
+        :param to: str `previous` or a version, to install it on every host at once without asking
+        :param parallel: int number of hosts to roll back at once with `to`, all of them if not given
+        """
+        connections = as_connections(connection)
+        if not to:
+            for host_connection in connections:
+                self._rollback_host(host_connection)
+            return
+        # the version is worked out and checked once for the whole fleet, before any host is touched
+        version = self._resolve_rollback_version(connections, to)
+        print(blue(f'Rolling back {len(connections)} host(s) to {version}'))
+        results = run_on_hosts(connections, partial(self._rollback_host, to=version),
+                               parallel=parallel or len(connections))
+        if len(results) > 1:
+            print_host_results(results)
+        if not all(r.ok for r in results):
+            sys.exit(1)
 
-    def rollback(self, connection):
-        def validator(rollback_candidate):
-            if rollback_candidate not in [v.get('Version') for v in available_versions]:
-                raise Exception(f'invalid rollback selection: {rollback_candidate}')
-            return rollback_candidate
+    def _resolve_rollback_version(self, connections, to):
+        """
+        :param connections: list of Connections
+        :param to: str `previous` or a version
+        :return: str version every host should be rolled back to, which is available in the repository.
+                 `previous` is the version before the one installed, which has to be the same on every host.
+        """
+        connection = connections[0]
+        installed = {}
 
-        available_versions = self._get_available_nexus_versions()
-        current_version = self._get_current_package_version(connection)
+        def read_version(host_connection):
+            installed[host_connection.host] = self._get_current_package_version(host_connection)
 
-        curr_index = self._display_apt_versions_for_rollback_selection(
-            available_versions,
-            current_version
-        )
+        results = run_on_hosts(connections, read_version, parallel=len(connections))
+        if not all(r.ok for r in results):
+            print_host_results(results)
+            self._log_error_and_exit(connection, 'Unable to tell which version is installed on every host')
 
-        default_rollback_choice = available_versions[max(curr_index - 1, 0)].get('Version')
+        current_versions = set(installed.values())
+        available = [v.get('Version') for v in
+                     self._get_available_nexus_versions(connection, current_version=installed[connection.host])]
+        if to != 'previous':
+            if to not in available:
+                self._log_error_and_exit(connection, f'invalid rollback selection: {to}')
+            return to
 
-        rollback_to = input('Rollback to:')
-        try:
-            validator(rollback_to)
-        except Exception as e:
-            self._log_error_and_exit(connection, str(e))
+        if len(current_versions) > 1:
+            self._log_error_and_exit(connection, f'hosts have different versions installed '
+                                                 f'({", ".join(sorted(current_versions))}), '
+                                                 f'name the version to roll back to with --to')
+        current_version = current_versions.pop()
+        if current_version not in available:
+            self._log_error_and_exit(connection, f'installed version {current_version} is not in the repository')
+        curr_index = available.index(current_version)
+        if curr_index == 0:
+            self._log_error_and_exit(connection, f'there is no version before {current_version} to roll back to')
+        return available[curr_index - 1]
 
-        self._apt_install(connection=connection, version=rollback_to)
+    def _rollback_host(self, connection, to=None):
+        """
+        Install an earlier version of the package on one host
+        :param connection: Connection
+        :param to: str version to install, already checked to be available. asked for if not given
+        :return: nothing
+        """
+        if not to:
+            current_version = self._get_current_package_version(connection)
+            available_versions = self._get_available_nexus_versions(connection, current_version=current_version)
+            self._display_apt_versions_for_rollback_selection(available_versions, current_version)
+            to = input('Rollback to:')
+            if to not in [v.get('Version') for v in available_versions]:
+                self._log_error_and_exit(connection, f'invalid rollback selection: {to}')
+
+        self._apt_install(connection=connection, version=to)
         self._track_event(connection, event='rolledback')
 
     def _get_current_package_version(self, connection: Connection):
@@ -86,9 +154,56 @@ class RemoteDebDeployer(Deployer, NexusMixin):
 
         return curr_index
 
+    def _apt_update(self, connection: Connection, version=None, latest=False):
+        """
+        Bring the host's apt index up to date. With `apt_source_list` set in mendel.yml, only that source is
+        refreshed, and not at all if it already lists `version` or, unless the latest package is wanted, was
+        refreshed less than `apt_update_max_age` seconds ago. Otherwise every source is, as `apt-get update` does.
+        :param connection: Connection
+        :param version: str version about to be installed, if not the latest
+        :param latest: bool whether the latest package is about to be installed, which may have just been
+                       published, so an index refreshed a few minutes ago could be missing it
+        :return: nothing
+        """
+        if not self.config.apt_source_list:
+            connection.sudo('apt-get update', hide="stdout")
+            return
+
+        stamp = f'/var/lib/apt/lists/.mendel-{self.config.service_name}'
+        fresh = []
+        if not latest:
+            fresh.append(f'[ $(( $(date +%s) - $(stat -c %Y {stamp} 2>/dev/null || echo 0) )) '
+                         f'-lt {int(self.config.apt_update_max_age)} ]')
+        if version:
+            fresh.append(f"apt-cache madison {self.config.service_name} | awk '{{print $3}}' | grep -qxF {version}")
+        update = (f'apt-get update -o Dir::Etc::sourcelist={self.config.apt_source_list} '
+                  f'-o Dir::Etc::sourceparts=- -o APT::Get::List-Cleanup=0 >/dev/null && touch {stamp}')
+        command = f'if {" || ".join(fresh)}; then echo fresh; else {update}; fi' if fresh else update
+        result = connection.sudo(f'bash -c {shlex.quote(command)}', hide="stdout")
+        if result.stdout.strip() == 'fresh':
+            print(blue(f'apt index on {connection.host} is fresh, not updating it'))
+
+    def _apt_prefetch(self, connection: Connection):
+        """
+        Download the latest package into the host's apt cache without installing it,
+        so installing it during the cutover doesn't have to wait for the download
+        :param connection: Connection
+        :return: nothing
+        """
+        print(blue(f'downloading latest {self.config.service_name} package ahead of installing it'))
+        self._apt_update(connection, latest=True)
+        with self._lock:
+            self._apt_refreshed_hosts.add(connection.host)
+        connection.sudo(f'apt-get install -y --force-yes --download-only --only-upgrade {self.config.service_name}',
+                        hide="stdout")
+
     def _apt_install_latest(self, connection: Connection):
         print(blue(f'upgrading package {self.config.service_name} to latest available version'))
-        connection.sudo('apt-get update', hide="stdout")
+        # the index was already refreshed for the package just published if this host prefetched it
+        with self._lock:
+            prefetched = connection.host in self._apt_refreshed_hosts
+        if not prefetched:
+            self._apt_update(connection, latest=True)
         connection.sudo(
             f'apt-get install -y --force-yes --only-upgrade -o Dpkg::Options::="--force-confold" {self.config.service_name}')
 
@@ -97,7 +212,7 @@ class RemoteDebDeployer(Deployer, NexusMixin):
             self._apt_install_latest(connection)
         else:
             print(blue(f'installing {self.config.service_name} {version}'))
-            connection.sudo('apt-get update', hide="stdout")
+            self._apt_update(connection, version=version)
             connection.sudo(
                 f'apt-get install -y --force-yes -o Dpkg::Options::="--force-confold" {self.config.service_name}={version}')
 
@@ -105,46 +220,48 @@ class RemoteDebDeployer(Deployer, NexusMixin):
         jar_name = connection.run(f'readlink {path}.jar', hide='both')
         print(green(f'apt installed new jar: {jar_name}'))
 
-    def _get_available_nexus_versions(self):
+    def _get_available_nexus_versions(self, connection, current_version=None):
+        """
+        Find every version of the package in the repository, from the local index of it. The index is only
+        brought up to date (which takes the nexus password) if it's a few minutes old or doesn't know
+        about `current_version` yet, and is used as it is if nexus can't be reached.
+        :param connection: Connection
+        :param current_version: str version installed on the host, if known
+        :return: list of dicts with the Package, Version, Filename, Size and SHA256 of each version
+        """
         # validate nexus settings are configured first
         for suffix in ('host', 'port', 'user', 'repository'):
-            if not getattr(self, '_nexus_%s' % suffix):
-                self._log_error_and_exit('~/.mendel.conf is missing %s in [nexus] configuration section' % suffix)
-
-        url_for_debug = f'http://{self.config.nexus_host}:{self.config.nexus_port}' + \
-                        f'/nexus/content/repositories' + \
-                        f'/{self.config.nexus_repository}' + \
-                        f'/Packages'
-
-        print(blue(f'Downloading packages from {url_for_debug}'))
-
-        # TODO maybe read password from maven settings?
-        nexus_password = os.environ.get('MENDEL_NEXUS_PASSWORD') or \
-            getpass.getpass(prompt='Enter nexus password: ')
-
-        packages_file = requests.get(
-            'http://%(nexus_user)s:%(nexus_password)s'
-            '@%(nexus_host)s:%(nexus_port)s'
-            '/nexus/content/repositories'
-            '/%(nexus_repository)s'
-            '/Packages' % dict(nexus_user=self.config.nexus_user,
-                               nexus_password=nexus_password,
-                               nexus_host=self.config.nexus_host,
-                               nexus_port=self.config.nexus_port,
-                               nexus_repository=self.config.nexus_repository
-                               )
-        ).content
-
-        package_entries = [
-            deb822.Packages(package_info)
-            for package_info in packages_file.split('\n\n')
-            if package_info
-        ]
-
-        available_versions = [
-            p for p in package_entries if p.get('Package') == self.config.service_name
-        ]
-
-        print(blue(f'Found {len(package_entries)} available versions of {self.config.service_name}'))
+            if not getattr(self.config, 'nexus_%s' % suffix):
+                self._log_error_and_exit(connection,
+                                         '~/.mendel.conf is missing %s in [nexus] configuration section' % suffix)
+
+        repository_url = f'http://{self.config.nexus_host}:{self.config.nexus_port}' + \
+                         f'/nexus/content/repositories' + \
+                         f'/{self.config.nexus_repository}'
+        package = self.config.service_name
+
+        with self._lock:
+            known_versions = [v['Version'] for v in self._known_versions(repository_url, package)]
+            if not self.deb_index.is_fresh(repository_url, package) or \
+                    (current_version and current_version not in known_versions):
+                print(blue(f'Refreshing versions of {package} from {repository_url}/Packages'))
+
+                # TODO maybe read password from maven settings?
+                nexus_password = os.environ.get('MENDEL_NEXUS_PASSWORD') or \
+                    getpass.getpass(prompt='Enter nexus password: ')
+                self.deb_index.refresh(repository_url, package, auth=(self.config.nexus_user, nexus_password))
+
+        try:
+            available_versions = self.deb_index.versions(repository_url, package)
+        except DebIndexError as e:
+            self._log_error_and_exit(connection, str(e))
+
+        print(blue(f'Found {len(available_versions)} available versions of {package}'))
 
         return available_versions
+
+    def _known_versions(self, repository_url, package):
+        try:
+            return self.deb_index.versions(repository_url, package)
+        except DebIndexError:
+            return []
@@ -1,19 +1,20 @@
 """
 Deploy a jar housed remotely (Nexus)
 """
-import datetime
-
-import requests
-
 from mendel.config.service_config import ServiceConfig
 from mendel.util.colors import blue
 from mendel.util.colors import green
 from .base import Deployer
+from .download import download_command
+from .download import print_download_result
 from .mixins.nexus import NexusMixin
 from .mixins.rollback import SymlinkRollbackMixin
+from .script import RemoteScript
 
 
 class RemoteJarDeployer(Deployer, NexusMixin, SymlinkRollbackMixin):
+    RELEASE_MANIFEST = True
+
     def __init__(self, service_name: str = None, config: ServiceConfig = None):
         super().__init__(service_name, config)
         self._already_deployed = False
@@ -24,19 +25,58 @@ class RemoteJarDeployer(Deployer, NexusMixin, SymlinkRollbackMixin):
         :param connection: Connection
         :return: Nothing
         """
-        nexus_url = self._generate_nexus_url(connection)
-        self._create_if_missing(connection, path=self._rpath('releases'))
-        release_dir = self._new_release_dir(connection)
-        self._create_if_missing(connection, path=self._rpath('releases', release_dir))
+        current_release = self._rpath('releases', self._get_plan(connection).release_dir)
+        print(blue("Linking release %s into current" % current_release))
+        script = self._release_script(connection)
+        script.add('symlink', self._symlink_command(current_release), user=self.config.user)
+        self._run_release_script(connection, script)
+        self._record_install(connection)
+        print(green(self.INSTALL_SUCCESS_MESSAGE % self.config.service_name))
 
-        current_release = self._rpath('releases', release_dir)
-        connection.sudo(f'wget {nexus_url} --directory-prefix={current_release}', hide=True)
-        # rename versioned jar to normal service jar
-        connection.sudo(f'mv {current_release}/*.jar {current_release}/{self.config.jar_name}.jar')
-        connection.sudo(f'chown {self.config.user}:{self.config.group} {current_release}/{self.config.jar_name}.jar')
+    def _stage_release(self, connection):
+        self._run_release_script(connection, self._release_script(connection))
 
-        self._change_symlink_to(connection=connection, release_path=self._rpath('releases', release_dir))
-        print(green(self.INSTALL_SUCCESS_MESSAGE % self.config.service_name))
+    def _release_script(self, connection):
+        """
+        :param connection: Connection
+        :return: RemoteScript downloading the jar into its release dir, short of linking it into current
+        """
+        plan = self._get_plan(connection)
+        nexus_url = plan.artifact_url
+        current_release = self._rpath('releases', plan.release_dir)
+
+        proxy = self._artifact_proxy
+        if proxy:
+            nexus_url = f'http://127.0.0.1:{proxy.port}/{proxy.name}'
+        downloads = self._rpath('releases', '.downloads')
+        downloaded = downloads + '/' + nexus_url.rstrip('/').split('/')[-1]
+
+        script = RemoteScript()
+        script.add('mkdir', f'mkdir -p {current_release}', user=self.config.user)  # Note: skipping group
+        script.add('download', download_command(nexus_url, downloads, checksum=proxy.sha256 if proxy else None))
+        # copy the download to the normal service jar name
+        script.add('cp', f'cp {downloaded} {current_release}/{self.config.jar_name}.jar')
+        script.add('chown', f'chown {self.config.user}:{self.config.group} {current_release}/{self.config.jar_name}.jar')
+        return script
+
+    def _run_release_script(self, connection, script):
+        """
+        Run a script with a download step, through the artifact proxy if there is one
+        :param connection: Connection
+        :param script: RemoteScript
+        :return: nothing
+        """
+        proxy = self._artifact_proxy
+        if proxy:
+            # the host sees the proxy on the same port on its own localhost
+            with connection.forward_remote(proxy.port, local_port=proxy.port):
+                results = self._run_script(connection, script)
+        else:
+            results = self._run_script(connection, script)
+        print_download_result(connection, next(r for r in results if r.name == 'download'))
+
+    def _staged_check_command(self, release_path, entry):
+        return self._jar_check_command(f'{release_path}/{self.config.jar_name}.jar', entry.get('checksum'))
 
     def upload(self, connection):
         """
@@ -44,13 +84,15 @@ class RemoteJarDeployer(Deployer, NexusMixin, SymlinkRollbackMixin):
         :param connection: Connection
         :return:
         """
-        if not self.already_deployed(connection):
-            if self.config.project_type == "java":
-                print(blue('Pushing jar to nexus server'))
-                connection.local('mvn deploy')
-                self._already_deployed = True
-            else:
-                raise Exception(f"Unsupported project type: {self.config.project_type}")
+        with self._lock:
+            if not self.already_deployed(connection):
+                if self.config.project_type == "java":
+                    print(blue('Pushing jar to nexus server'))
+                    connection.local('mvn deploy')
+                    self._already_deployed = True
+                    self.nexus_cache.remember_artifact(self._get_plan(connection).artifact_url)
+                else:
+                    raise Exception(f"Unsupported project type: {self.config.project_type}")
 
     def already_built(self, connection):
         return self.already_deployed(connection)
@@ -58,43 +100,55 @@ class RemoteJarDeployer(Deployer, NexusMixin, SymlinkRollbackMixin):
     def already_deployed(self, connection):
         """
         Check if jar has already been deployed to the central repository (nexus)
-        Check first time, and caches it on an instance variable thereafter.
+        Check first time, and caches it on an instance variable thereafter. Released jars found in nexus are
+        remembered across runs, see NexusCache.
         :param connection: Connection
         :return: bool whether jar is already deployed
         """
         if self._already_deployed:
             return True
         else:
-            nexus_url = self._generate_nexus_url(connection)
-            resp = requests.head(url=nexus_url, timeout=3)
+            nexus_url = self._get_plan(connection).artifact_url
 
-            if resp.status_code == 200:
+            if self.nexus_cache.artifact_exists(nexus_url):
                 print(green('Already found artifact in nexus. Skipping build and upload phases...'))
                 self._already_deployed = True
                 return True
             else:
-                print(print(resp.content))
                 print(blue(f'Artifact not found in nexus. Url checked: {nexus_url}'))
         return False
 
-    def rollback(self, connection):
+    def rollback(self, connection, to=None, parallel=None):
         """
         [core]\t\tchoose a version to rollback to from all available releases
+        :param connection: Connection, or Group of Connections to roll them all back at once
+        :param to: str `previous` or a release name, to roll every host back to it without asking
+        :param parallel: int number of hosts to restart at once with `to`, all of them if not given
         """
-        return self.symlink_rollback(connection)
+        return self.symlink_rollback(connection, to=to, parallel=parallel)
 
-    def _new_release_dir(self, connection):
+    def _new_plan(self, connection):
         """
-        Generate a new release dir for the remote hosts, this needs to be the same across hosts
-        Note this is overridden from the base class - this variant includes project version
+        Note this extends the base class - the release dir includes the project version
         in addition to the commit hash, user and timestamp on the base class.
         :param connection: Connection
-        :return: str release dir
+        :return: DeploymentPlan
         """
-        release_dir_timestamp = datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S')
-        commit_hash = self._get_commit_hash(connection)
+        plan = super()._new_plan(connection)
+        return plan._replace(release_dir=f'{plan.release_dir}-{plan.version or self.project_version}')
 
-        release_dir = f'{release_dir_timestamp}-{self.config.deployment_user}-{commit_hash}-{self.project_version}'
-        print(blue(f"Release directory set to {release_dir}"))
+    def _resolve_version(self, connection):
+        """
+        The version in the pom, or the latest in nexus, unless a version was asked for
+        :param connection: Connection
+        :return: str version to deploy
+        """
+        return self._resolve_nexus_version(connection, self._pom())
 
-        return release_dir
+    def _get_artifact_url(self, connection, version):
+        """
+        :param connection: Connection
+        :param version: str version to deploy
+        :return: str url of the jar in nexus
+        """
+        return self._generate_nexus_url(connection, version=version)
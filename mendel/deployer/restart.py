@@ -0,0 +1,103 @@
+"""
+Restart a service in one remote invocation, with the strategy configured for it in mendel.yml, and measure how long
+it was unavailable for. The gap is measured on the host by sampling the service's readiness probes while it's
+restarted: from the first sample that fails to the first one that passes again after it.
+"""
+import re
+import shlex
+
+RESTART_MARKER = '__MENDEL_RESTART__'
+STRATEGIES = ('stop-start', 'restart', 'reload', 'try-reload-or-restart')
+
+
+def restart_command(strategy, service_name, init_system):
+    """
+    Whatever the strategy, a service that isn't running is started
+    :param strategy: str one of STRATEGIES
+    :param service_name: str name of the service
+    :param init_system: str systemd or upstart
+    :return: str command restarting the service
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f'unknown restart_strategy {strategy}, use one of {", ".join(STRATEGIES)} '
+                         f'or set restart_command')
+    name = shlex.quote(service_name)
+    if init_system == 'systemd':
+        running = f'systemctl is-active --quiet {name}'
+        command = {
+            'stop-start': f'systemctl stop {name}; systemctl start {name}',
+            'restart': f'systemctl restart {name}',
+            'reload': f'systemctl reload {name}',
+            'try-reload-or-restart': f'systemctl reload-or-restart {name}',
+        }[strategy]
+        start = f'systemctl start {name}'
+    else:
+        running = f'service {name} status | grep -q start/running'
+        command = {
+            'stop-start': f'service {name} stop; service {name} start',
+            'restart': f'service {name} restart',
+            'reload': f'service {name} reload',
+            'try-reload-or-restart': f'{{ service {name} reload || service {name} restart; }}',
+        }[strategy]
+        start = f'service {name} start'
+    return f'if {running}; then {command}; else {start}; fi'
+
+
+def measured_command(command, check=None, deadline=300, user=None):
+    """
+    :param command: str command restarting the service
+    :param check: str command that succeeds while the service is available, the gap isn't measured if not given
+    :param deadline: int seconds to wait for the service to be available again
+    :param user: str user to run `check` as, while `command` runs as whoever runs the script
+    :return: str bash commands running `command`, which report how it went for `parse_restart`
+    """
+    lines = [
+        'now() { echo $(( $(date +%s%N) / 1000000 )); }',
+        'finished=$(mktemp -u)',
+    ]
+    if check:
+        if user:
+            check = f'sudo -u {shlex.quote(user)} bash -c {shlex.quote(check)}'
+        lines += [
+            f'available() {{ {check}; }}',
+            '(',
+            f'  down=; up=; end=$(( SECONDS + {int(deadline)} ))',
+            '  while [ $SECONDS -lt $end ]; do',
+            '    t=$(now)',
+            '    if available; then',
+            '      if [ -n "$down" ]; then up=$t; break; fi',
+            '      [ -e "$finished" ] && break',
+            '    elif [ -z "$down" ]; then down=$t; fi',
+            '    sleep 0.1',
+            '  done',
+            f'  if [ -z "$down" ]; then echo "{RESTART_MARKER} gap 0"',
+            f'  elif [ -n "$up" ]; then echo "{RESTART_MARKER} gap $(( up - down ))"; fi',
+            ') &',
+            'sampler=$!',
+        ]
+    lines += [
+        'start=$(now)',
+        f'( {command} ) 2>&1',
+        'status=$?',
+        f'echo "{RESTART_MARKER} restart $status $(( $(now) - start ))"',
+    ]
+    if check:
+        lines += [
+            '[ $status -eq 0 ] || kill $sampler 2>/dev/null',
+            'touch "$finished"; wait $sampler; rm -f "$finished"',
+        ]
+    lines.append('exit $status')
+    return '\n'.join(lines)
+
+
+def parse_restart(output):
+    """
+    :param output: str output of the measured command
+    :return: tuple of (int exit status of the restart or None if it didn't report, float seconds the restart took,
+             float seconds the service was unavailable for, None if that wasn't measured)
+    """
+    restart = re.search(f'{RESTART_MARKER} restart (\\d+) (\\d+)', output or '')
+    gap = re.search(f'{RESTART_MARKER} gap (\\d+)', output or '')
+    if not restart:
+        return None, 0.0, None
+    return int(restart.group(1)), int(restart.group(2)) / 1000.0, int(gap.group(1)) / 1000.0 if gap else None
@@ -0,0 +1,138 @@
+"""
+Decide which old release dirs to delete from a host, and delete them once the deploy is done with the host.
+The release `current` points at and the one before it are always kept, whatever the policy says.
+Bundles in the bundle cache (`releases/.cache`) go with the last release that used them.
+"""
+import shlex
+import time
+
+CACHE_DIR = '.cache'
+
+
+def list_command(releases_dir, current_link):
+    """
+    :param releases_dir: str path to the releases dir on the host
+    :param current_link: str path to the `current` symlink on the host
+    :return: str command printing the real path of the releases dir and of the release `current` points at,
+             then `<mtime> <name>` for every release and `cached <mtime> <sha256>` for every cached bundle
+    """
+    cache_dir = shlex.quote(f'{releases_dir.rstrip("/")}/{CACHE_DIR}')
+    releases_dir, current_link = shlex.quote(releases_dir), shlex.quote(current_link)
+    return (f'[ -d {releases_dir} ] || exit 0; readlink -f {releases_dir}; readlink -f {current_link}; '
+            f"find {releases_dir} -mindepth 1 -maxdepth 1 -type d ! -name '.*' -printf '%T@ %f\\n'; "
+            f"[ -d {cache_dir} ] && find {cache_dir} -mindepth 1 -maxdepth 1 -type f -printf 'cached %T@ %f\\n'")
+
+
+def parse_listing(output):
+    """
+    :param output: str output of list_command
+    :return: tuple of (str name of the current release or None, list of (str name, float mtime))
+    """
+    lines = [line.strip() for line in output.splitlines() if line.strip()]
+    if len(lines) < 2:
+        return None, []
+    current = None
+    prefix = lines[0].rstrip('/') + '/'
+    if lines[1].startswith(prefix):
+        # tgz releases link to a dir inside the release
+        current = lines[1][len(prefix):].split('/')[0]
+    releases = []
+    for line in lines[2:]:
+        mtime, _, name = line.partition(' ')
+        try:
+            releases.append((name, float(mtime)))
+        except ValueError:
+            continue
+    return current, releases
+
+
+def parse_cached(output):
+    """
+    :param output: str output of list_command
+    :return: list of (str sha256, float mtime) of the bundles in the bundle cache
+    """
+    cached = []
+    for line in output.splitlines():
+        marker, _, rest = line.strip().partition(' ')
+        mtime, _, checksum = rest.partition(' ')
+        if marker != 'cached' or not checksum:
+            continue
+        try:
+            cached.append((checksum, float(mtime)))
+        except ValueError:
+            continue
+    return cached
+
+
+def releases_to_prune(releases, current, keep=None, max_age=None, now=None):
+    """
+    A release is kept if it's one of the newest `keep`, or younger than `max_age` seconds, or it's the current
+    release or the one before it. With neither `keep` nor `max_age` set, every release is kept.
+    :param releases: list of (str name, float mtime) of the releases on a host
+    :param current: str name of the release `current` points at, None if it couldn't be told
+    :param keep: int number of most recent releases to keep
+    :param max_age: float seconds to keep releases for
+    :param now: float time to measure ages from, now if not given
+    :return: list of str names of releases to delete, oldest first
+    """
+    if not keep and not max_age:
+        return []
+    if current is None or current not in dict(releases):
+        # not knowing what's live, it's not safe to delete anything
+        return []
+    now = now if now is not None else time.time()
+    # release dirs start with a timestamp, so sort by name like rollback does
+    names = sorted(name for name, _ in releases)
+    mtimes = dict(releases)
+    protected = {current}
+    if names.index(current) > 0:
+        protected.add(names[names.index(current) - 1])
+    if keep:
+        protected.update(names[-int(keep):])
+    if max_age:
+        protected.update(name for name in names if now - mtimes[name] < float(max_age))
+    return [name for name in names if name not in protected]
+
+
+def cached_to_prune(cached, used=None, keep=None, max_age=None, now=None):
+    """
+    With the checksums of the bundles the kept releases were deployed from, every other cached bundle goes.
+    Without them (no manifest on the host), cached bundles are kept by the same policy as releases.
+    :param cached: list of (str sha256, float mtime) of the bundles in the bundle cache
+    :param used: set of str sha256 of the bundles kept releases use, None if not known
+    :param keep: int number of most recently cached bundles to keep
+    :param max_age: float seconds to keep cached bundles for
+    :param now: float time to measure ages from, now if not given
+    :return: list of str sha256 of cached bundles to delete
+    """
+    if used is not None:
+        return sorted(checksum for checksum, _ in cached if checksum not in used)
+    if not keep and not max_age:
+        return []
+    now = now if now is not None else time.time()
+    newest_first = [checksum for checksum, _ in sorted(cached, key=lambda c: c[1], reverse=True)]
+    mtimes = dict(cached)
+    protected = set(newest_first[:int(keep)] if keep else [])
+    if max_age:
+        protected.update(checksum for checksum in newest_first if now - mtimes[checksum] < float(max_age))
+    return sorted(checksum for checksum in newest_first if checksum not in protected)
+
+
+def prune_command(releases_dir, current_link, names, cached=()):
+    """
+    :param releases_dir: str path to the releases dir on the host
+    :param current_link: str path to the `current` symlink on the host
+    :param names: list of str names of releases to delete
+    :param cached: list of str sha256 of cached bundles to delete
+    :return: str command deleting the releases, skipping whichever one `current` points at right before
+             deleting it. It fails if anything couldn't be deleted.
+    """
+    current_link = shlex.quote(current_link)
+    delete = (f'base=$(readlink -f {shlex.quote(releases_dir)}); [ -n "$base" ] || exit 0; failed=0; '
+              f'for name in {" ".join(shlex.quote(name) for name in names)}; do '
+              f'cur=$(readlink -e {current_link}); [ -n "$cur" ] || {{ echo "can\'t tell what current is"; exit 1; }}; '
+              f'case "$cur/" in "$base/$name"/*) ;; *) rm -rf "$base/$name" || failed=1 ;; esac; done')
+    if cached:
+        delete += (f'; cd "$base/{CACHE_DIR}" && rm -f {" ".join(shlex.quote(checksum) for checksum in cached)} '
+                   f'|| failed=1')
+    return f'bash -c {shlex.quote(delete + "; exit $failed")}'
@@ -0,0 +1,127 @@
+"""
+Batch the steps of a remote operation into a single shell script, so they run in one sudo session
+(one ssh round trip) instead of paying for a round trip and a sudo startup per command.
+"""
+import re
+import shlex
+
+STEP_MARKER = '__MENDEL_STEP__'
+
+
+class RemoteScriptError(Exception):
+    """
+    raised when a step of a RemoteScript fails on the remote host
+    """
+
+    def __init__(self, message, results):
+        super().__init__(message)
+        self.results = results
+
+
+class StepResult(object):
+    """
+    Outcome of a single step of a RemoteScript
+    """
+
+    def __init__(self, name, exit_code, duration_ms, output=''):
+        super().__init__()
+        self.name = name
+        self.exit_code = exit_code
+        self.duration_ms = duration_ms
+        self.output = output
+
+    @property
+    def ok(self):
+        return self.exit_code == 0
+
+    def __repr__(self):
+        return "StepResult for %s: exited %s in %sms" % (self.name, self.exit_code, self.duration_ms)
+
+
+class RemoteScript(object):
+    """
+    A list of named shell steps which run one after another as root, stopping at the first one that fails.
+
+        script = RemoteScript()
+        script.add('mkdir', 'mkdir -p /srv/my-service/releases', user='my-service')
+        script.add('chown', 'chown my-service:my-service /srv/my-service/releases')
+        results = script.run(connection)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.steps = []
+
+    def add(self, name, command, user=None):
+        """
+        :param name: str name of the step, reported back with its result
+        :param command: str shell command
+        :param user: str user to run the command as, root if not given
+        :return: self, so calls can be chained
+        """
+        self.steps.append((name, command, user))
+        return self
+
+    def render(self):
+        """
+        :return: str bash script which runs every step, reporting each step's exit code and duration in ms
+        """
+        lines = []
+        for name, command, user in self.steps:
+            command = f'bash -c {shlex.quote(command)}'
+            if user:
+                command = f'sudo -u {shlex.quote(user)} -H {command}'
+            lines.extend([
+                'start=$(date +%s%N)',
+                f'{command} 2>&1',
+                'rc=$?',
+                f'echo "{STEP_MARKER} {name} $rc $(( ($(date +%s%N) - start) / 1000000 ))"',
+                '[ $rc -eq 0 ] || exit $rc',
+            ])
+        return '\n'.join(lines)
+
+    def run(self, connection):
+        """
+        Run all of the steps on the remote host in one go
+        :param connection: Connection
+        :return: list of StepResults
+        :raises RemoteScriptError: if a step failed
+        """
+        result = connection.sudo(f'bash -c {shlex.quote(self.render())}', hide='both', warn=True)
+        results = self.parse(result.stdout)
+        failed = [r for r in results if not r.ok]
+        if failed:
+            raise RemoteScriptError(f'{failed[0].name} failed on {connection.host}: {failed[0].output.strip()}',
+                                    results)
+        if len(results) != len(self.steps):
+            raise RemoteScriptError(f'remote script exited early on {connection.host}: {result.stdout.strip()}',
+                                    results)
+        return results
+
+    @staticmethod
+    def parse(output):
+        """
+        :param output: str output of a rendered script
+        :return: list of StepResults, one for each step that ran
+        """
+        results, step_output = [], []
+        for line in output.splitlines():
+            match = re.match(f'^{STEP_MARKER} (\\S+) (\\d+) (\\d+)$', line.strip())
+            if match:
+                name, exit_code, duration_ms = match.groups()
+                results.append(StepResult(name, int(exit_code), int(duration_ms), '\n'.join(step_output)))
+                step_output = []
+            else:
+                step_output.append(line)
+        return results
+
+
+def print_step_results(connection, results):
+    """
+    Print how long each step took
+    :param connection: Connection
+    :param results: list of StepResults
+    :return: nothing
+    """
+    steps = ', '.join(f'{r.name} {r.duration_ms}ms' for r in results)
+    print(f'[{connection.host}] {steps}')
@@ -0,0 +1,61 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import pytest
+
+from mendel.deployer.artifact_proxy import ArtifactProxy
+from mendel.deployer.artifact_proxy import ArtifactProxyError
+
+URL = 'http://nexus.com/com/mycompany/best-jar-ever/1.2.0/best-jar-ever-1.2.0.jar'
+JAR = b'PK jar bytes' * 1000
+
+
+def response(status_code=200, data=b''):
+    resp = MagicMock(status_code=status_code, text=data.decode())
+    resp.iter_content.return_value = [data[:100], data[100:]]
+    resp.__enter__.return_value = resp
+    return resp
+
+
+class ArtifactProxyTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('requests.get')
+    def test_downloads_once_and_serves(self, get):
+        get.side_effect = [response(data=JAR), response(data=hashlib.sha1(JAR).hexdigest().encode())]
+        proxy = ArtifactProxy(URL, cache_dir=self.tmp_dir)
+        proxy.start()
+        try:
+            served = urllib.request.urlopen(f'http://127.0.0.1:{proxy.port}/best-jar-ever-1.2.0.jar').read()
+            with pytest.raises(urllib.error.HTTPError):
+                urllib.request.urlopen(f'http://127.0.0.1:{proxy.port}/something-else.jar')
+        finally:
+            proxy.stop()
+        self.assertEqual(served, JAR)
+        self.assertEqual(proxy.sha256, hashlib.sha256(JAR).hexdigest())
+
+        # a release that's already been downloaded isn't downloaded again
+        next_proxy = ArtifactProxy(URL, cache_dir=self.tmp_dir)
+        next_proxy.start()
+        next_proxy.stop()
+        self.assertEqual(get.call_count, 2)
+
+    @patch('requests.get')
+    def test_checksum_mismatch(self, get):
+        get.side_effect = [response(data=JAR), response(data=b'0' * 40)]
+        with pytest.raises(ArtifactProxyError):
+            ArtifactProxy(URL, cache_dir=self.tmp_dir).start()
+        self.assertEqual(os.listdir(self.tmp_dir), [])
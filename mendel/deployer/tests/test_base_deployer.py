@@ -1,4 +1,9 @@
+import hashlib
+import os
+import tempfile
+import time
 from unittest import TestCase
+from unittest.mock import MagicMock
 from unittest.mock import patch
 
 import pytest
@@ -6,6 +11,8 @@ from invoke import Result
 
 from mendel.config.service_config import ServiceConfig
 from mendel.deployer.base import Deployer
+from mendel.deployer.readiness import ReadinessProbe
+from mendel.deployer.relay import RelayError
 from .helpers import MockConnection
 
 
@@ -27,35 +34,55 @@ class BaseDeployerTests(TestCase):
                                     track_event_endpoint='endpoint.com')
         self.deployer = Deployer(config=mock_config)
 
-    def test_git_commit_hash(self):
+    @patch('mendel.util.git._read_git_dir')
+    def test_git_commit_hash(self, read_git_dir):
+        read_git_dir.return_value = None
+        self.deployer.config.cwd = '/nowhere/test_git_commit_hash'
         mock_connection = MockConnection(run=Result('f333c776c8cf9d56a4604ff29640326f50f00c19'))
         result = self.deployer._get_commit_hash(mock_connection)
         self.assertEqual(result, 'f333c776c8cf9d56a4604ff29640326f50f00c19')
 
-    def test_git_commit_hash_short(self):
-        mock_connection = MockConnection(run=Result('f333c77'))
+    @patch('mendel.util.git._read_git_dir')
+    def test_git_commit_hash_short(self, read_git_dir):
+        read_git_dir.return_value = None
+        self.deployer.config.cwd = '/nowhere/test_git_commit_hash_short'
+        mock_connection = MockConnection(run=Result('f333c776c8cf9d56a4604ff29640326f50f00c19'))
         result = self.deployer._get_commit_hash(mock_connection, shorten=True)
         self.assertEqual(result, 'f333c77')
 
-    @patch('mendel.deployer.base.track_event_slack')
-    def test_log_and_exit(self, slack):
-        with pytest.raises(SystemExit) as e:
-            mock_connection = MockConnection(host='prod-something-01')
-            result = self.deployer._log_error_and_exit(mock_connection, 'something went wrong')
-            self.assertTrue('something went wrong' in result.stdout)
-            self.assertTrue(slack.called)
+    @patch('mendel.util.git._read_git_dir')
+    def test_git_commit_hash_failed(self, read_git_dir):
+        read_git_dir.return_value = None
+        self.deployer.config.cwd = '/nowhere/test_git_commit_hash_failed'
+        mock_connection = MockConnection(host='prod-something-01', run=Result('', exited=128))
+        with pytest.raises(SystemExit):
+            self.deployer._get_commit_hash(mock_connection)
+
+    def test_log_and_exit(self):
+        slack = MagicMock(return_value=True)
+        with patch.dict('mendel.deployer.tracking.dispatcher.SINKS', slack=slack):
+            with pytest.raises(SystemExit) as e:
+                mock_connection = MockConnection(host='prod-something-01')
+                self.deployer._log_error_and_exit(mock_connection, 'something went wrong')
+            self.deployer.tracker.flush()
+        self.assertTrue(slack.called)
+        self.assertEqual(slack.call_args[1]['event'], 'something went wrong')
+        self.assertTrue(slack.call_args[1]['failure'])
 
-    @patch('mendel.deployer.base.track_event_api')
-    @patch('mendel.deployer.base.track_event_graphite')
-    @patch('mendel.deployer.base.track_event_slack')
     @patch('mendel.deployer.base.Deployer._get_commit_hash')
-    def test_track_event(self, commit_hash, slack, graphite, api):
+    def test_track_event(self, commit_hash):
         commit_hash.return_value = '123aaa'
-        mock_connection = MockConnection(host='prod-something-01')
-        result = self.deployer._track_event(mock_connection, 'deployed')
-        self.assertTrue(slack.called)
-        self.assertTrue(graphite.called)
-        self.assertTrue(api.called)
+        sinks = dict(slack=MagicMock(return_value=True),
+                     graphite=MagicMock(return_value=True),
+                     api=MagicMock(return_value=True))
+        with patch.dict('mendel.deployer.tracking.dispatcher.SINKS', **sinks):
+            mock_connection = MockConnection(host='prod-something-01')
+            self.deployer._track_event(mock_connection, 'deployed')
+            self.deployer.tracker.flush()
+        self.assertTrue(sinks['slack'].called)
+        self.assertTrue(sinks['graphite'].called)
+        self.assertTrue(sinks['api'].called)
+        self.assertEqual(sinks['slack'].call_args[1]['commit_hash'], '123aaa')
 
     def test_get_current_release(self):
         release = '/srv/my-service/releases/20190809-184022-user-be07d4d1fa4b0-2.9.9'
@@ -70,6 +97,80 @@ class BaseDeployerTests(TestCase):
         result = self.deployer._new_release_dir(mock_connection)
         self.assertTrue('kevin-1232435zzz' in result)
 
+    @patch('mendel.deployer.base.Deployer._get_bundle_name')
+    @patch('mendel.deployer.base.Deployer._get_commit_hash')
+    def test_plan(self, commit_hash, bundle_name):
+        commit_hash.return_value = '1232435zzz'
+        bundle_name.return_value = 'test_service.jar'
+        with tempfile.TemporaryDirectory() as build_dir:
+            with open(os.path.join(build_dir, 'test_service.jar'), 'wb') as f:
+                f.write(b'jar')
+            self.deployer.config.build_target_path = build_dir
+            mock_connection = MockConnection(host='prod-something-01')
+            plan = self.deployer._get_plan(mock_connection)
+        self.assertIs(self.deployer._get_plan(mock_connection), plan)
+        self.assertEqual(bundle_name.call_count, 1)
+        self.assertEqual(plan.bundle_name, 'test_service.jar')
+        self.assertEqual(plan.checksums['test_service.jar'], hashlib.sha256(b'jar').hexdigest())
+        self.assertEqual(plan.commit_hash, '1232435zzz')
+        self.assertIn('kevin-1232435zzz', plan.release_dir)
+        self.assertIsNone(plan.artifact_url)
+
+    def test_put_bundle(self):
+        mock_connection = MagicMock(host='prod-something-01')
+        result = self.deployer._put_bundle(mock_connection, '/home/kevin/test_service/target/test_service.jar')
+        self.assertEqual(result, '/tmp/test_service.jar')
+        mock_connection.put.assert_called_once_with('/home/kevin/test_service/target/test_service.jar', '/tmp')
+
+    @patch('mendel.deployer.base.relay_file')
+    @patch('mendel.deployer.base.Deployer._get_local_bundle_path')
+    @patch('mendel.deployer.base.Deployer._get_plan')
+    def test_relay_bundle_failure(self, plan, local_bundle_path, relay_file):
+        local_bundle_path.return_value = '/home/kevin/test_service/target/test_service.jar'
+        relay_file.side_effect = RelayError('Unable to upload test_service.jar to seed hosts')
+        mock_connections = [MagicMock(host='prod-something-01'), MagicMock(host='prod-something-02')]
+        with patch.object(self.deployer, '_log_error_and_exit', side_effect=SystemExit) as log_error:
+            with pytest.raises(SystemExit):
+                self.deployer._relay_bundle(mock_connections)
+        log_error.assert_called_once_with(mock_connections[0], 'Unable to upload test_service.jar to seed hosts')
+        self.assertEqual(self.deployer._relayed_hosts, set())
+
+    @patch('os.path.getsize')
+    def test_put_bundle_already_relayed(self, getsize):
+        getsize.return_value = 1024
+        mock_connection = MagicMock(host='prod-something-01')
+        self.deployer._relayed_hosts.add('prod-something-01')
+        result = self.deployer._put_bundle(mock_connection, '/home/kevin/test_service/target/test_service.jar')
+        self.assertEqual(result, '/tmp/test_service.jar')
+        self.assertFalse(mock_connection.put.called)
+        self.assertEqual(self.deployer._bytes_saved, 1024)
+
+    @patch('os.path.getsize')
+    @patch('mendel.deployer.base.sha256_of')
+    def test_put_bundle_cache_hit(self, sha256, getsize):
+        sha256.return_value = 'abc123'
+        getsize.return_value = 1024
+        self.deployer.config.bundle_cache = True
+        mock_connection = MagicMock(host='prod-something-01')
+        mock_connection.run.return_value.stdout = 'hit\n'
+        result = self.deployer._put_bundle(mock_connection, '/home/kevin/test_service/target/test_service.jar')
+        self.assertEqual(result, '/tmp/test_service.jar')
+        self.assertIn('cp /srv/releases/.cache/abc123 /tmp/test_service.jar', mock_connection.run.call_args[0][0])
+        self.assertFalse(mock_connection.put.called)
+        self.assertFalse(mock_connection.sudo.called)
+        self.assertEqual(self.deployer._bytes_saved, 1024)
+
+    @patch('mendel.deployer.base.sha256_of')
+    def test_put_bundle_cache_miss(self, sha256):
+        sha256.return_value = 'abc123'
+        self.deployer.config.bundle_cache = True
+        mock_connection = MagicMock(host='prod-something-01')
+        mock_connection.run.return_value.stdout = 'miss\n'
+        self.deployer._put_bundle(mock_connection, '/home/kevin/test_service/target/test_service.jar')
+        self.assertTrue(mock_connection.put.called)
+        self.assertIn('cp /tmp/test_service.jar /srv/releases/.cache/abc123', mock_connection.sudo.call_args[0][0])
+        self.assertEqual(self.deployer._bytes_saved, 0)
+
     def test_change_symlink_to(self):
         mock_connection = MockConnection(host='prod-something-01', sudo=Result())
         result = self.deployer._change_symlink_to(mock_connection, '/srv/blah/my-new-release')
@@ -152,6 +253,10 @@ class BaseDeployerDeployTests(TestCase):
                                     graphite_host='int.graphite.com',
                                     track_event_endpoint='endpoint.com')
         self.deployer = Deployer(config=mock_config)
+        # deploys work out their plan from the local git checkout, which the tests may not be run from
+        commit_hash = patch('mendel.deployer.base.Deployer._get_commit_hash', return_value='123aaa')
+        commit_hash.start()
+        self.addCleanup(commit_hash.stop)
 
     @patch('mendel.deployer.base.Deployer._track_event')
     @patch('mendel.deployer.base.Deployer._start_or_restart')
@@ -180,4 +285,149 @@ class BaseDeployerDeployTests(TestCase):
             self.assertFalse(upload.called)
             self.assertFalse(install.called)
             self.assertFalse(restart.called)
-            self.assertFalse(track.called)
\ No newline at end of file
+            self.assertFalse(track.called)
+
+    @patch('mendel.deployer.base.Deployer._track_event')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.base.Deployer.install')
+    @patch('mendel.deployer.base.Deployer.upload')
+    @patch('mendel.deployer.base.Deployer.build')
+    def test_deploy_many_hosts_builds_once(self, build, upload, install, restart, track):
+        mock_connections = [MockConnection(host='prod-something-%02d' % i, run=Result('200')) for i in range(1, 4)]
+        self.deployer.deploy(mock_connections, parallel='2')
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(upload.call_count, 3)
+        self.assertEqual(install.call_count, 3)
+        self.assertEqual(restart.call_count, 3)
+        self.assertEqual(track.call_count, 3)
+
+    @patch('mendel.deployer.base.Deployer._track_event')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.base.Deployer.install')
+    @patch('mendel.deployer.base.Deployer.upload')
+    @patch('mendel.deployer.base.Deployer.build')
+    def test_deploy_many_hosts_failure(self, build, upload, install, restart, track):
+        mock_connections = [MockConnection(host='prod-something-%02d' % i, run=Result('200')) for i in range(1, 4)]
+        install.side_effect = [None, Exception('disk full'), None]
+        with pytest.raises(SystemExit):
+            self.deployer.deploy(mock_connections)
+        self.assertEqual(install.call_count, 2)
+        self.assertEqual(restart.call_count, 1)
+
+    @patch('mendel.deployer.base.Deployer._get_commit_hash')
+    @patch('mendel.deployer.base.Deployer._track_event')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.base.Deployer.install')
+    @patch('mendel.deployer.base.Deployer.upload')
+    @patch('mendel.deployer.base.Deployer.build')
+    def test_deploy_many_hosts_summary(self, build, upload, install, restart, track, commit_hash):
+        self.deployer.config.notifications = 'summary'
+        self.deployer.project_version = '1.0.0'
+        commit_hash.return_value = '123aaa'
+        install.side_effect = [None, Exception('disk full'), None]
+        mock_connections = [MockConnection(host='prod-something-%02d' % i, run=Result('200')) for i in range(1, 4)]
+        sinks = dict(slack=MagicMock(return_value=True),
+                     graphite=MagicMock(return_value=True),
+                     api=MagicMock(return_value=True))
+        with patch.dict('mendel.deployer.tracking.dispatcher.SINKS', **sinks):
+            with pytest.raises(SystemExit):
+                self.deployer.deploy(mock_connections)
+            self.deployer.tracker.flush()
+        self.assertFalse(track.called)
+        for sink in sinks.values():
+            self.assertEqual(sink.call_count, 1)
+        slack = sinks['slack'].call_args[1]
+        self.assertEqual(slack['deployment_host'], 'prod-something-01')
+        self.assertEqual(slack['failed_hosts'], ['prod-something-02', 'prod-something-03 (skipped)'])
+        api = sinks['api'].call_args[1]
+        self.assertEqual(api['hosts'], [dict(host='prod-something-01', status='ok'),
+                                        dict(host='prod-something-02', status='failed'),
+                                        dict(host='prod-something-03', status='skipped')])
+        self.assertEqual(api['commit_hash'], '123aaa')
+        self.assertEqual(api['project_version'], '1.0.0')
+
+    @patch('mendel.deployer.base.Deployer._is_ready')
+    @patch('mendel.deployer.base.Deployer._track_event')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.base.Deployer.install')
+    @patch('mendel.deployer.base.Deployer.upload')
+    @patch('mendel.deployer.base.Deployer.build')
+    def test_deploy_rolling(self, build, upload, install, restart, track, ready):
+        mock_connections = [MockConnection(host='prod-something-%02d' % i, run=Result('200')) for i in range(1, 5)]
+        ready.side_effect = [True, False, True, True]
+        with pytest.raises(SystemExit):
+            self.deployer.deploy(mock_connections, batch_size='50%')
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(upload.call_count, 4)
+        self.assertEqual(install.call_count, 2)
+        self.assertEqual(ready.call_count, 2)
+
+    def test_restart_waits_until_ready(self):
+        self.deployer.config.use_init = self.deployer.config.use_upstart = False
+        self.deployer.readiness = ReadinessProbe(http='http://localhost:8080/health', log='Started',
+                                                 log_file='/var/log/test_service/output.log')
+        mock_connection = MockConnection(host='prod-something-01',
+                                         sudo=[Result('1024'), Result('__MENDEL_READY__ ready 3')])
+        with patch.object(mock_connection, 'sudo', wraps=mock_connection.sudo) as sudo:
+            self.deployer._start_or_restart(mock_connection)
+        wait = sudo.call_args_list[1][0][0]
+        self.assertIn('curl -fsS', wait)
+        self.assertIn('from=1025', wait)
+        self.assertIn('prod-something-01', self.deployer._ready_times)
+
+    def test_restart_fails_when_never_ready(self):
+        self.deployer.config.use_init = self.deployer.config.use_upstart = False
+        self.deployer.readiness = ReadinessProbe(tcp=8080, deadline=5)
+        mock_connection = MockConnection(host='prod-something-01', sudo=Result('__MENDEL_READY__ timeout 4', exited=1))
+        with pytest.raises(SystemExit):
+            self.deployer._start_or_restart(mock_connection)
+        self.assertNotIn('prod-something-01', self.deployer._ready_times)
+
+    @patch('mendel.deployer.base.Deployer._restart')
+    def test_readiness_deadline_counts_from_the_restart(self, restart):
+        restart.side_effect = lambda connection: time.sleep(1.2)
+        self.deployer.readiness = ReadinessProbe(tcp=8080, deadline=2)
+        mock_connection = MockConnection(host='prod-something-01', sudo=Result('__MENDEL_READY__ ready 1'))
+        with patch.object(mock_connection, 'sudo', wraps=mock_connection.sudo) as sudo:
+            self.deployer._start_or_restart(mock_connection)
+        self.assertIn('deadline=$(( SECONDS + 1 ))', sudo.call_args[0][0])
+
+    @patch('mendel.deployer.base.Deployer._init_system')
+    def test_restart_is_one_invocation(self, init_system):
+        init_system.return_value = 'systemd'
+        self.deployer.config.restart_strategy = 'reload'
+        self.deployer.readiness = ReadinessProbe(http='http://localhost:8080/health')
+        mock_connection = MockConnection(host='prod-something-01',
+                                         sudo=[Result('__MENDEL_RESTART__ gap 250\n__MENDEL_RESTART__ restart 0 300'),
+                                               Result('__MENDEL_READY__ ready 1')])
+        with patch.object(mock_connection, 'sudo', wraps=mock_connection.sudo) as sudo:
+            self.deployer._start_or_restart(mock_connection)
+        self.assertIn('systemctl reload test_service', sudo.call_args_list[0][0][0])
+        self.assertIn('curl -fsS', sudo.call_args_list[0][0][0])
+        self.assertEqual(self.deployer._unavailable_times, {'prod-something-01': 0.2})
+
+    @patch('mendel.deployer.base.Deployer._init_system')
+    def test_restart_samples_readiness_as_the_service_user(self, init_system):
+        init_system.return_value = 'systemd'
+        self.deployer.readiness = ReadinessProbe(tcp=8080)
+        mock_connection = MockConnection(host='prod-something-01',
+                                         sudo=[Result('__MENDEL_RESTART__ gap 0\n__MENDEL_RESTART__ restart 0 300'),
+                                               Result('__MENDEL_READY__ ready 1')])
+        with patch.object(mock_connection, 'sudo', wraps=mock_connection.sudo) as sudo:
+            self.deployer._start_or_restart(mock_connection)
+        script = sudo.call_args_list[0][0][0]
+        # the restart itself still runs as root, only the check switches user
+        self.assertNotIn('user', sudo.call_args_list[0][1])
+        self.assertIn("available() { sudo -u test_service bash -c '", script)
+        self.assertIn('\n( if systemctl is-active --quiet test_service;', script)
+
+    @patch('mendel.deployer.base.Deployer._init_system')
+    def test_restart_command(self, init_system):
+        self.deployer.config.restart_command = 'kill -HUP $(cat /srv/test_service/pid)'
+        mock_connection = MockConnection(host='prod-something-01', sudo=Result('__MENDEL_RESTART__ restart 1 10',
+                                                                               exited=1))
+        with patch.object(mock_connection, 'sudo', wraps=mock_connection.sudo) as sudo:
+            with pytest.raises(SystemExit):
+                self.deployer._start_or_restart(mock_connection)
+        self.assertIn('kill -HUP', sudo.call_args[0][0])
+        self.assertFalse(init_system.called)
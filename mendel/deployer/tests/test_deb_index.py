@@ -0,0 +1,83 @@
+import lzma
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from mendel.deployer.deb_index import DebIndex
+from mendel.deployer.deb_index import DebIndexError
+
+REPOSITORY = 'http://nexus.com/nexus/content/repositories/debs'
+INDEX = b'''Package: other-service
+Version: 3.0.0
+
+Package: my-service
+Version: 1.0.0
+Filename: pool/m/my-service_1.0.0_all.deb
+Size: 1024
+SHA256: aaaa
+
+Package: my-service
+Version: 1.1.0
+Filename: pool/m/my-service_1.1.0_all.deb
+'''
+
+
+def response(status_code=200, data=b'', headers=None):
+    resp = MagicMock(status_code=status_code, headers=headers or {})
+    resp.iter_content.return_value = [data]
+    resp.__enter__.return_value = resp
+    return resp
+
+
+def session(*responses):
+    mock_session = MagicMock()
+    mock_session.get.side_effect = list(responses)
+    return mock_session
+
+
+class DebIndexTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index = DebIndex(path=os.path.join(self.tmp_dir, 'debs.sqlite'))
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_refresh_and_list(self):
+        self.assertFalse(self.index.is_fresh(REPOSITORY, 'my-service'))
+        self.assertTrue(self.index.refresh(REPOSITORY, 'my-service', session=session(
+            response(status_code=404), response(status_code=404), response(data=INDEX))))
+        self.assertTrue(self.index.is_fresh(REPOSITORY, 'my-service'))
+        self.assertEqual(self.index.versions(REPOSITORY, 'my-service'), [
+            dict(Package='my-service', Version='1.0.0', Filename='pool/m/my-service_1.0.0_all.deb',
+                 Size=1024, SHA256='aaaa'),
+            dict(Package='my-service', Version='1.1.0', Filename='pool/m/my-service_1.1.0_all.deb',
+                 Size=None, SHA256=None),
+        ])
+
+    def test_refresh_is_conditional(self):
+        self.index.refresh(REPOSITORY, 'my-service', session=session(
+            response(data=lzma.compress(INDEX), headers={'ETag': '"v1"', 'Last-Modified': 'Mon, 02 Sep 2019'})))
+        mock_session = session(response(status_code=304))
+        self.assertTrue(self.index.refresh(REPOSITORY, 'my-service', session=mock_session))
+        self.assertEqual(mock_session.get.call_args[1]['headers'], {'If-None-Match': '"v1"',
+                                                                    'If-Modified-Since': 'Mon, 02 Sep 2019'})
+        self.assertEqual(len(self.index.versions(REPOSITORY, 'my-service')), 2)
+
+    def test_refresh_keeps_what_is_known_when_nexus_is_down(self):
+        self.index.refresh(REPOSITORY, 'my-service', session=session(response(data=lzma.compress(INDEX))))
+        mock_session = MagicMock()
+        mock_session.get.side_effect = requests.Timeout('slow')
+        self.assertFalse(self.index.refresh(REPOSITORY, 'my-service', session=mock_session))
+        self.assertEqual(len(self.index.versions(REPOSITORY, 'my-service')), 2)
+
+    def test_never_looked_up(self):
+        with pytest.raises(DebIndexError):
+            self.index.versions(REPOSITORY, 'my-service')
@@ -0,0 +1,60 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import pytest
+
+from mendel.deployer.delta import _bytes_sent
+from mendel.deployer.delta import rsync_file
+from mendel.deployer.delta import rsync_tree
+
+
+class DeltaTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.connection = MagicMock(host='prod-something-01', port=2222, user='kevin',
+                                    connect_kwargs={'key_filename': '/home/kevin/.ssh/id_rsa'})
+
+    def test_bytes_sent(self):
+        output = """
+            Number of files: 1 (reg: 1)
+            Total file size: 52,428,800 bytes
+            Total bytes sent: 12,345
+            Total bytes received: 2,016
+        """
+        self.assertEqual(_bytes_sent(output), 12345)
+        self.assertEqual(_bytes_sent('nothing here'), 0)
+
+    @patch('mendel.deployer.delta.sha256_of')
+    def test_rsync_file(self, sha256):
+        sha256.return_value = 'abc123'
+        self.connection.run.return_value.stdout = 'abc123  /tmp/test_service.jar'
+        self.connection.local.return_value.stdout = 'Total bytes sent: 2,048'
+        result = rsync_file(self.connection, 'target/test_service.jar',
+                            '/srv/test_service/releases/20190809-184022/test_service.jar', '/tmp/test_service.jar')
+        self.assertEqual(result, 2048)
+        seed = self.connection.run.call_args_list[0][0][0]
+        self.assertEqual(seed, 'cp /srv/test_service/releases/20190809-184022/test_service.jar /tmp/test_service.jar')
+        rsync = self.connection.local.call_args[0][0]
+        self.assertIn('-e "ssh -p 2222 -o BatchMode=yes -i /home/kevin/.ssh/id_rsa"', rsync)
+        self.assertIn('kevin@prod-something-01:/tmp/test_service.jar', rsync)
+
+    @patch('mendel.deployer.delta.sha256_of')
+    def test_rsync_file_checksum_mismatch(self, sha256):
+        sha256.return_value = 'abc123'
+        self.connection.run.return_value.stdout = 'def456  /tmp/test_service.jar'
+        with pytest.raises(Exception):
+            rsync_file(self.connection, 'target/test_service.jar', '/srv/a.jar', '/tmp/test_service.jar')
+
+    def test_rsync_tree_verify_mismatch(self):
+        self.connection.local.side_effect = [MagicMock(stdout='Total bytes sent: 10'),
+                                             MagicMock(stdout='>fc.T...... lib/test_service.jar')]
+        with pytest.raises(Exception):
+            rsync_tree(self.connection, '/tmp/local', '/srv/test_service/releases/1', '/tmp/remote')
+
+    def test_rsync_tree(self):
+        self.connection.local.side_effect = [MagicMock(stdout='Total bytes sent: 10'), MagicMock(stdout='')]
+        self.assertEqual(rsync_tree(self.connection, '/tmp/local', '/srv/test_service/releases/1', '/tmp/remote'), 10)
+        rsync = self.connection.local.call_args_list[0][0][0]
+        self.assertIn('/tmp/local/ -e', rsync)
+        self.assertIn('kevin@prod-something-01:/tmp/remote/', rsync)
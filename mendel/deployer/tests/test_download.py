@@ -0,0 +1,93 @@
+import hashlib
+import http.server
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from unittest import TestCase
+
+import pytest
+
+from mendel.deployer.download import download_command
+from mendel.deployer.download import parse_download
+
+JAR = b'PK jar bytes' * 1000
+
+
+class DownloadCommandTests(TestCase):
+    """
+    Runs the download commands with the local bash and wget, against a local http server
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        if not shutil.which('wget'):
+            pytest.skip('wget is not installed')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.served = os.path.join(self.tmp_dir, 'served')
+        os.makedirs(self.served)
+        with open(os.path.join(self.served, 'app-1.0.0.jar'), 'wb') as f:
+            f.write(JAR)
+        with open(os.path.join(self.served, 'app-1.0.0.jar.sha1'), 'w') as f:
+            f.write(hashlib.sha1(JAR).hexdigest())
+
+        served = self.served
+
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            def translate_path(self, path):
+                return os.path.join(served, path.lstrip('/'))
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/app-1.0.0.jar'
+        self.downloads = os.path.join(self.tmp_dir, 'downloads')
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_download(self, **kwargs):
+        return subprocess.run(['bash', '-c', download_command(self.url, self.downloads, attempts=2, **kwargs)],
+                              stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+    def test_downloads_then_reuses(self):
+        result = self.run_download()
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertEqual(parse_download(result.stdout), (False, len(JAR)))
+        with open(os.path.join(self.downloads, 'app-1.0.0.jar'), 'rb') as f:
+            self.assertEqual(f.read(), JAR)
+        self.assertEqual(parse_download(self.run_download().stdout), (True, 0))
+
+    def test_resumes_partial_download(self):
+        os.makedirs(self.downloads)
+        with open(os.path.join(self.downloads, 'app-1.0.0.jar'), 'wb') as f:
+            f.write(JAR[:5000])
+        result = self.run_download(checksum=hashlib.sha256(JAR).hexdigest())
+        self.assertEqual(result.returncode, 0, result.stdout)
+        reused, size = parse_download(result.stdout)
+        self.assertFalse(reused)
+        # the simple test server doesn't do ranges, so this is either resumed or downloaded again, but verified
+        with open(os.path.join(self.downloads, 'app-1.0.0.jar'), 'rb') as f:
+            self.assertEqual(f.read(), JAR)
+
+    def test_checksum_mismatch_fails(self):
+        result = self.run_download(checksum='0' * 64)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn('does not match its sha256 checksum', result.stdout)
+
+    def test_without_a_checksum_downloads_from_scratch(self):
+        os.remove(os.path.join(self.served, 'app-1.0.0.jar.sha1'))
+        os.makedirs(self.downloads)
+        with open(os.path.join(self.downloads, 'app-1.0.0.jar'), 'wb') as f:
+            f.write(b'x' * len(JAR))  # a stale snapshot of the same size
+        result = self.run_download()
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertEqual(parse_download(result.stdout), (False, len(JAR)))
+        with open(os.path.join(self.downloads, 'app-1.0.0.jar'), 'rb') as f:
+            self.assertEqual(f.read(), JAR)
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+from invoke import Result
+
+from mendel.deployer.facts import HostFacts
+from mendel.deployer.facts import parse_facts
+from .helpers import MockConnection
+
+UBUNTU_18 = 'os_id=ubuntu\nos_version=18.04\npid1=systemd\n'
+UBUNTU_14 = 'os_id=ubuntu\nos_version=14.04\npid1=init\n'
+
+
+class ParseFactsTests(TestCase):
+    def test_systemd(self):
+        facts = parse_facts(UBUNTU_18)
+        self.assertEqual(facts, dict(os_id='ubuntu', os_version=18.04, init_system='systemd'))
+
+    def test_upstart(self):
+        self.assertEqual(parse_facts(UBUNTU_14)['init_system'], 'upstart')
+
+    def test_unknown_assumes_upstart(self):
+        facts = parse_facts('os_id=\nos_version=\npid1=\n')
+        self.assertEqual(facts, dict(os_id=None, os_version=0.0, init_system='upstart'))
+
+
+class HostFactsTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'facts.json')
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_detects_once(self):
+        facts = HostFacts(path=self.path)
+        mock_connection = MockConnection(host='prod-something-01', run=[Result(UBUNTU_18)])
+        self.assertEqual(facts.get(mock_connection)['init_system'], 'systemd')
+        # the mock only has one result, so a second detection would raise
+        self.assertEqual(facts.get(mock_connection)['init_system'], 'systemd')
+
+    def test_cached_across_runs(self):
+        HostFacts(path=self.path).get(MockConnection(host='prod-something-01', run=[Result(UBUNTU_18)]))
+        mock_connection = MockConnection(host='prod-something-01', run=[])
+        self.assertEqual(HostFacts(path=self.path).get(mock_connection)['os_version'], 18.04)
+
+    def test_expired(self):
+        HostFacts(path=self.path).get(MockConnection(host='prod-something-01', run=[Result(UBUNTU_18)]))
+        mock_connection = MockConnection(host='prod-something-01', run=[Result(UBUNTU_14)])
+        self.assertEqual(HostFacts(path=self.path, ttl=0).get(mock_connection)['init_system'], 'upstart')
+
+    def test_refresh(self):
+        HostFacts(path=self.path).get(MockConnection(host='prod-something-01', run=[Result(UBUNTU_18)]))
+        time.sleep(0.01)
+        facts = HostFacts(path=self.path, refresh=True)
+        mock_connection = MockConnection(host='prod-something-01', run=[Result(UBUNTU_14)])
+        self.assertEqual(facts.get(mock_connection)['init_system'], 'upstart')
+        # refreshed once per run
+        self.assertEqual(facts.get(mock_connection)['init_system'], 'upstart')
+
+    def test_guess_not_cached(self):
+        HostFacts(path=self.path).get(MockConnection(host='prod-something-01', run=[Result('')]))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_unwritable_cache(self):
+        facts = HostFacts(path='/proc/mendel/facts.json')
+        mock_connection = MockConnection(host='prod-something-01', run=[Result(UBUNTU_18)])
+        self.assertEqual(facts.get(mock_connection)['init_system'], 'systemd')
@@ -0,0 +1,95 @@
+import threading
+import time
+from unittest import TestCase
+
+from mendel.deployer.fleet import HostResult
+from mendel.deployer.fleet import as_connections
+from mendel.deployer.fleet import host_count_for
+from mendel.deployer.fleet import run_on_hosts
+from mendel.deployer.fleet import run_rolling
+from .helpers import MockConnection
+
+
+class FleetTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.connections = [MockConnection(host='prod-something-%02d' % i) for i in range(1, 6)]
+
+    def test_as_connections(self):
+        self.assertEqual(as_connections(self.connections[0]), [self.connections[0]])
+        self.assertEqual(as_connections(self.connections), self.connections)
+
+    def test_run_on_hosts_serial(self):
+        seen = []
+        results = run_on_hosts(self.connections, lambda c: seen.append(c.host))
+        self.assertEqual(seen, [c.host for c in self.connections])
+        self.assertEqual([r.host for r in results], [c.host for c in self.connections])
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_run_on_hosts_bounded_concurrency(self):
+        lock = threading.Lock()
+        counts = {'current': 0, 'max': 0}
+
+        def work(connection):
+            with lock:
+                counts['current'] += 1
+                counts['max'] = max(counts['max'], counts['current'])
+            time.sleep(0.05)
+            with lock:
+                counts['current'] -= 1
+
+        results = run_on_hosts(self.connections, work, parallel=2)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(counts['max'], 2)
+
+    def test_run_on_hosts_failure_skips_remaining_hosts(self):
+        def work(connection):
+            if connection.host == 'prod-something-02':
+                raise SystemExit(1)
+
+        results = run_on_hosts(self.connections, work)
+        self.assertEqual([r.status for r in results], [HostResult.OK, HostResult.FAILED, HostResult.SKIPPED,
+                                                       HostResult.SKIPPED, HostResult.SKIPPED])
+        self.assertTrue(isinstance(results[1].error, SystemExit))
+
+    def test_host_count_for(self):
+        self.assertEqual(host_count_for('3', 40), 3)
+        self.assertEqual(host_count_for(3, 40), 3)
+        self.assertEqual(host_count_for('25%', 40), 10)
+        self.assertEqual(host_count_for('10%', 5), 1)
+        self.assertEqual(host_count_for('0', 5), 1)
+        self.assertEqual(host_count_for('100', 5), 5)
+
+    def test_run_rolling_batches(self):
+        batches = []
+
+        def work(connection):
+            batches.append(connection.host)
+
+        results = run_rolling(self.connections, work, batch_size='40%')
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual([r.host for r in results], [c.host for c in self.connections])
+        self.assertEqual(len(batches), 5)
+
+    def test_run_rolling_gate_failure_stops_rollout(self):
+        results = run_rolling(self.connections, lambda c: None, batch_size=2,
+                              gate=lambda c: c.host != 'prod-something-01')
+        self.assertEqual([r.status for r in results], [HostResult.FAILED, HostResult.OK, HostResult.SKIPPED,
+                                                       HostResult.SKIPPED, HostResult.SKIPPED])
+
+    def test_run_rolling_max_unavailable_shrinks_batches(self):
+        def work(connection):
+            if connection.host == 'prod-something-01':
+                raise Exception('boom')
+
+        results = run_rolling(self.connections, work, batch_size=2, max_unavailable=2)
+        self.assertEqual([r.status for r in results], [HostResult.FAILED, HostResult.OK, HostResult.OK,
+                                                       HostResult.OK, HostResult.OK])
+
+    def test_run_rolling_max_unavailable_exhausted(self):
+        def work(connection):
+            raise Exception('boom')
+
+        results = run_rolling(self.connections, work, batch_size=1, max_unavailable=2)
+        self.assertEqual([r.status for r in results], [HostResult.FAILED, HostResult.FAILED, HostResult.SKIPPED,
+                                                       HostResult.SKIPPED, HostResult.SKIPPED])
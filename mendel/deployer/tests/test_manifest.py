@@ -0,0 +1,62 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+from mendel.deployer.manifest import ReleaseManifest
+from mendel.deployer.manifest import read_command
+from mendel.deployer.manifest import write_command
+
+
+class ReleaseManifestTests(TestCase):
+    def test_record_and_latest_ok(self):
+        manifest = ReleaseManifest(releases=[dict(name='20190901-120000-kevin-aaaa', ok=None)])
+        manifest.record('20190902-120000-kevin-bbbb', version='1.0.0', commit='bbbb', checksum='abc', size=10, ok=True)
+        manifest.record('20190903-120000-kevin-cccc', version='1.1.0', ok=False)
+        self.assertEqual(manifest.latest_ok(), '20190902-120000-kevin-bbbb')
+        self.assertEqual(manifest.names, ['20190901-120000-kevin-aaaa', '20190902-120000-kevin-bbbb',
+                                          '20190903-120000-kevin-cccc'])
+        manifest.record('20190903-120000-kevin-cccc', version='1.1.0', ok=True)
+        self.assertEqual(len(manifest.releases), 3)
+        self.assertEqual(manifest.latest_ok(), '20190903-120000-kevin-cccc')
+
+    def test_stage_and_activate(self):
+        manifest = ReleaseManifest(current='20190901-120000-kevin-aaaa',
+                                   releases=[dict(name='20190901-120000-kevin-aaaa', ok=True)])
+        self.assertIsNone(manifest.latest_staged())
+        manifest.record('20190902-120000-kevin-bbbb', version='1.0.0', staged=True)
+        self.assertEqual(manifest.latest_staged(), '20190902-120000-kevin-bbbb')
+        self.assertEqual(manifest.current, '20190901-120000-kevin-aaaa')
+        manifest.activate('20190902-120000-kevin-bbbb', ok=True)
+        self.assertIsNone(manifest.latest_staged())
+        self.assertEqual(manifest.current, '20190902-120000-kevin-bbbb')
+        self.assertEqual(manifest.latest_ok(), '20190902-120000-kevin-bbbb')
+
+    def test_previous(self):
+        manifest = ReleaseManifest(releases=[dict(name='a', ok=None), dict(name='b', ok=True), dict(name='c', ok=False),
+                                             dict(name='d', ok=True), dict(name='e', staged=True)])
+        self.assertEqual(manifest.previous('d'), 'b')
+        self.assertEqual(manifest.previous('b'), 'a')
+        self.assertIsNone(manifest.previous('a'))
+
+    def test_parse(self):
+        manifest = ReleaseManifest(current='a', releases=[dict(name='a', ok=True)])
+        parsed = ReleaseManifest.parse(manifest.dumps())
+        self.assertEqual((parsed.current, parsed.releases), ('a', [dict(name='a', ok=True)]))
+        self.assertIsNone(ReleaseManifest.parse(''))
+        self.assertIsNone(ReleaseManifest.parse('{"something": "else"}'))
+
+    def test_write_and_read_commands(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'releases.json')
+            self.assertEqual(subprocess.check_output(read_command(path), shell=True), b'')
+            manifest = ReleaseManifest(current="it's", releases=[dict(name="it's", ok=True)])
+            subprocess.check_call(write_command(path, manifest), shell=True)
+            self.assertEqual(json.loads(subprocess.check_output(read_command(path), shell=True).decode()),
+                             json.loads(manifest.dumps()))
+            self.assertEqual(os.listdir(tmp_dir), ['releases.json'])
+        finally:
+            shutil.rmtree(tmp_dir)
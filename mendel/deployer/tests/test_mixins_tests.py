@@ -1,13 +1,18 @@
 import os
+import tempfile
 from unittest import TestCase
 from unittest.mock import MagicMock
 from unittest.mock import patch
 from xml.etree.ElementTree import ElementTree
 
+import pytest
+import requests
 from invoke import Result
 
 from mendel.config.service_config import ServiceConfig
+from mendel.deployer.manifest import ReleaseManifest
 from mendel.deployer.mixins.nexus import NexusMixin
+from mendel.deployer.mixins.nexus import parse_pom
 from mendel.deployer.remote_jar import RemoteJarDeployer
 from .helpers import MockConnection
 
@@ -59,8 +64,32 @@ class NexusMixinTests(TestCase):
                                 cwd='.')
         nexus_mixin = NexusMixin()
         nexus_mixin.config = mock_config
+        nexus_mixin._nexus_cache = MagicMock()
+        nexus_mixin._nexus_cache.metadata.return_value = meta
         res = nexus_mixin._find_latest_nexus_version(mock_connection)
         self.assertEqual(res, '2.7.0')
+        nexus_mixin._nexus_cache.metadata.assert_called_once_with('nexus.com/maven-metadata.xml')
+
+    @patch('mendel.deployer.mixins.nexus.ElementTree')
+    @patch('mendel.deployer.mixins.nexus.NexusMixin._generate_base_nexus_url')
+    def test_find_latest_nexus_version_through_host(self, mock_nexus_url, mock_tree):
+        root_path = os.path.dirname(os.path.abspath(__file__))
+        mock_nexus_url.return_value = 'nexus.com'
+        with open(os.path.join(root_path, 'fixtures', 'maven_metadata.xml'), 'r') as f:
+            meta = f.read()
+        mock_connection = MockConnection(run=Result(meta))
+        nexus_mixin = NexusMixin()
+        nexus_mixin.config = MagicMock(cwd='.')
+        nexus_mixin._nexus_cache = MagicMock()
+        nexus_mixin._nexus_cache.metadata.side_effect = requests.ConnectionError()
+        self.assertEqual(nexus_mixin._find_latest_nexus_version(mock_connection), '2.7.0')
+
+    def test_pom_is_parsed_once(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pom_path = os.path.join(tmp_dir, 'pom.xml')
+            with open(pom_path, 'w') as f:
+                f.write('<project><version>1.0.0</version></project>')
+            self.assertIs(parse_pom(pom_path), parse_pom(pom_path))
 
 
 class SymlinkRollbackMixinTests(TestCase):
@@ -92,3 +121,81 @@ class SymlinkRollbackMixinTests(TestCase):
         current = "20190809-184022-user-be07d4d1fa4b0-2.9.9"
         result = self.deployer._display_releases_for_rollback_selection(releases, current)
         self.assertEqual(result, 3)
+
+    @patch('builtins.input')
+    @patch('mendel.deployer.base.Deployer._track_event')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.base.Deployer._change_symlink_to')
+    @patch('mendel.deployer.base.Deployer._write_manifest')
+    def test_rollback_from_manifest(self, write_manifest, change_symlink, restart, track, mock_input):
+        manifest = ReleaseManifest(current='20190322-134809-user1-ada7933-1.1.8',
+                                   releases=[dict(name='20190320-181250-user2-24e98ff-1.1.7', ok=True),
+                                             dict(name='20190322-134809-user1-ada7933-1.1.8', ok=True)])
+        mock_input.return_value = '20190320-181250-user2-24e98ff-1.1.7'
+        # only the manifest is read from the host
+        mock_connection = MockConnection(host='prod-something-01', sudo=Result(manifest.dumps()))
+        self.deployer.symlink_rollback(mock_connection)
+        change_symlink.assert_called_once_with(mock_connection, '/srv/releases/20190320-181250-user2-24e98ff-1.1.7')
+        self.assertEqual(write_manifest.call_args[0][1].current, '20190320-181250-user2-24e98ff-1.1.7')
+
+    @patch('mendel.deployer.base.Deployer._track_event')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.base.Deployer._change_symlink_to')
+    @patch('mendel.deployer.base.Deployer._write_manifest')
+    def test_fleet_rollback_to_previous(self, write_manifest, change_symlink, restart, track):
+        releases = [dict(name='20190320-181250-user2-24e98ff-1.1.7', ok=True),
+                    dict(name='20190321-100000-user2-5555555-1.1.8', ok=False),
+                    dict(name='20190322-134809-user1-ada7933-1.1.8', ok=True),
+                    dict(name='20190323-100000-user1-6666666-1.1.9', staged=True)]
+        on_new = ReleaseManifest(current='20190322-134809-user1-ada7933-1.1.8', releases=releases)
+        connections = [MockConnection(host='prod-something-01', sudo=Result(on_new.dumps())),
+                       MockConnection(host='prod-something-02', sudo=Result(on_new.dumps()))]
+        self.deployer.rollback(connections, to='previous')
+        # the release that failed to deploy and the staged one are skipped over
+        self.assertEqual({c[0][1] for c in change_symlink.call_args_list},
+                         {'/srv/releases/20190320-181250-user2-24e98ff-1.1.7'})
+        self.assertEqual(restart.call_count, 2)
+
+    @patch('mendel.deployer.base.Deployer._change_symlink_to')
+    def test_fleet_rollback_to_previous_needs_hosts_on_one_release(self, change_symlink):
+        releases = [dict(name='20190320-181250-user2-24e98ff-1.1.7'), dict(name='20190322-134809-user1-ada7933-1.1.8')]
+        on_new = ReleaseManifest(current='20190322-134809-user1-ada7933-1.1.8', releases=releases)
+        on_old = ReleaseManifest(current='20190320-181250-user2-24e98ff-1.1.7', releases=releases)
+        connections = [MockConnection(host='prod-something-01', sudo=Result(on_new.dumps())),
+                       MockConnection(host='prod-something-02', sudo=Result(on_old.dumps()))]
+        with patch.object(self.deployer, '_log_error_and_exit', side_effect=SystemExit) as log_error:
+            with pytest.raises(SystemExit):
+                self.deployer.rollback(connections, to='previous')
+        message = log_error.call_args[0][1]
+        self.assertIn('prod-something-01 on 20190322-134809-user1-ada7933-1.1.8', message)
+        self.assertIn('prod-something-02 on 20190320-181250-user2-24e98ff-1.1.7', message)
+        self.assertFalse(change_symlink.called)
+
+    @patch('mendel.deployer.base.Deployer._track_event')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.base.Deployer._change_symlink_to')
+    @patch('mendel.deployer.base.Deployer._write_manifest')
+    def test_fleet_rollback_to_named_release(self, write_manifest, change_symlink, restart, track):
+        releases = [dict(name='20190320-181250-user2-24e98ff-1.1.7'), dict(name='20190322-134809-user1-ada7933-1.1.8')]
+        on_new = ReleaseManifest(current='20190322-134809-user1-ada7933-1.1.8', releases=releases)
+        on_old = ReleaseManifest(current='20190320-181250-user2-24e98ff-1.1.7', releases=releases)
+        connections = [MockConnection(host='prod-something-01', sudo=Result(on_new.dumps())),
+                       MockConnection(host='prod-something-02', sudo=Result(on_new.dumps())),
+                       MockConnection(host='prod-something-03', sudo=Result(on_old.dumps()))]
+        self.deployer.rollback(connections, to='20190320-181250-user2-24e98ff-1.1.7')
+        # the host already on it is left alone
+        self.assertEqual({c[0][0].host for c in change_symlink.call_args_list}, {'prod-something-01',
+                                                                                 'prod-something-02'})
+        self.assertEqual({c[0][1] for c in change_symlink.call_args_list},
+                         {'/srv/releases/20190320-181250-user2-24e98ff-1.1.7'})
+        self.assertEqual(restart.call_count, 2)
+
+    @patch('mendel.deployer.base.Deployer._change_symlink_to')
+    def test_fleet_rollback_checks_every_host_first(self, change_symlink):
+        on_one = ReleaseManifest(current='b', releases=[dict(name='a'), dict(name='b')])
+        on_other = ReleaseManifest(current='b', releases=[dict(name='b')])
+        connections = [MockConnection(host='prod-something-01', sudo=Result(on_one.dumps())),
+                       MockConnection(host='prod-something-02', sudo=Result(on_other.dumps()))]
+        with pytest.raises(SystemExit):
+            self.deployer.rollback(connections, to='a')
+        self.assertFalse(change_symlink.called)
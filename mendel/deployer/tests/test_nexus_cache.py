@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import pytest
+import requests
+
+from mendel.deployer.nexus_cache import NexusCache
+
+METADATA_URL = 'http://nexus.com/com/mycompany/best-jar-ever/maven-metadata.xml'
+JAR_URL = 'http://nexus.com/com/mycompany/best-jar-ever/1.2.0/best-jar-ever-1.2.0.jar'
+METADATA = '<metadata><versioning><latest>1.2.0</latest></versioning></metadata>'
+
+
+def response(status_code=200, text='', headers=None):
+    return MagicMock(status_code=status_code, text=text, headers=headers or {})
+
+
+class NexusCacheTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'nexus.json')
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('requests.get')
+    def test_metadata_is_revalidated(self, get):
+        get.side_effect = [response(text=METADATA, headers={'ETag': '"abc"', 'Last-Modified': 'Mon, 02 Sep 2019'}),
+                           response(status_code=304)]
+        self.assertEqual(NexusCache(path=self.path).metadata(METADATA_URL), METADATA)
+        self.assertEqual(NexusCache(path=self.path).metadata(METADATA_URL), METADATA)
+        self.assertEqual(get.call_args[1]['headers'], {'If-None-Match': '"abc"',
+                                                       'If-Modified-Since': 'Mon, 02 Sep 2019'})
+
+    @patch('requests.get')
+    def test_metadata_falls_back_to_cached_copy(self, get):
+        get.side_effect = [response(text=METADATA, headers={'ETag': '"abc"'}), requests.ConnectionError()]
+        cache = NexusCache(path=self.path)
+        cache.metadata(METADATA_URL)
+        self.assertEqual(cache.metadata(METADATA_URL), METADATA)
+
+    @patch('requests.get')
+    def test_metadata_unreachable_and_not_cached(self, get):
+        get.side_effect = requests.ConnectionError()
+        with pytest.raises(requests.RequestException):
+            NexusCache(path=self.path).metadata(METADATA_URL)
+
+    @patch('requests.head')
+    def test_found_release_is_not_looked_for_again(self, head):
+        head.return_value = response()
+        self.assertTrue(NexusCache(path=self.path).artifact_exists(JAR_URL))
+        self.assertTrue(NexusCache(path=self.path).artifact_exists(JAR_URL))
+        self.assertEqual(head.call_count, 1)
+
+    @patch('requests.head')
+    def test_missing_and_snapshot_artifacts_are_looked_for_every_time(self, head):
+        head.side_effect = [response(status_code=404), response(status_code=404), response(), response()]
+        cache = NexusCache(path=self.path)
+        self.assertFalse(cache.artifact_exists(JAR_URL))
+        self.assertFalse(cache.artifact_exists(JAR_URL))
+        snapshot_url = JAR_URL.replace('1.2.0', '1.3.0-SNAPSHOT')
+        self.assertTrue(cache.artifact_exists(snapshot_url))
+        self.assertTrue(cache.artifact_exists(snapshot_url))
+        self.assertEqual(head.call_count, 4)
@@ -0,0 +1,61 @@
+import gzip
+import lzma
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from mendel.deployer.packages_index import iter_lines
+from mendel.deployer.packages_index import iter_stanzas
+from mendel.deployer.packages_index import open_index
+
+INDEX = '''Package: other-service
+Version: 3.0.0
+Filename: pool/o/other-service_3.0.0_all.deb
+
+Package: my-service
+Version: 1.0.0
+Filename: pool/m/my-service_1.0.0_all.deb
+Description: my service
+ with a long description
+
+Package: my-service-tools
+Version: 9.0.0
+
+Package: my-service
+Version: 1.1.0
+Filename: pool/m/my-service_1.1.0_all.deb
+'''
+
+
+def chunked(data, size=7):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def response(status_code=200, data=b''):
+    resp = MagicMock(status_code=status_code)
+    resp.iter_content.return_value = chunked(data)
+    resp.__enter__.return_value = resp
+    return resp
+
+
+class PackagesIndexTests(TestCase):
+    def test_only_keeps_the_package(self):
+        stanzas = list(iter_stanzas(INDEX.splitlines(), 'my-service'))
+        self.assertEqual([s['Version'] for s in stanzas], ['1.0.0', '1.1.0'])
+        self.assertEqual(stanzas[0]['Description'], 'my service\n with a long description')
+
+    def test_lines_across_chunks(self):
+        for name, data in (('Packages', INDEX.encode()),
+                           ('Packages.gz', gzip.compress(INDEX.encode())),
+                           ('Packages.xz', lzma.compress(INDEX.encode()))):
+            self.assertEqual(list(iter_lines(chunked(data), name)), INDEX.splitlines())
+
+    def test_open_index_uses_first_index_available(self):
+        session = MagicMock()
+        session.get.side_effect = [response(status_code=404), response(data=gzip.compress(INDEX.encode()))]
+        name, resp = open_index(session, 'http://nexus.com/repo/', auth=('user', 'pass'))
+        self.assertEqual(name, 'Packages.gz')
+        self.assertEqual(list(iter_lines(resp.iter_content(), name)), INDEX.splitlines())
+        self.assertEqual([c[0][0] for c in session.get.call_args_list],
+                         ['http://nexus.com/repo/Packages.xz', 'http://nexus.com/repo/Packages.gz'])
+        self.assertEqual(session.get.call_args[1]['auth'], ('user', 'pass'))
+        self.assertTrue(session.get.call_args[1]['stream'])
@@ -0,0 +1,77 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from unittest import TestCase
+
+import pytest
+
+from mendel.config.service_config import ServiceConfig
+from mendel.deployer.readiness import ReadinessProbe
+from mendel.deployer.readiness import parse_wait
+
+
+class ReadinessProbeTests(TestCase):
+    """
+    Runs the probe commands with the local bash
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.tmp_dir, 'output.log')
+        with open(self.log_file, 'w') as f:
+            f.write('Started Application\n')
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_wait(self, probe, log_offset=None, deadline=None):
+        result = subprocess.run(['bash', '-c', probe.wait_command(log_offset, deadline)], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True)
+        return result.returncode, parse_wait(result.stdout)
+
+    def test_from_config(self):
+        config = ServiceConfig(service_name='myservice', readiness=dict(log='Started', deadline=60))
+        probe = ReadinessProbe.from_config(config)
+        self.assertEqual((probe.log_file, probe.deadline, probe.interval), ('/var/log/myservice/output.log', 60, 1))
+        self.assertIsNone(ReadinessProbe.from_config(ServiceConfig(service_name='myservice')))
+        with pytest.raises(ValueError):
+            ReadinessProbe.from_config(ServiceConfig(service_name='myservice', readiness=dict(htp='oops')))
+        with pytest.raises(ValueError):
+            ReadinessProbe.from_config(ServiceConfig(service_name='myservice', readiness=dict(deadline=60)))
+
+    def test_only_new_log_lines_count(self):
+        probe = ReadinessProbe(log='Started Application', log_file=self.log_file, deadline=1)
+        self.assertEqual(self.run_wait(probe, log_offset=0), (0, (True, 1)))
+        self.assertEqual(self.run_wait(probe, log_offset=os.path.getsize(self.log_file))[0], 1)
+
+    def test_tcp_and_command(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        try:
+            port = listener.getsockname()[1]
+            probe = ReadinessProbe(tcp=f'127.0.0.1:{port}', command=f'test -f {self.log_file}', deadline=1)
+            self.assertEqual(self.run_wait(probe), (0, (True, 1)))
+        finally:
+            listener.close()
+        self.assertEqual(self.run_wait(probe)[0], 1)
+
+    def test_backs_off_until_the_deadline(self):
+        probe = ReadinessProbe(command='false', deadline=3, interval=1, max_interval=2)
+        start = time.time()
+        returncode, (ready, attempts) = self.run_wait(probe)
+        self.assertEqual((returncode, ready), (1, False))
+        # checked at 0s, 1s and 3s
+        self.assertEqual(attempts, 3)
+        self.assertLess(time.time() - start, 6)
+
+    def test_shorter_deadline_still_checks_once(self):
+        probe = ReadinessProbe(command='false', deadline=300)
+        start = time.time()
+        self.assertEqual(self.run_wait(probe, deadline=-5), (1, (False, 1)))
+        self.assertLess(time.time() - start, 2)
@@ -0,0 +1,58 @@
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+import pytest
+
+from mendel.deployer.relay import RelayError
+from mendel.deployer.relay import relay_file
+from mendel.util.misc import sha256_of
+
+
+class RelayTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        fd, self.bundle = tempfile.mkstemp(suffix='.jar')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'not really a jar')
+        self.checksum = sha256_of(self.bundle)
+
+    def tearDown(self) -> None:
+        os.remove(self.bundle)
+        super().tearDown()
+
+    def _connections(self, count, checksum=None):
+        connections = []
+        for i in range(1, count + 1):
+            connection = MagicMock(host='prod-something-%02d' % i, port=22, user='deployer', forward_agent=False)
+            connection.run.return_value.stdout = '%s  /tmp/bundle.jar' % (checksum or self.checksum)
+            connections.append(connection)
+        return connections
+
+    def test_uploads_once_per_seed(self):
+        connections = self._connections(7)
+        hosts = relay_file(connections, self.bundle, '/tmp', seeds=1)
+        self.assertEqual(set(hosts), {c.host for c in connections})
+        self.assertEqual(connections[0].put.call_count, 1)
+        self.assertTrue(all(c.put.call_count == 0 for c in connections[1:]))
+        self.assertTrue(all(c.run.called for c in connections[1:]))
+
+    def test_copies_from_a_peer(self):
+        connections = self._connections(2)
+        relay_file(connections, self.bundle, '/tmp/', seeds=1)
+        scp = connections[1].run.call_args_list[0][0][0]
+        self.assertIn('deployer@prod-something-01:/tmp/%s' % os.path.basename(self.bundle), scp)
+        self.assertIn('StrictHostKeyChecking=accept-new', scp)
+        self.assertFalse(connections[1].forward_agent)  # only forwarded for the copy
+
+    def test_checksum_mismatch_is_not_relayed(self):
+        connections = self._connections(3, checksum='abc123')
+        hosts = relay_file(connections, self.bundle, '/tmp', seeds=1)
+        self.assertEqual(hosts, ['prod-something-01'])
+
+    def test_failed_seed_upload(self):
+        connections = self._connections(3)
+        connections[0].put.side_effect = IOError('connection reset')
+        with pytest.raises(RelayError):
+            relay_file(connections, self.bundle, '/tmp', seeds=1)
@@ -0,0 +1,129 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import pytest
+
+from invoke import Result
+
+from mendel.config.service_config import ServiceConfig
+from mendel.deployer.deb_index import DebIndex
+from mendel.deployer.remote_deb import RemoteDebDeployer
+from .helpers import MockConnection
+
+
+class RemoteDebDeployerTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        mock_config = ServiceConfig(service_name='my-service', deployment_user='kevin', nexus_user='kevin',
+                                    nexus_host='nexus.com', nexus_port='8081', nexus_repository='debs')
+        self.deployer = RemoteDebDeployer(service_name='my-service', config=mock_config)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.deployer.deb_index = DebIndex(path=os.path.join(self.tmp_dir, 'debs.sqlite'))
+        self.connection = MockConnection(host='prod-something-01')
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    @patch('getpass.getpass')
+    @patch('mendel.deployer.deb_index.DebIndex.versions')
+    @patch('mendel.deployer.deb_index.DebIndex.refresh')
+    @patch('mendel.deployer.deb_index.DebIndex.is_fresh')
+    def test_fresh_index_is_used_without_asking_nexus(self, is_fresh, refresh, versions, getpass):
+        is_fresh.return_value = True
+        versions.return_value = [dict(Version='1.0.0'), dict(Version='1.1.0')]
+        result = self.deployer._get_available_nexus_versions(self.connection, current_version='1.1.0')
+        self.assertEqual(result, versions.return_value)
+        self.assertFalse(refresh.called)
+        self.assertFalse(getpass.called)
+
+    @patch.dict('os.environ', {'MENDEL_NEXUS_PASSWORD': 'secret'})
+    @patch('mendel.deployer.deb_index.DebIndex.versions')
+    @patch('mendel.deployer.deb_index.DebIndex.refresh')
+    @patch('mendel.deployer.deb_index.DebIndex.is_fresh')
+    def test_refreshed_when_current_version_is_unknown(self, is_fresh, refresh, versions):
+        is_fresh.return_value = True
+        versions.return_value = [dict(Version='1.0.0')]
+        self.deployer._get_available_nexus_versions(self.connection, current_version='1.1.0')
+        refresh.assert_called_once_with('http://nexus.com:8081/nexus/content/repositories/debs', 'my-service',
+                                        auth=('kevin', 'secret'))
+
+    def test_full_apt_update_by_default(self):
+        self.connection = MockConnection(host='prod-something-01', sudo=Result(''))
+        with patch.object(self.connection, 'sudo', wraps=self.connection.sudo) as sudo:
+            self.deployer._apt_update(self.connection, version='1.1.0')
+        sudo.assert_called_once_with('apt-get update', hide='stdout')
+
+    def test_scoped_apt_update(self):
+        self.deployer.config.apt_source_list = '/etc/apt/sources.list.d/nexus.list'
+        self.deployer.config.apt_update_max_age = 300
+        self.connection = MockConnection(host='prod-something-01', sudo=Result('fresh\n'))
+        with patch.object(self.connection, 'sudo', wraps=self.connection.sudo) as sudo:
+            self.deployer._apt_update(self.connection, version='1.1.0')
+        command = sudo.call_args[0][0]
+        self.assertIn('-lt 300 ]', command)
+        self.assertIn('grep -qxF 1.1.0', command)
+        self.assertIn('apt-get update -o Dir::Etc::sourcelist=/etc/apt/sources.list.d/nexus.list '
+                      '-o Dir::Etc::sourceparts=- -o APT::Get::List-Cleanup=0', command)
+        self.assertIn('touch /var/lib/apt/lists/.mendel-my-service', command)
+
+    def test_latest_package_always_refreshes_the_source(self):
+        self.deployer.config.apt_source_list = '/etc/apt/sources.list.d/nexus.list'
+        self.connection = MockConnection(host='prod-something-01', sudo=[Result(''), Result(''), Result('')])
+        with patch.object(self.connection, 'sudo', wraps=self.connection.sudo) as sudo:
+            self.deployer._apt_prefetch(self.connection)
+            self.deployer._apt_install_latest(self.connection)
+        self.assertEqual(sudo.call_count, 3)
+        update = sudo.call_args_list[0][0][0]
+        self.assertNotIn('fresh', update)
+        self.assertIn('apt-get update -o Dir::Etc::sourcelist=/etc/apt/sources.list.d/nexus.list', update)
+        self.assertIn('--only-upgrade', sudo.call_args_list[2][0][0])  # not refreshed again after the prefetch
+
+    def test_upload_prefetches_on_every_host(self):
+        self.deployer.config.project_type = 'java'
+        connections = [MockConnection(host='prod-something-01', sudo=[Result(''), Result('')]),
+                       MockConnection(host='prod-something-02', sudo=[Result(''), Result('')])]
+        for connection in connections:
+            with patch.object(connection, 'local') as local, \
+                    patch.object(connection, 'sudo', wraps=connection.sudo) as sudo:
+                self.deployer.upload(connection)
+            self.assertIn('--download-only --only-upgrade my-service', sudo.call_args[0][0])
+        self.assertEqual(local.call_count, 0)  # mvn deploy only ran for the first host
+
+    @patch('mendel.deployer.remote_deb.RemoteDebDeployer._apt_install')
+    @patch('mendel.deployer.remote_deb.RemoteDebDeployer._get_available_nexus_versions')
+    @patch('mendel.deployer.remote_deb.RemoteDebDeployer._get_current_package_version')
+    def test_rollback_to_previous_once_for_every_host(self, current_version, available, apt_install):
+        current_version.return_value = '1.1.0'
+        available.return_value = [dict(Version='1.0.0'), dict(Version='1.1.0')]
+        connections = [MockConnection(host='prod-something-01'), MockConnection(host='prod-something-02')]
+        with patch.object(self.deployer, '_track_event'):
+            self.deployer.rollback(connections, to='previous')
+        self.assertEqual(available.call_count, 1)
+        self.assertEqual({c[1]['version'] for c in apt_install.call_args_list}, {'1.0.0'})
+        self.assertEqual(apt_install.call_count, 2)
+
+    @patch('mendel.deployer.remote_deb.RemoteDebDeployer._apt_install')
+    @patch('mendel.deployer.remote_deb.RemoteDebDeployer._get_available_nexus_versions')
+    @patch('mendel.deployer.remote_deb.RemoteDebDeployer._get_current_package_version')
+    def test_rollback_to_previous_is_checked_first(self, current_version, available, apt_install):
+        available.return_value = [dict(Version='1.0.0'), dict(Version='1.1.0')]
+        connections = [MockConnection(host='prod-something-01'), MockConnection(host='prod-something-02')]
+        with patch.object(self.deployer, '_log_error_and_exit', side_effect=SystemExit(1)) as error:
+            for installed in (['1.0.0', '1.1.0'], ['1.0.0', '1.0.0'], ['0.9.0', '0.9.0']):
+                current_version.side_effect = installed
+                with pytest.raises(SystemExit):
+                    self.deployer.rollback(connections, to='previous')
+            current_version.side_effect = None
+            current_version.return_value = '1.1.0'
+            with pytest.raises(SystemExit):
+                self.deployer.rollback(connections, to='2.0.0')
+        messages = [c[0][1] for c in error.call_args_list]
+        self.assertIn('hosts have different versions installed', messages[0])
+        self.assertIn('no version before 1.0.0', messages[1])
+        self.assertIn('0.9.0 is not in the repository', messages[2])
+        self.assertIn('invalid rollback selection: 2.0.0', messages[3])
+        self.assertFalse(apt_install.called)
@@ -1,9 +1,17 @@
+import shutil
+import tempfile
 from unittest import TestCase
+from unittest.mock import ANY
+from unittest.mock import MagicMock
 from unittest.mock import patch
 
+import pytest
 from invoke import Result
 
 from mendel.config.service_config import ServiceConfig
+from mendel.deployer.manifest import ReleaseManifest
+from mendel.deployer.nexus_cache import NexusCache
+from mendel.deployer.plan import DeploymentPlan
 from mendel.deployer.remote_jar import RemoteJarDeployer
 from .helpers import MockConnection
 
@@ -25,13 +33,21 @@ class BaseDeployerDeployTests(TestCase):
                                     graphite_host='int.graphite.com',
                                     track_event_endpoint='endpoint.com')
         self.deployer = RemoteJarDeployer(config=mock_config)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.deployer._nexus_cache = NexusCache(path=self.tmp_dir + '/nexus.json')
 
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        super().tearDown()
+
+    @patch('mendel.deployer.base.Deployer._record_release')
+    @patch('mendel.deployer.base.Deployer._get_plan')
     @patch('mendel.deployer.base.Deployer._track_event')
     @patch('mendel.deployer.base.Deployer._start_or_restart')
     @patch('mendel.deployer.remote_jar.RemoteJarDeployer.install')
     @patch('mendel.deployer.remote_jar.RemoteJarDeployer.upload')
     @patch('mendel.deployer.base.Deployer.build')
-    def test_deploy_polymorphism(self, build, upload, install, restart, track):
+    def test_deploy_polymorphism(self, build, upload, install, restart, track, plan, record):
         mock_connection = MockConnection(host='prod-something-01', run=Result('200'))
         result = self.deployer.deploy(mock_connection)
         self.assertTrue(build.called)
@@ -39,19 +55,23 @@ class BaseDeployerDeployTests(TestCase):
         self.assertTrue(install.called)
         self.assertTrue(restart.called)
         self.assertTrue(track.called)
+        record.assert_called_once_with(mock_connection, ok=True)
 
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._get_artifact_url')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._resolve_version')
     @patch('mendel.deployer.base.Deployer._get_commit_hash')
-    def test_new_release_dir(self, mock_commit_hash):
+    def test_release_dir_has_version(self, mock_commit_hash, resolve_version, artifact_url):
         mock_commit_hash.return_value = '1232435zzz'
+        resolve_version.return_value = '2.9.9'
         mock_connection = MockConnection(host='prod-something-01')
-        self.deployer.project_version = '2.9.9'
-        result = self.deployer._new_release_dir(mock_connection)
-        self.assertTrue('kevin-1232435zzz-2.9.9' in result)
+        plan = self.deployer._get_plan(mock_connection)
+        self.assertTrue(plan.release_dir.endswith('kevin-1232435zzz-2.9.9'))
+        self.assertEqual(plan.version, '2.9.9')
 
     @patch('requests.head')
-    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._generate_nexus_url')
-    def test_already_deployed(self, nexus_url, head_req):
-        nexus_url.return_value = 'http://int.my_nexus.com'
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._get_plan')
+    def test_already_deployed(self, plan, head_req):
+        plan.return_value = DeploymentPlan(artifact_url='http://int.my_nexus.com')
         head_req.return_value.status_code = 200
         mock_connection = MockConnection(host='prod-something-01')
         result = self.deployer.already_deployed(mock_connection)
@@ -60,11 +80,193 @@ class BaseDeployerDeployTests(TestCase):
         self.assertTrue(self.deployer._already_deployed)
 
     @patch('requests.head')
-    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._generate_nexus_url')
-    def test_not_already_deployed(self, nexus_url, head_req):
-        nexus_url.return_value = 'http://int.my_nexus.com'
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._get_plan')
+    def test_already_deployed_is_remembered_across_runs(self, plan, head_req):
+        plan.return_value = DeploymentPlan(artifact_url='http://int.my_nexus.com/test_service-1.0.0.jar')
+        head_req.return_value.status_code = 200
+        mock_connection = MockConnection(host='prod-something-01')
+        self.assertTrue(self.deployer.already_deployed(mock_connection))
+
+        next_run = RemoteJarDeployer(config=self.deployer.config)
+        next_run._nexus_cache = NexusCache(path=self.deployer.nexus_cache.path)
+        self.assertTrue(next_run.already_deployed(mock_connection))
+        self.assertEqual(head_req.call_count, 1)
+
+    @patch('requests.head')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._get_plan')
+    def test_not_already_deployed(self, plan, head_req):
+        plan.return_value = DeploymentPlan(artifact_url='http://int.my_nexus.com')
         head_req.return_value.status_code = 404
         mock_connection = MockConnection(host='prod-something-01')
         result = self.deployer.already_deployed(mock_connection)
         self.assertFalse(result)
         self.assertFalse(self.deployer._already_deployed)
+
+    @patch('mendel.deployer.base.Deployer._record_release')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._get_plan')
+    def test_install_is_one_remote_script(self, plan, record):
+        plan.return_value = DeploymentPlan(artifact_url='http://int.my_nexus.com/test_service-1.0.0.jar',
+                                           release_dir='20190901-120000-kevin-aaaa-1.0.0')
+        steps = ('mkdir', 'download', 'cp', 'chown', 'symlink')
+        output = '\n'.join('__MENDEL_STEP__ %s 0 5' % step for step in steps)
+        mock_connection = MockConnection(host='prod-something-01', sudo=Result(output))
+        with patch.object(mock_connection, 'sudo', wraps=mock_connection.sudo) as sudo:
+            self.deployer.install(mock_connection)
+        self.assertEqual(sudo.call_count, 1)
+        script = sudo.call_args[0][0]
+        self.assertIn('url=http://int.my_nexus.com/test_service-1.0.0.jar', script)
+        self.assertIn('cp /srv/releases/.downloads/test_service-1.0.0.jar '
+                      '/srv/releases/20190901-120000-kevin-aaaa-1.0.0/test_service.jar', script)
+        self.assertIn('ln -sfT /srv/releases/20190901-120000-kevin-aaaa-1.0.0 /srv/.current.tmp '
+                      '&& mv -T /srv/.current.tmp /srv/current', script)
+
+    @patch('mendel.deployer.base.Deployer._write_manifest')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._get_plan')
+    def test_install_records_the_release(self, plan, write_manifest):
+        plan.return_value = DeploymentPlan(artifact_url='http://int.my_nexus.com/test_service-1.0.0.jar',
+                                           release_dir='20190902-120000-kevin-bbbb-1.0.0', version='1.0.0')
+        steps = ('mkdir', 'download', 'cp', 'chown', 'symlink')
+        output = '\n'.join('__MENDEL_STEP__ %s 0 5' % step for step in steps)
+        manifest = ReleaseManifest(current='20190901-120000-kevin-aaaa-0.9.0',
+                                   releases=[dict(name='20190901-120000-kevin-aaaa-0.9.0', ok=True)])
+        mock_connection = MockConnection(host='prod-something-01', sudo=[Result(output), Result(manifest.dumps())])
+        self.deployer.install(mock_connection)
+        installed = write_manifest.call_args[0][1]
+        self.assertEqual(installed.current, '20190902-120000-kevin-bbbb-1.0.0')
+        self.assertEqual(installed.get('20190902-120000-kevin-bbbb-1.0.0')['version'], '1.0.0')
+
+    @patch('mendel.deployer.base.Deployer._write_manifest')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer.install')
+    def test_deploy_records_the_release_once(self, install, restart, write_manifest):
+        install.side_effect = lambda connection: self.deployer._record_install(connection)
+        with patch.object(self.deployer, '_record_release') as record:
+            self.deployer._cut_over_host(MockConnection(host='prod-something-01'))
+        record.assert_called_once_with(ANY, ok=True)
+
+    @patch('mendel.deployer.base.Deployer._write_manifest')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer.upload')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._get_plan')
+    def test_stage_leaves_current_alone(self, plan, upload, write_manifest):
+        plan.return_value = DeploymentPlan(artifact_url='http://int.my_nexus.com/test_service-1.0.0.jar',
+                                           release_dir='20190902-120000-kevin-bbbb-1.0.0')
+        steps = ('mkdir', 'download', 'cp', 'chown')
+        output = '\n'.join('__MENDEL_STEP__ %s 0 5' % step for step in steps)
+        manifest = ReleaseManifest(current='20190901-120000-kevin-aaaa-0.9.0',
+                                   releases=[dict(name='20190901-120000-kevin-aaaa-0.9.0', ok=True)])
+        mock_connection = MockConnection(host='prod-something-01', sudo=[Result(output), Result(manifest.dumps())])
+        with patch.object(mock_connection, 'sudo', wraps=mock_connection.sudo) as sudo:
+            self.deployer._stage_host(mock_connection)
+        self.assertTrue(upload.called)
+        self.assertNotIn('current', sudo.call_args_list[0][0][0])
+        staged = write_manifest.call_args[0][1]
+        self.assertEqual(staged.current, '20190901-120000-kevin-aaaa-0.9.0')
+        self.assertEqual(staged.latest_staged(), '20190902-120000-kevin-bbbb-1.0.0')
+
+    @patch('mendel.deployer.base.Deployer._track_event')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.base.Deployer._change_symlink_to')
+    @patch('mendel.deployer.base.Deployer._write_manifest')
+    def test_activate_latest_staged(self, write_manifest, change_symlink, restart, track):
+        manifest = ReleaseManifest(current='20190901-120000-kevin-aaaa-0.9.0',
+                                   releases=[dict(name='20190901-120000-kevin-aaaa-0.9.0', ok=True),
+                                             dict(name='20190902-120000-kevin-bbbb-1.0.0', staged=True,
+                                                  checksum='abcd')])
+        connections = [MockConnection(host=f'prod-something-0{i}', sudo=[Result(manifest.dumps()), Result('')])
+                       for i in (1, 2)]
+        with patch.object(connections[0], 'sudo', wraps=connections[0].sudo) as sudo:
+            self.deployer.activate(connections)
+        self.assertIn('sha256sum -c', sudo.call_args_list[1][0][0])
+        self.assertEqual({c[0][1] for c in change_symlink.call_args_list},
+                         {'/srv/releases/20190902-120000-kevin-bbbb-1.0.0'})
+        self.assertEqual(restart.call_count, 2)
+        activated = write_manifest.call_args[0][1]
+        self.assertEqual(activated.current, '20190902-120000-kevin-bbbb-1.0.0')
+        self.assertIsNone(activated.latest_staged())
+        self.assertEqual(activated.latest_ok(), '20190902-120000-kevin-bbbb-1.0.0')
+
+    @patch('mendel.deployer.base.Deployer._get_commit_hash')
+    @patch('mendel.deployer.base.Deployer._start_or_restart')
+    @patch('mendel.deployer.base.Deployer._change_symlink_to')
+    @patch('mendel.deployer.base.Deployer._write_manifest')
+    def test_activate_reports_what_was_staged(self, write_manifest, change_symlink, restart, commit_hash):
+        self.deployer.config.notifications = 'summary'
+        commit_hash.return_value = 'cccccccccccc'  # checked out since staging
+        manifest = ReleaseManifest(releases=[dict(name='20190902-120000-kevin-bbbb-1.0.0', staged=True,
+                                                  version='1.0.0', commit='bbbbbbbbbbbb')])
+        connections = [MockConnection(host=f'prod-something-0{i}', sudo=[Result(manifest.dumps()), Result('')])
+                       for i in (1, 2)]
+        sinks = dict(slack=MagicMock(return_value=True),
+                     graphite=MagicMock(return_value=True),
+                     api=MagicMock(return_value=True))
+        with patch.dict('mendel.deployer.tracking.dispatcher.SINKS', **sinks):
+            self.deployer.activate(connections)
+            self.deployer.tracker.flush()
+        api = sinks['api'].call_args[1]
+        self.assertEqual((api['commit_hash'], api['project_version']), ('bbbbbbb', '1.0.0'))
+        self.assertEqual(sinks['slack'].call_args[1]['commit_hash'], 'bbbbbbb')
+
+    @patch('mendel.deployer.base.Deployer._change_symlink_to')
+    def test_activate_checks_every_host_first(self, change_symlink):
+        manifest = ReleaseManifest(current='20190901-120000-kevin-aaaa-0.9.0',
+                                   releases=[dict(name='20190902-120000-kevin-bbbb-1.0.0', staged=True)])
+        connections = [MockConnection(host='prod-something-01', sudo=[Result(manifest.dumps()), Result('')]),
+                       MockConnection(host='prod-something-02', sudo=[Result(manifest.dumps()),
+                                                                      Result('', exited=1)])]
+        with pytest.raises(SystemExit):
+            self.deployer.activate(connections)
+        self.assertFalse(change_symlink.called)
+
+    @patch('mendel.deployer.base.Deployer._record_release')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._get_plan')
+    def test_install_through_artifact_proxy(self, plan, record):
+        plan.return_value = DeploymentPlan(artifact_url='http://int.my_nexus.com/test_service-1.0.0.jar',
+                                           release_dir='20190901-120000-kevin-aaaa-1.0.0')
+        self.deployer._artifact_proxy = MagicMock(port=41234, sha256='abcd')
+        self.deployer._artifact_proxy.name = 'test_service-1.0.0.jar'
+        steps = ('mkdir', 'download', 'cp', 'chown', 'symlink')
+        output = '\n'.join('__MENDEL_STEP__ %s 0 5' % step for step in steps)
+        mock_connection = MockConnection(host='prod-something-01', sudo=Result(output))
+        mock_connection.forward_remote = MagicMock()
+        with patch.object(mock_connection, 'sudo', wraps=mock_connection.sudo) as sudo:
+            self.deployer.install(mock_connection)
+        mock_connection.forward_remote.assert_called_once_with(41234, local_port=41234)
+        script = sudo.call_args[0][0]
+        self.assertIn('url=http://127.0.0.1:41234/test_service-1.0.0.jar', script)
+        self.assertIn('expected=abcd', script)
+
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._generate_nexus_url')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._resolve_version')
+    @patch('mendel.deployer.base.Deployer._get_commit_hash')
+    def test_plan_is_made_once(self, commit_hash, version, nexus_url):
+        commit_hash.return_value = '1232435zzz'
+        version.return_value = '2.9.9'
+        nexus_url.return_value = 'http://int.my_nexus.com/test_service-2.9.9.jar'
+        mock_connection = MockConnection(host='prod-something-01')
+        plan = self.deployer._get_plan(mock_connection)
+        self.assertIs(self.deployer._get_plan(mock_connection), plan)
+        self.assertEqual(version.call_count, 1)
+        self.assertEqual(plan.version, '2.9.9')
+        self.assertEqual(plan.commit_hash, '1232435zzz')
+        self.assertTrue(plan.release_dir.endswith('-kevin-1232435zzz-2.9.9'))
+        self.assertEqual(plan.artifact_url, 'http://int.my_nexus.com/test_service-2.9.9.jar')
+        self.assertEqual(nexus_url.call_args[1]['version'], '2.9.9')
+        self.assertIsNone(plan.bundle_name)
+        self.assertIsNone(self.deployer.project_version)
+        with pytest.raises(AttributeError):
+            plan.version = '3.0.0'
+
+    @patch('mendel.deployer.base.Deployer._write_manifest')
+    @patch('mendel.deployer.remote_jar.RemoteJarDeployer._get_plan')
+    def test_record_release_starts_manifest(self, plan, write_manifest):
+        plan.return_value = DeploymentPlan(version='1.0.0', commit_hash='bbbb',
+                                           release_dir='20190902-120000-kevin-bbbb-1.0.0')
+        # no manifest yet, then the release dirs already there
+        mock_connection = MockConnection(host='prod-something-01',
+                                         sudo=[Result(''), Result('20190901-120000-kevin-aaaa-0.9.0\n')])
+        self.deployer._record_release(mock_connection, ok=True)
+        manifest = write_manifest.call_args[0][1]
+        self.assertEqual(manifest.current, '20190902-120000-kevin-bbbb-1.0.0')
+        self.assertEqual(manifest.names, ['20190901-120000-kevin-aaaa-0.9.0', '20190902-120000-kevin-bbbb-1.0.0'])
+        self.assertEqual(manifest.latest_ok(), '20190902-120000-kevin-bbbb-1.0.0')
+        self.assertEqual(manifest.get('20190902-120000-kevin-bbbb-1.0.0')['commit'], 'bbbb')
@@ -0,0 +1,69 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+import pytest
+
+from mendel.deployer.restart import measured_command
+from mendel.deployer.restart import parse_restart
+from mendel.deployer.restart import restart_command
+
+
+class RestartCommandTests(TestCase):
+    def test_strategies(self):
+        self.assertEqual(restart_command('reload', 'myservice', 'systemd'),
+                         'if systemctl is-active --quiet myservice; then systemctl reload myservice; '
+                         'else systemctl start myservice; fi')
+        self.assertIn('service myservice reload || service myservice restart',
+                      restart_command('try-reload-or-restart', 'myservice', 'upstart'))
+        self.assertIn('systemctl stop myservice; systemctl start myservice',
+                      restart_command('stop-start', 'myservice', 'systemd'))
+        with pytest.raises(ValueError):
+            restart_command('bounce', 'myservice', 'systemd')
+
+
+class MeasuredCommandTests(TestCase):
+    """
+    Runs the measured commands with the local bash, against a "service" that's available while a file exists
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.up = os.path.join(self.tmp_dir, 'up')
+        open(self.up, 'w').close()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_measured(self, command, check=True):
+        script = measured_command(command, f'test -f {self.up}' if check else None, deadline=5)
+        result = subprocess.run(['bash', '-c', script], stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                universal_newlines=True)
+        return result.returncode, parse_restart(result.stdout)
+
+    def test_measures_the_gap(self):
+        returncode, (status, seconds, unavailable) = self.run_measured(f'rm {self.up}; sleep 0.5; touch {self.up}')
+        self.assertEqual((returncode, status), (0, 0))
+        self.assertGreaterEqual(seconds, 0.5)
+        self.assertGreater(unavailable, 0.3)
+        self.assertLess(unavailable, 2)
+
+    def test_no_gap(self):
+        self.assertEqual(self.run_measured('sleep 0.3')[1][2], 0.0)
+
+    def test_failed_restart(self):
+        returncode, (status, _, unavailable) = self.run_measured(f'rm {self.up}; exit 3')
+        self.assertEqual((returncode, status, unavailable), (3, 3, None))
+
+    def test_check_as_user(self):
+        script = measured_command('systemctl restart myservice', 'test -f /srv/myservice/up', user='myservice')
+        self.assertIn("available() { sudo -u myservice bash -c 'test -f /srv/myservice/up'; }", script)
+        self.assertIn('( systemctl restart myservice ) 2>&1', script)
+
+    def test_without_a_check(self):
+        returncode, (status, _, unavailable) = self.run_measured('true', check=False)
+        self.assertEqual((returncode, status, unavailable), (0, 0, None))
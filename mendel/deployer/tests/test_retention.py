@@ -0,0 +1,148 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from invoke import Result
+
+from mendel.config.service_config import ServiceConfig
+from mendel.deployer.manifest import ReleaseManifest
+from mendel.deployer.remote_jar import RemoteJarDeployer
+from mendel.deployer.retention import cached_to_prune
+from mendel.deployer.retention import parse_cached
+from mendel.deployer.retention import parse_listing
+from mendel.deployer.retention import prune_command
+from mendel.deployer.retention import releases_to_prune
+from .helpers import MockConnection
+
+DAY = 24 * 60 * 60
+NOW = 100 * DAY
+RELEASES = [('20190901-120000-kevin-aaaa', NOW - 30 * DAY),
+            ('20190902-120000-kevin-bbbb', NOW - 20 * DAY),
+            ('20190903-120000-kevin-cccc', NOW - 10 * DAY),
+            ('20190904-120000-kevin-dddd', NOW - 5 * DAY),
+            ('20190905-120000-kevin-eeee', NOW - 1 * DAY)]
+
+
+class ReleasesToPruneTests(TestCase):
+    def test_no_policy_keeps_everything(self):
+        self.assertEqual(releases_to_prune(RELEASES, '20190905-120000-kevin-eeee', now=NOW), [])
+
+    def test_keep_newest(self):
+        self.assertEqual(releases_to_prune(RELEASES, '20190905-120000-kevin-eeee', keep=2, now=NOW),
+                         ['20190901-120000-kevin-aaaa', '20190902-120000-kevin-bbbb', '20190903-120000-kevin-cccc'])
+
+    def test_max_age(self):
+        self.assertEqual(releases_to_prune(RELEASES, '20190905-120000-kevin-eeee', max_age=15 * DAY, now=NOW),
+                         ['20190901-120000-kevin-aaaa', '20190902-120000-kevin-bbbb'])
+
+    def test_current_and_previous_are_always_kept(self):
+        # rolled back to an old release
+        self.assertEqual(releases_to_prune(RELEASES, '20190902-120000-kevin-bbbb', keep=1, now=NOW),
+                         ['20190903-120000-kevin-cccc', '20190904-120000-kevin-dddd'])
+
+    def test_unknown_current_keeps_everything(self):
+        self.assertEqual(releases_to_prune(RELEASES, None, keep=1, now=NOW), [])
+        self.assertEqual(releases_to_prune(RELEASES, 'something-else', keep=1, now=NOW), [])
+
+
+class ParseListingTests(TestCase):
+    def test_parse(self):
+        output = ('/data/srv/my-service/releases\n'
+                  '/data/srv/my-service/releases/20190902-120000-kevin-bbbb/my-service-1.0\n'
+                  '1567339200.5 20190901-120000-kevin-aaaa\n'
+                  '1567425600.0 20190902-120000-kevin-bbbb\n')
+        self.assertEqual(parse_listing(output), ('20190902-120000-kevin-bbbb',
+                                                 [('20190901-120000-kevin-aaaa', 1567339200.5),
+                                                  ('20190902-120000-kevin-bbbb', 1567425600.0)]))
+
+    def test_no_releases_dir(self):
+        self.assertEqual(parse_listing(''), (None, []))
+
+    def test_parse_cached(self):
+        output = ('/data/srv/my-service/releases\n'
+                  '/data/srv/my-service/releases/20190902-120000-kevin-bbbb\n'
+                  '1567425600.0 20190902-120000-kevin-bbbb\n'
+                  'cached 1567425600.0 abc123\n')
+        self.assertEqual(parse_cached(output), [('abc123', 1567425600.0)])
+        self.assertEqual(parse_listing(output)[1], [('20190902-120000-kevin-bbbb', 1567425600.0)])
+
+
+class CachedToPruneTests(TestCase):
+    CACHED = [('aaaa', NOW - 30 * DAY), ('bbbb', NOW - 20 * DAY), ('cccc', NOW - 1 * DAY)]
+
+    def test_unused_by_kept_releases(self):
+        self.assertEqual(cached_to_prune(self.CACHED, used={'bbbb', None}, keep=5), ['aaaa', 'cccc'])
+
+    def test_without_a_manifest(self):
+        self.assertEqual(cached_to_prune(self.CACHED, keep=1, now=NOW), ['aaaa', 'bbbb'])
+        self.assertEqual(cached_to_prune(self.CACHED, max_age=25 * DAY, now=NOW), ['aaaa'])
+        self.assertEqual(cached_to_prune(self.CACHED, now=NOW), [])
+
+
+class PruneTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.config = ServiceConfig(service_name='my-service', service_root='/srv/my-service',
+                                    deployment_user='kevin', keep_releases=1)
+        self.deployer = RemoteJarDeployer(config=self.config)
+
+    def test_prune(self):
+        listing = '/srv/my-service/releases\n/srv/my-service/releases/20190903-120000-kevin-cccc\n' + \
+                  '\n'.join(f'{mtime} {name}' for name, mtime in RELEASES[:3])
+        connection = MockConnection(host='prod-something-01', sudo=[Result(listing), Result(''), Result('')])
+        with patch.object(connection, 'sudo', wraps=connection.sudo) as sudo:
+            self.assertEqual(self.deployer._prune_releases(connection), ['20190901-120000-kevin-aaaa'])
+        command = sudo.call_args_list[2][0][0]
+        self.assertEqual(command, prune_command('/srv/my-service/releases', '/srv/my-service/current',
+                                                ['20190901-120000-kevin-aaaa']))
+
+    def test_prune_cached_bundles_with_their_releases(self):
+        listing = '/srv/my-service/releases\n/srv/my-service/releases/20190903-120000-kevin-cccc\n' + \
+                  '\n'.join(f'{mtime} {name}' for name, mtime in RELEASES[:3]) + \
+                  '\ncached 1.0 aaaa-sha\ncached 2.0 bbbb-sha\ncached 3.0 cccc-sha\n'
+        manifest = ReleaseManifest(current='20190903-120000-kevin-cccc',
+                                   releases=[dict(name=name, checksum=name[-4:] + '-sha') for name, _ in RELEASES[:3]])
+        connection = MockConnection(host='prod-something-01',
+                                    sudo=[Result(listing), Result(manifest.dumps()), Result(''), Result('')])
+        with patch.object(connection, 'sudo', wraps=connection.sudo) as sudo:
+            self.deployer._prune_releases(connection)
+        self.assertEqual(sudo.call_args_list[2][0][0],
+                         prune_command('/srv/my-service/releases', '/srv/my-service/current',
+                                       ['20190901-120000-kevin-aaaa'], cached=['aaaa-sha']))
+
+
+class PruneCommandTests(TestCase):
+    """
+    Runs the prune command with the local bash, against a releases dir in a temp dir
+    """
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.releases = os.path.join(self.tmp_dir, 'releases')
+        self.current = os.path.join(self.tmp_dir, 'current')
+        for name in ('r1', 'r2', 'r3', '.cache'):
+            os.makedirs(os.path.join(self.releases, name))
+        open(os.path.join(self.releases, '.cache', 'aaaa-sha'), 'w').close()
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def run_prune(self, names, cached=()):
+        return subprocess.run(prune_command(self.releases, self.current, names, cached=cached), shell=True,
+                              executable='/bin/bash', stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+
+    def test_skips_whatever_is_current(self):
+        os.symlink(os.path.join(self.releases, 'r2'), self.current)
+        result = self.run_prune(['r1', 'r2'], cached=['aaaa-sha'])
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertEqual(sorted(os.listdir(self.releases)), ['.cache', 'r2', 'r3'])
+        self.assertEqual(os.listdir(os.path.join(self.releases, '.cache')), [])
+
+    def test_fails_without_current(self):
+        self.assertNotEqual(self.run_prune(['r1']).returncode, 0)
+        self.assertIn('r1', os.listdir(self.releases))
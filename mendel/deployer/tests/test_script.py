@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+import pytest
+from invoke import Result
+
+from mendel.deployer.script import RemoteScript
+from mendel.deployer.script import RemoteScriptError
+from .helpers import MockConnection
+
+
+class RemoteScriptTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.script = RemoteScript()
+        self.script.add('mkdir', 'mkdir -p /srv/test_service/releases', user='test_service')
+        self.script.add('chown', 'chown test_service:test_service /srv/test_service/releases')
+
+    def test_render(self):
+        rendered = self.script.render()
+        self.assertIn("sudo -u test_service -H bash -c 'mkdir -p /srv/test_service/releases' 2>&1", rendered)
+        self.assertIn("\nbash -c 'chown test_service:test_service /srv/test_service/releases' 2>&1", rendered)
+        self.assertEqual(rendered.count('[ $rc -eq 0 ] || exit $rc'), 2)
+
+    def test_parse(self):
+        output = "__MENDEL_STEP__ mkdir 0 12\nchanged ownership\n__MENDEL_STEP__ chown 0 4\n"
+        results = RemoteScript.parse(output)
+        self.assertEqual([r.name for r in results], ['mkdir', 'chown'])
+        self.assertEqual([r.duration_ms for r in results], [12, 4])
+        self.assertEqual(results[1].output, 'changed ownership')
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_run(self):
+        output = "__MENDEL_STEP__ mkdir 0 12\n__MENDEL_STEP__ chown 0 4\n"
+        mock_connection = MockConnection(host='prod-something-01', sudo=Result(output))
+        results = self.script.run(mock_connection)
+        self.assertEqual(len(results), 2)
+
+    def test_run_step_failed(self):
+        output = "__MENDEL_STEP__ mkdir 0 12\nchown: invalid user\n__MENDEL_STEP__ chown 1 4\n"
+        mock_connection = MockConnection(host='prod-something-01', sudo=Result(output, exited=1))
+        with pytest.raises(RemoteScriptError) as e:
+            self.script.run(mock_connection)
+        self.assertIn('chown failed on prod-something-01: chown: invalid user', str(e.value))
+        self.assertEqual(len(e.value.results), 2)
+
+    def test_run_exited_early(self):
+        mock_connection = MockConnection(host='prod-something-01', sudo=Result('sudo: no tty present', exited=1))
+        with pytest.raises(RemoteScriptError):
+            self.script.run(mock_connection)
@@ -1,4 +1,5 @@
 from unittest import TestCase
+from unittest.mock import MagicMock
 from unittest.mock import patch
 
 from invoke import Result
@@ -31,3 +32,31 @@ class BaseDeployerDeployTests(TestCase):
         mock_connection = MockConnection(host='prod-something-01', run=Result('myservice-tgz.tar.gz'))
         result = self.deployer._get_bundle_name(mock_connection)
         self.assertEqual('myservice-tgz.tar.gz', result)
+
+    @patch('mendel.deployer.tgz.rsync_tree')
+    @patch('mendel.deployer.tgz.TarballDeployer._unpack_bundle_locally')
+    @patch('mendel.deployer.tgz.TarballDeployer._get_current_release')
+    @patch('os.path.getsize')
+    def test_upload_delta(self, getsize, current_release, unpack, rsync_tree):
+        getsize.return_value = 4096
+        current_release.return_value = '20190809-184022-user-be07d4d1fa4b0'
+        unpack.return_value = '/tmp/mendel-test_service-abc'
+        rsync_tree.return_value = 1024
+        self.deployer.config.project_type = 'java'
+        mock_connection = MagicMock(host='prod-something-01')
+        result = self.deployer._upload_delta(mock_connection, '/target/test_service/test_service.tar.gz',
+                                             '/srv/releases/20190901-120000-kevin-aaaa')
+        self.assertTrue(result)
+        self.assertEqual(rsync_tree.call_args[0][2], '/srv/releases/20190809-184022-user-be07d4d1fa4b0')
+        self.assertIn('prod-something-01', self.deployer._delta_hosts)
+        self.assertEqual(self.deployer._bytes_saved, 3072)
+
+    @patch('mendel.deployer.tgz.TarballDeployer._get_current_release')
+    def test_upload_delta_no_current_release(self, current_release):
+        current_release.side_effect = Exception('readlink failed')
+        self.deployer.config.project_type = 'java'
+        mock_connection = MagicMock(host='prod-something-01')
+        result = self.deployer._upload_delta(mock_connection, '/target/test_service/test_service.tar.gz',
+                                             '/srv/releases/20190901-120000-kevin-aaaa')
+        self.assertFalse(result)
+        self.assertNotIn('prod-something-01', self.deployer._delta_hosts)
@@ -1,75 +1,170 @@
 """
 Deploy a tarball
 """
+import atexit
+import os
+import shutil
+import tempfile
+
 from mendel.config.service_config import ServiceConfig
+from mendel.util.colors import blue
 from mendel.util.colors import green
+from mendel.util.colors import yellow
 from .base import Deployer
+from .delta import rsync_tree
 from .mixins.rollback import SymlinkRollbackMixin
+from .script import RemoteScript
 
 
 class TarballDeployer(Deployer, SymlinkRollbackMixin):
+    RELEASE_MANIFEST = True
+
     def __init__(self, service_name: str = None, config: ServiceConfig = None):
         super().__init__(service_name, config)
-        self.release_dir = None
+        self._unpacked_bundles = {}
+        self._delta_hosts = set()  # hosts the tarball's contents were delta uploaded to, already unpacked
 
     def install(self, connection):
-        try:
-            bundle_name = self._get_bundle_name(connection)
-        except Exception as e:
-            self._log_error_and_exit(connection, message=str(e))
-
-        if not self.release_dir:
-            self.release_dir = self._new_release_dir(connection)
-        release_destination = self._rpath('releases', self.release_dir)
-        connection.run(
-            f'cd {release_destination} && sudo tar --strip-components 1 -zxvf {bundle_name} && sudo rm {bundle_name}')
+        plan = self._get_plan(connection)
+        release_destination = self._rpath('releases', plan.release_dir)
+        script = self._release_script(connection)
 
         if self.config.project_type == 'java':
-            connection.run(f'cd {release_destination} && sudo ln -sf *.jar {self.config.service_name}.jar')
-            self._change_symlink_to(connection, self._rpath('releases', self.release_dir))
+            print(blue("Linking release %s into current" % release_destination))
+            script.add('symlink', self._symlink_command(release_destination), user=self.config.user)
+            self._run_script(connection, script)
 
         elif self.config.project_type == 'python':
-            # fabric commands are each issued in their own shell so the virtual env needs to be activated each time
-            # pip had issues with wheel cache permissions which were solved with the --no-cache flag
-            # the requires.txt is used instead of setup.py install because we don't need the code installed as a module
-            #   but we still need to the requirements installed, this way we dont have to find a requirements.txt file
-            #   in the rest of the application b/c setup.py sdist puts it in the egg-info
-            connection.sudo(
-                f'source /srv/{self.config.service_name}/env/bin/activate && pip install --no-cache -r {release_destination}/{self.config.service_name}.egg-info/requires.txt')
-            # need to get the top level application directory but not the egg-info directory or other setup files
-            project_dir = connection.sudo("find . -maxdepth 1 -mindepth 1 -type d -not -regex '.*egg-info$'")
-            project_dir = project_dir[2:]  # find command returns a string like './dir'
-            self._change_symlink_to(connection, release_path=self._rpath('releases', self.release_dir, project_dir))
+            self._run_script(connection, script)
+            self._install_requirements(connection, release_destination)
+            self._change_symlink_to(connection, self._release_link_target(connection, release_destination))
 
+        self._record_install(connection)
         print(green(self.INSTALL_SUCCESS_MESSAGE % self.config.service_name))
 
+    def _stage_release(self, connection):
+        self._run_script(connection, self._release_script(connection))
+        if self.config.project_type == 'python':
+            self._install_requirements(connection, self._rpath('releases', self._get_plan(connection).release_dir))
+
+    def _release_script(self, connection):
+        """
+        :param connection: Connection
+        :return: RemoteScript unpacking the uploaded tarball in its release dir, short of linking it into current
+        """
+        plan = self._get_plan(connection)
+        release_destination = self._rpath('releases', plan.release_dir)
+        script = RemoteScript()
+        if connection.host not in self._delta_hosts:
+            script.add('untar', f'cd {release_destination} && tar --strip-components 1 -zxf {plan.bundle_name} && '
+                                f'rm {plan.bundle_name}')
+        if self.config.project_type == 'java':
+            script.add('link_jar', f'cd {release_destination} && ln -sf *.jar {self.config.service_name}.jar')
+        return script
+
+    def _install_requirements(self, connection, release_destination):
+        """
+        Install a python release's requirements into the service's virtual env
+        :param connection: Connection
+        :param release_destination: str path to the release dir
+        :return: nothing
+        """
+        # fabric commands are each issued in their own shell so the virtual env needs to be activated each time
+        # pip had issues with wheel cache permissions which were solved with the --no-cache flag
+        # the requires.txt is used instead of setup.py install because we don't need the code installed as a module
+        #   but we still need to the requirements installed, this way we dont have to find a requirements.txt file
+        #   in the rest of the application b/c setup.py sdist puts it in the egg-info
+        connection.sudo(
+            f'source /srv/{self.config.service_name}/env/bin/activate && pip install --no-cache -r {release_destination}/{self.config.service_name}.egg-info/requires.txt')
+
+    def _release_link_target(self, connection, release_path):
+        if self.config.project_type != 'python':
+            return release_path
+        # need to get the top level application directory but not the egg-info directory or other setup files
+        project_dir = connection.sudo(f"cd {release_path} && find . -maxdepth 1 -mindepth 1 -type d "
+                                      f"-not -regex '.*egg-info$'", hide='both').stdout.strip()
+        project_dir = project_dir[2:]  # find command returns a string like './dir'
+        return os.path.join(release_path, project_dir)
+
+    def _staged_check_command(self, release_path, entry):
+        if self.config.project_type == 'java':
+            return f'test -e {release_path}/{self.config.service_name}.jar'
+        return super()._staged_check_command(release_path, entry)
+
     def upload(self, connection, bundle_name=None):
         """
         create a new release dir and upload tarball
         """
-        try:
-            bundle_name = self._get_bundle_name(connection)
-        except Exception as e:
-            self._log_error_and_exit(connection, message=str(e))
+        plan = self._get_plan(connection)
+        bundle_name = plan.bundle_name
 
         self._create_if_missing(connection, self._rpath('releases'))
-        self.release_dir = self._new_release_dir(connection)
-        self._create_if_missing(connection, self._rpath('releases', self.release_dir))
+        self._create_if_missing(connection, self._rpath('releases', plan.release_dir))
         fq_bundle_file = self._lpath(self.config.build_target_path, bundle_name)
+        release_target = self._rpath('releases', plan.release_dir)
+        if self.config.delta_upload and self._upload_delta(connection, fq_bundle_file, release_target):
+            print(green(self.UPLOAD_SUCCESS_MESSAGE % (bundle_name, plan.release_dir)))
+            return plan.release_dir
+
         # There is no way in fabric 2 to put with sudo, workaround used https://github.com/fabric/fabric/issues/1750
-        connection.put(fq_bundle_file, self._tpath())
-        release_target = self._rpath('releases', self.release_dir)
+        self._put_bundle(connection, fq_bundle_file)
         connection.sudo(f'mv {self._tpath()}/{bundle_name} {release_target}')
 
-        print(green(self.UPLOAD_SUCCESS_MESSAGE % (bundle_name, self.release_dir)))
+        print(green(self.UPLOAD_SUCCESS_MESSAGE % (bundle_name, plan.release_dir)))
 
-        return self.release_dir
+        return plan.release_dir
 
-    def rollback(self, connection):
+    def rollback(self, connection, to=None, parallel=None):
         """
         [core]\t\tchoose a version to rollback to from all available releases
+        :param connection: Connection, or Group of Connections to roll them all back at once
+        :param to: str `previous` or a release name, to roll every host back to it without asking
+        :param parallel: int number of hosts to restart at once with `to`, all of them if not given
+        """
+        return self.symlink_rollback(connection, to=to, parallel=parallel)
+
+    def _upload_delta(self, connection, fq_bundle_file, release_target):
+        """
+        Upload the contents of the tarball straight into the release dir, only sending the files that
+        changed since the current release. Only java projects are supported.
+        :param connection: Connection
+        :param fq_bundle_file: str path to the local tarball
+        :param release_target: str release dir on the remote host
+        :return: bool whether the contents were uploaded. if not, the tarball needs to be uploaded in full
+        """
+        if self.config.project_type != 'java':
+            return False
+        staging = self._tpath(f'{self.config.service_name}-{os.path.basename(release_target)}')
+        try:
+            base_dir = self._rpath('releases', self._get_current_release(connection))
+            bytes_sent = rsync_tree(connection, self._unpack_bundle_locally(connection, fq_bundle_file),
+                                    base_dir, staging)
+            connection.sudo(f'cp -R --preserve=mode,timestamps,links {staging}/. {release_target}/ && '
+                            f'rm -rf {staging}', hide='both')
+        except Exception as e:
+            print(yellow(f'Unable to delta upload to {connection.host} ({e}), uploading the whole bundle'))
+            return False
+
+        print(blue(f'Delta uploaded {fq_bundle_file} to {connection.host}, sent {bytes_sent} bytes'))
+        self._count_bytes_saved(fq_bundle_file, bytes_sent)
+        with self._lock:
+            self._delta_hosts.add(connection.host)
+        return True
+
+    def _unpack_bundle_locally(self, connection, fq_bundle_file):
+        """
+        Unpack the tarball into a local temp dir the same way install unpacks it on the hosts, once per run
+        :param connection: Connection
+        :param fq_bundle_file: str path to the local tarball
+        :return: str path to the local temp dir
         """
-        return self.symlink_rollback(connection)
+        with self._lock:
+            if fq_bundle_file not in self._unpacked_bundles:
+                local_dir = tempfile.mkdtemp(prefix=f'mendel-{self.config.service_name}-')
+                atexit.register(shutil.rmtree, local_dir, True)
+                connection.local(f'tar --strip-components 1 -zxf {fq_bundle_file} -C {local_dir}', hide='both')
+                self._unpacked_bundles[fq_bundle_file] = local_dir
+        return self._unpacked_bundles[fq_bundle_file]
 
     def _get_bundle_name(self, connection):
         build_path = self._lpath(self.config.build_target_path)
@@ -1,5 +1,6 @@
 import requests
 
+from mendel.deployer.tracking.util import undelivered
 from mendel.util.colors import cyan
 from mendel.util.colors import red
 from mendel.util.colors import yellow
@@ -9,31 +10,52 @@ def track_event_api(*, track_event_endpoint: str,
                     event: str,
                     service_name: str,
                     deployment_user: str,
-                    deployment_host: str):
+                    deployment_host: str = None,
+                    hosts: list = None,
+                    project_version: str = None,
+                    commit_hash: str = None,
+                    duration: float = None,
+                    session: requests.Session = None):
     """
     Track who deployed what service and what the release dir is to an external REST API
+    Given `hosts`, a list of dicts with each host and its status, one bulk event covering all of them is sent as json,
+    along with the version, commit and duration of the deploy.
+    :return: bool whether the event was delivered, False if it's worth trying again, None if there's no point
     """
     if not track_event_endpoint:
         print(red('Unable to track deployment event in custom api, no api endpoint configured in config'))
-        return
-
-    data = {
-        'service': service_name,
-        'host': deployment_host,
-        'deployer': deployment_user,
-        'event': event
-    }
+        return None
 
     url = 'http://%s' % track_event_endpoint
 
+    if hosts is not None:
+        data = {
+            'service': service_name,
+            'hosts': hosts,
+            'deployer': deployment_user,
+            'event': event,
+            'version': project_version,
+            'commit': commit_hash,
+            'duration': duration
+        }
+        post_kwargs = dict(json=data)
+    else:
+        data = {
+            'service': service_name,
+            'host': deployment_host,
+            'deployer': deployment_user,
+            'event': event
+        }
+        post_kwargs = dict(data=data)
+
     try:
-        r = requests.post(url=url, data=data, timeout=5)
+        r = (session or requests).post(url=url, timeout=5, **post_kwargs)
     except Exception as e:
         print(yellow(f"Could not track event api with url {url} got error {str(e)}"))
-        return
+        return undelivered(e)
 
     if r.ok:
         print(cyan(f'Tracked deploy to external_api {track_event_endpoint}: (data={data}'))
-    else:
-        print(
-            yellow(f'Unable to track deployment event to the external API (HTTP {r.status_code} content {r.content})'))
+        return True
+    print(yellow(f'Unable to track deployment event to the external API (HTTP {r.status_code} content {r.content})'))
+    return undelivered(r)
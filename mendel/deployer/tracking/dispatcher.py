@@ -0,0 +1,163 @@
+"""
+Deliver tracking events in the background, so a slow graphite, api or slack endpoint doesn't hold up a deploy.
+Events that can't be delivered are spooled to disk and sent again on the next run.
+"""
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+import requests
+
+from mendel.deployer.tracking.api import track_event_api
+from mendel.deployer.tracking.graphite import track_event_graphite
+from mendel.deployer.tracking.slack import track_event_slack
+from mendel.util.colors import yellow
+from mendel.util.misc import mendel_dir
+from mendel.util.trace import tracer
+
+SINKS = {
+    'graphite': track_event_graphite,
+    'api': track_event_api,
+    'slack': track_event_slack,
+}
+
+
+class TrackingDispatcher(object):
+    """
+    Sends events to their sinks from a few worker threads, each with its own keep-alive requests.Session,
+    so events for different sinks go out concurrently while the caller carries on.
+
+        tracker = TrackingDispatcher()
+        tracker.submit('slack', slack_url=..., event='deployed', ...)
+
+    Events wait in a queue of at most `max_queued`; events that don't fit, that fail with a network error or a
+    5xx, or that are still queued `flush_timeout` seconds into process exit, are appended to a spool file.
+    The spool is re-sent the next time a dispatcher starts, unless the events in it are older than `spool_max_age`.
+    """
+    DEFAULT_WORKERS = 3
+    DEFAULT_MAX_QUEUED = 100
+    DEFAULT_FLUSH_TIMEOUT = 10
+    DEFAULT_SPOOL_MAX_AGE = 24 * 60 * 60
+
+    def __init__(self, workers=None, max_queued=None, flush_timeout=None, spool_path=None, spool_max_age=None):
+        super().__init__()
+        self.workers = workers or self.DEFAULT_WORKERS
+        self.flush_timeout = flush_timeout if flush_timeout is not None else self.DEFAULT_FLUSH_TIMEOUT
+        self.spool_path = spool_path or mendel_dir('spool', 'events.jsonl')
+        self.spool_max_age = spool_max_age if spool_max_age is not None else self.DEFAULT_SPOOL_MAX_AGE
+        self._queue = queue.Queue(maxsize=max_queued or self.DEFAULT_MAX_QUEUED)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, sink, **kwargs):
+        """
+        Queue an event for delivery, without waiting for it to be delivered
+        :param sink: str name of the sink, one of SINKS
+        :param kwargs: keyword arguments for the sink's track_event function
+        :return: nothing
+        """
+        self._start()
+        self._enqueue(dict(sink=sink, kwargs=kwargs, queued_at=time.time()))
+
+    def flush(self, timeout=None):
+        """
+        Wait for queued events to be delivered. Anything still queued after `timeout` seconds is spooled.
+        :param timeout: float seconds, flush_timeout if not given
+        :return: nothing
+        """
+        deadline = time.time() + (timeout if timeout is not None else self.flush_timeout)
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks and time.time() < deadline:
+                self._queue.all_tasks_done.wait(deadline - time.time())
+
+        undelivered = []
+        while True:
+            try:
+                undelivered.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            self._queue.task_done()
+        if undelivered:
+            print(yellow(f'Gave up waiting to track {len(undelivered)} event(s), they will be sent on the next run'))
+            self._spool(undelivered)
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            atexit.register(self.flush)
+        for event in self._unspool():
+            self._enqueue(event)
+
+    def _enqueue(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._spool([event])
+
+    def _work(self):
+        while True:
+            event = self._queue.get()
+            try:
+                if self._deliver(event) is False:
+                    self._spool([event])
+            except Exception as e:
+                print(yellow(f"Unable to track {event['sink']} event: {e}"))
+            finally:
+                self._queue.task_done()
+
+    def _deliver(self, event):
+        """
+        :param event: dict with the sink name and its kwargs
+        :return: bool whether the event was delivered, False if it's worth trying again later
+        """
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        with tracer.span(f"track {event['kwargs'].get('event')} in {event['sink']}", category='tracking',
+                         host='tracking') as args:
+            args['delivered'] = SINKS[event['sink']](session=self._local.session, **event['kwargs'])
+            return args['delivered']
+
+    def _spool(self, events):
+        """
+        Append events to the spool file. Tracking is best effort, so failing to spool is not an error.
+        """
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(self.spool_path), exist_ok=True)
+                with open(self.spool_path, 'a') as f:
+                    for event in events:
+                        f.write(json.dumps(event) + '\n')
+            except (IOError, OSError):
+                pass
+
+    def _unspool(self):
+        """
+        Take the events out of the spool file
+        :return: list of events young enough to still be worth sending
+        """
+        with self._lock:
+            try:
+                with open(self.spool_path) as f:
+                    lines = f.readlines()
+                os.remove(self.spool_path)
+            except (IOError, OSError):
+                return []
+
+        events = []
+        for line in lines:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get('sink') in SINKS and time.time() - event.get('queued_at', 0) < self.spool_max_age:
+                events.append(event)
+        return events
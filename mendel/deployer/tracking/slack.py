@@ -2,6 +2,7 @@ import json
 
 import requests
 
+from mendel.deployer.tracking.util import undelivered
 from mendel.util.colors import cyan
 from mendel.util.colors import red
 from mendel.util.colors import yellow
@@ -15,30 +16,43 @@ def track_event_slack(*, slack_url: str,
                       deployment_host: str,
                       project_version: str = None,
                       commit_hash: str = None,
-                      failure: bool = False):
+                      failure: bool = False,
+                      failed_hosts: list = None,
+                      duration: float = None,
+                      time_to_ready: float = None,
+                      session: requests.Session = None):
     """
     Notify Slack that a mendel event has taken place
+    A summary of a deploy to many hosts lists the hosts it failed on in `failed_hosts`, how long it took, and
+    how long the slowest host took to be ready after restarting (`time_to_ready`).
+    :return: bool whether the event was delivered, False if it's worth trying again, None if there's no point
     """
     if not slack_url:
         print(yellow('No slack_url found; skipping slack notification'))
-        return
+        return None
 
     if failure:
         text = f"*DEPLOY FAILED FOR* {deployment_user} {service_name} @ {commit_hash}, version *{project_version}* to host(s) {deployment_host} with error {event} *ABORTING DEPLOY*"
     else:
         text = f"{deployment_user} *{event.upper()}* {service_name} @ {commit_hash}, version *{project_version}* to host(s) {deployment_host}"
+    if failed_hosts:
+        text += f" *FAILED ON* {', '.join(failed_hosts)}"
+    if duration is not None:
+        text += f" in {duration:.0f}s"
+    if time_to_ready is not None:
+        text += f", ready after {time_to_ready:.0f}s"
     params = {
         'username': 'Mendel 3',
         'text': text,
-        'icon_emoji': ":rotating_light:" if failure else slack_emoji
+        'icon_emoji': ":rotating_light:" if failure or failed_hosts else slack_emoji
     }
     try:
-        resp = requests.post(url=slack_url, data=json.dumps(params).encode('utf-8'), timeout=5)
+        resp = (session or requests).post(url=slack_url, data=json.dumps(params).encode('utf-8'), timeout=5)
     except Exception as e:
         print(red(f"Could not notify slack that a mendel event took place at url: {slack_url} with error {e}"))
-        return
+        return undelivered(e)
     if resp.ok:
         print(cyan('Tracked deploy in slack (data=%s' % json.dumps(params)))
-    else:
-        print(
-            red(f"Could not notify slack that a mendel event took place at url: {slack_url} with error {resp.content}"))
+        return True
+    print(red(f"Could not notify slack that a mendel event took place at url: {slack_url} with error {resp.content}"))
+    return undelivered(resp)
@@ -0,0 +1,112 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from mendel.deployer.tracking.dispatcher import TrackingDispatcher
+
+SINKS = 'mendel.deployer.tracking.dispatcher.SINKS'
+
+
+class TrackingDispatcherTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.spool_path = os.path.join(self.tmp_dir, 'spool', 'events.jsonl')
+        self.tracker = TrackingDispatcher(spool_path=self.spool_path)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def _spooled(self):
+        with open(self.spool_path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_delivers_in_background(self):
+        release = threading.Event()
+        slack = MagicMock(side_effect=lambda **kwargs: release.wait(5))
+        with patch.dict(SINKS, slack=slack):
+            start = time.time()
+            self.tracker.submit('slack', event='deployed')
+            self.assertLess(time.time() - start, 1)
+            release.set()
+            self.tracker.flush()
+        self.assertEqual(slack.call_args[1]['event'], 'deployed')
+        self.assertIsNotNone(slack.call_args[1]['session'])
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    def test_sinks_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        sinks = dict(slack=MagicMock(side_effect=lambda **kwargs: barrier.wait() is not None),
+                     graphite=MagicMock(side_effect=lambda **kwargs: barrier.wait() is not None))
+        with patch.dict(SINKS, **sinks):
+            self.tracker.submit('slack', event='deployed')
+            self.tracker.submit('graphite', event='deployed')
+            self.tracker.flush()
+        self.assertFalse(barrier.broken)
+
+    def test_failed_event_is_spooled(self):
+        with patch.dict(SINKS, api=MagicMock(return_value=False)):
+            self.tracker.submit('api', event='deployed')
+            self.tracker.flush()
+        spooled = self._spooled()
+        self.assertEqual(len(spooled), 1)
+        self.assertEqual(spooled[0]['sink'], 'api')
+        self.assertEqual(spooled[0]['kwargs'], {'event': 'deployed'})
+
+    def test_undeliverable_event_is_dropped(self):
+        with patch.dict(SINKS, api=MagicMock(return_value=None)):
+            self.tracker.submit('api', event='deployed')
+            self.tracker.flush()
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    def test_flush_spools_what_is_left(self):
+        release = threading.Event()
+        tracker = TrackingDispatcher(workers=1, spool_path=self.spool_path)
+        with patch.dict(SINKS, slack=MagicMock(side_effect=lambda **kwargs: release.wait(5))):
+            tracker.submit('slack', event='first')
+            tracker.submit('slack', event='second')
+            tracker.flush(timeout=0.1)
+            release.set()
+        self.assertEqual([e['kwargs']['event'] for e in self._spooled()], ['second'])
+
+    def test_full_queue_spools(self):
+        release = threading.Event()
+        tracker = TrackingDispatcher(workers=1, max_queued=1, spool_path=self.spool_path)
+        with patch.dict(SINKS, slack=MagicMock(side_effect=lambda **kwargs: release.wait(5))):
+            for event in ('first', 'second', 'third'):
+                tracker.submit('slack', event=event)
+                time.sleep(0.05)
+            self.assertEqual([e['kwargs']['event'] for e in self._spooled()], ['third'])
+            release.set()
+            tracker.flush()
+
+    def test_spool_is_sent_on_next_run(self):
+        with patch.dict(SINKS, api=MagicMock(return_value=False)):
+            self.tracker.submit('api', event='deployed')
+            self.tracker.flush()
+
+        api, slack = MagicMock(return_value=True), MagicMock(return_value=True)
+        with patch.dict(SINKS, api=api, slack=slack):
+            tracker = TrackingDispatcher(spool_path=self.spool_path)
+            tracker.submit('slack', event='built')
+            tracker.flush()
+        self.assertEqual(api.call_args[1]['event'], 'deployed')
+        self.assertTrue(slack.called)
+        self.assertFalse(os.path.exists(self.spool_path))
+
+    def test_old_spool_is_dropped(self):
+        os.makedirs(os.path.dirname(self.spool_path))
+        with open(self.spool_path, 'w') as f:
+            f.write(json.dumps(dict(sink='api', kwargs={'event': 'deployed'}, queued_at=0)) + '\n')
+        api, slack = MagicMock(return_value=True), MagicMock(return_value=True)
+        with patch.dict(SINKS, api=api, slack=slack):
+            self.tracker.submit('slack', event='built')
+            self.tracker.flush()
+        self.assertFalse(api.called)
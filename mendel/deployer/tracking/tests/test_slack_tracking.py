@@ -29,4 +29,15 @@ class SlackTrackingTests(TestCase):
         self.assertEqual(json.loads(mock_post.call_args[1]['data'])['username'], 'Mendel 3')
         self.assertEqual(json.loads(mock_post.call_args[1]['data'])['icon_emoji'], ':dabomb:')
         self.assertEqual(json.loads(mock_post.call_args[1]['data'])['text'],
-                         'james *DEPLOYED* my_service @ 6g7l9p, version *0.1.0* to host(s) aws-123')
\ No newline at end of file
+                         'james *DEPLOYED* my_service @ 6g7l9p, version *0.1.0* to host(s) aws-123')
+
+    @patch('requests.post')
+    def test_slack_summary(self, mock_post):
+        track_event_slack(slack_url='ttp://slack.com/1234/adjaeifj', event='deployed',
+                          service_name='my_service', deployment_user='james',
+                          deployment_host='aws-123, aws-456', project_version='0.1.0', slack_emoji=':dabomb:',
+                          commit_hash='6g7l9p', failed_hosts=['aws-789'], duration=42.2, time_to_ready=12.4)
+        data = json.loads(mock_post.call_args[1]['data'])
+        self.assertEqual(data['text'], 'james *DEPLOYED* my_service @ 6g7l9p, version *0.1.0* to host(s) '
+                                       'aws-123, aws-456 *FAILED ON* aws-789 in 42s, ready after 12s')
+        self.assertEqual(data['icon_emoji'], ':rotating_light:')
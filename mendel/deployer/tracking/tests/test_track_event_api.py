@@ -1,7 +1,10 @@
 import json
 from unittest import TestCase
+from unittest.mock import MagicMock
 from unittest.mock import patch
 
+import requests
+
 from mendel.deployer.tracking.api import track_event_api
 
 
@@ -30,3 +33,39 @@ class ExternalApiTrackingTests(TestCase):
         self.assertEqual(mock_post.call_args[1]['data']['host'], 'aws-123')
         self.assertEqual(mock_post.call_args[1]['data']['deployer'], 'james')
         self.assertEqual(mock_post.call_args[1]['data']['event'], 'deployed')
+
+    def test_api_tracking_uses_session(self):
+        session = MagicMock()
+        delivered = track_event_api(track_event_endpoint='api/1234', event='deployed', service_name='my_service',
+                                    deployment_user='james', deployment_host='aws-123', session=session)
+        self.assertTrue(delivered)
+        self.assertEqual(session.post.call_args[1]['url'], 'http://api/1234')
+
+    def test_api_tracking_server_error_is_retriable(self):
+        response = requests.Response()
+        response.status_code = 503
+        session = MagicMock(**{'post.return_value': response})
+        delivered = track_event_api(track_event_endpoint='api/1234', event='deployed', service_name='my_service',
+                                    deployment_user='james', deployment_host='aws-123', session=session)
+        self.assertIs(delivered, False)
+
+    def test_api_tracking_client_error_is_not_retriable(self):
+        response = requests.Response()
+        response.status_code = 400
+        session = MagicMock(**{'post.return_value': response})
+        delivered = track_event_api(track_event_endpoint='api/1234', event='deployed', service_name='my_service',
+                                    deployment_user='james', deployment_host='aws-123', session=session)
+        self.assertIsNone(delivered)
+
+    def test_api_tracking_bulk(self):
+        session = MagicMock()
+        hosts = [dict(host='aws-123', status='ok'), dict(host='aws-456', status='failed')]
+        track_event_api(track_event_endpoint='api/1234', event='deployed', service_name='my_service',
+                        deployment_user='james', hosts=hosts, project_version='0.1.0', commit_hash='6g7l9p',
+                        duration=12.5, session=session)
+        self.assertEqual(session.post.call_count, 1)
+        payload = session.post.call_args[1]['json']
+        self.assertEqual(payload['hosts'], hosts)
+        self.assertEqual(payload['version'], '0.1.0')
+        self.assertEqual(payload['commit'], '6g7l9p')
+        self.assertEqual(payload['duration'], 12.5)
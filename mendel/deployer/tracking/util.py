@@ -0,0 +1,14 @@
+import requests
+
+
+def undelivered(outcome):
+    """
+    What a track_event function returns when it couldn't deliver an event
+    :param outcome: requests.Response or Exception, what came of the attempt
+    :return: False if trying again later might work (network errors, 5xx, 429), otherwise None
+    """
+    if isinstance(outcome, requests.Response):
+        return False if outcome.status_code >= 500 or outcome.status_code == 429 else None
+    if isinstance(outcome, (requests.ConnectionError, requests.Timeout)):
+        return False
+    return None
@@ -0,0 +1,144 @@
+"""
+Fabric plumbing that lets a task run once against every target host,
+instead of fabric's default of calling the task once per host,
+and that reuses one ssh connection per host for every task in a run.
+"""
+import threading
+
+from fabric.connection import Connection
+from fabric.executor import Executor
+from fabric.group import Group
+from fabric.tasks import ConnectionCall
+from fabric.tasks import Task
+
+from mendel.util.trace import trace_connection
+from mendel.util.trace import tracer
+
+
+class FleetTask(Task):
+    """
+    A Task whose body is handed a Group of Connections for all of the target hosts,
+    so it can coordinate work across them (e.g. build once, then fan out).
+    When run by a plain fabric Executor, the body is called once per host with a single Connection instead.
+    """
+    pass
+
+
+class ConnectionPool(object):
+    """
+    Hands out one Connection per host, creating it the first time it's asked for.
+    A Connection keeps its authenticated ssh transport (and sftp session) open once used, and runs every
+    command, upload and download over it, so sharing Connections means each host pays for the ssh handshake
+    (and the hop through any gateway) once per run instead of once per task.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.connections = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(init_kwargs):
+        return tuple(sorted((k, repr(v)) for k, v in init_kwargs.items() if k != 'config'))
+
+    def get(self, config, init_kwargs):
+        """
+        :param config: fabric Config
+        :param init_kwargs: dict of Connection init kwargs, e.g. host, user and port
+        :return: Connection, the same one for the same init kwargs
+        """
+        key = self._key(init_kwargs)
+        with self._lock:
+            if key not in self.connections:
+                kwargs = dict(init_kwargs, config=config)
+                self.connections[key] = Connection(**kwargs)
+                if tracer.enabled:
+                    trace_connection(self.connections[key])
+            return self.connections[key]
+
+    def close_all(self):
+        """
+        Close every connection the pool opened
+        :return: nothing
+        """
+        with self._lock:
+            connections, self.connections = list(self.connections.values()), {}
+        for connection in connections:
+            connection.close()
+
+
+class PooledConnectionCall(ConnectionCall):
+    """
+    A ConnectionCall which gets its Connection from a ConnectionPool, rather than making a new one
+    """
+
+    def __init__(self, *args, **kwargs):
+        pool = kwargs.pop('pool', None)
+        super().__init__(*args, **kwargs)
+        self.pool = pool
+
+    def clone_data(self):
+        data = super().clone_data()
+        data.update(init_kwargs=self.init_kwargs, pool=self.pool)
+        return data
+
+    def make_context(self, config):
+        if self.pool is None:
+            return super().make_context(config)
+        return self.pool.get(config, self.init_kwargs)
+
+
+class FleetCall(PooledConnectionCall):
+    """
+    A ConnectionCall which generates a Group of Connections, one for each of the target hosts
+    """
+
+    def make_context(self, config):
+        if self.pool is None:
+            connections = [Connection(config=config, **kwargs) for kwargs in self.init_kwargs]
+        else:
+            connections = [self.pool.get(config, kwargs) for kwargs in self.init_kwargs]
+        return Group.from_connections(connections)
+
+    def __repr__(self):
+        hosts = ','.join(kwargs['host'] for kwargs in self.init_kwargs)
+        return f"<{self.__class__.__name__} {self.task.name!r} hosts='{hosts}'>"
+
+
+class MendelExecutor(Executor):
+    """
+    Fabric Executor which collapses the per-host calls of a FleetTask into a single FleetCall,
+    and shares a single Connection per host between all of the tasks it executes, closing them when done
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connections = ConnectionPool()
+
+    def execute(self, *tasks):
+        try:
+            return super().execute(*tasks)
+        finally:
+            self.connections.close_all()
+
+    def expand_calls(self, calls, apply_hosts=True):
+        expanded = []
+        for call in super().expand_calls(calls, apply_hosts=apply_hosts):
+            if not isinstance(call, ConnectionCall):
+                expanded.append(call)
+                continue
+            if not isinstance(call.task, FleetTask):
+                expanded.append(call.clone(into=PooledConnectionCall,
+                                           with_=dict(init_kwargs=call.init_kwargs, pool=self.connections)))
+                continue
+            previous = expanded[-1] if expanded else None
+            is_same_call = isinstance(previous, FleetCall) and \
+                previous.task is call.task and \
+                previous.kwargs == call.kwargs and \
+                call.init_kwargs not in previous.init_kwargs
+            if is_same_call:
+                previous.init_kwargs.append(call.init_kwargs)
+            else:
+                expanded.append(call.clone(into=FleetCall,
+                                           with_=dict(init_kwargs=[call.init_kwargs], pool=self.connections)))
+        return expanded
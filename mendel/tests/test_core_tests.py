@@ -6,13 +6,15 @@ from mendel.deployer.deb import DebDeployer
 from mendel.deployer.jar import JarDeployer
 from mendel.deployer.remote_deb import RemoteDebDeployer
 from mendel.deployer.remote_jar import RemoteJarDeployer
+from mendel.executor import FleetTask
 
 
 class MendelCoreTests(TestCase):
     def setUp(self) -> None:
         super().setUp()
         self.expected_tasks = {'link_latest_release', 'build', 'upload',
-                               'install', 'deploy', 'rollback', 'tail', 'service_wrapper'}
+                               'install', 'deploy', 'rollback', 'tail', 'service_wrapper', 'prune',
+                               'stage', 'activate'}
         self.mock_config = ServiceConfig(service_name='test_service',
                                          slack_url='slack.com/aaa',
                                          slack_emoji=':alert:',
@@ -22,26 +24,36 @@ class MendelCoreTests(TestCase):
         self.mock_config.bundle_type = 'remote_jar'
         mendel = Mendel(config=self.mock_config, hosts='my-server-01')
         self.assertTrue(isinstance(mendel.deployer, RemoteJarDeployer))
-        self.assertEqual(len(mendel.tasks), 8)
+        self.assertEqual(len(mendel.tasks), 11)
         self.assertEqual({t.__name__ for t in mendel.tasks}, self.expected_tasks)
 
     def test_remote_deb_tasks(self):
         self.mock_config.bundle_type = 'remote_deb'
         mendel = Mendel(config=self.mock_config, hosts='my-server-01')
         self.assertTrue(isinstance(mendel.deployer, RemoteDebDeployer))
-        self.assertEqual(len(mendel.tasks), 8)
+        self.assertEqual(len(mendel.tasks), 11)
         self.assertEqual({t.__name__ for t in mendel.tasks}, self.expected_tasks)
 
     def test_deb_tasks(self):
         self.mock_config.bundle_type = 'deb'
         mendel = Mendel(config=self.mock_config, hosts='my-server-01')
         self.assertTrue(isinstance(mendel.deployer, DebDeployer))
-        self.assertEqual(len(mendel.tasks), 8)
+        self.assertEqual(len(mendel.tasks), 11)
         self.assertEqual({t.__name__ for t in mendel.tasks}, self.expected_tasks)
 
     def test_jar_tasks(self):
         self.mock_config.bundle_type = 'jar'
         mendel = Mendel(config=self.mock_config, hosts='my-server-01')
         self.assertTrue(isinstance(mendel.deployer, JarDeployer))
-        self.assertEqual(len(mendel.tasks), 8)
-        self.assertEqual({t.__name__ for t in mendel.tasks}, self.expected_tasks)
\ No newline at end of file
+        self.assertEqual(len(mendel.tasks), 11)
+        self.assertEqual({t.__name__ for t in mendel.tasks}, self.expected_tasks)
+
+    def test_fleet_tasks(self):
+        mendel = Mendel(config=self.mock_config, hosts='my-server-01')
+        fleet_tasks = {t.__name__ for t in mendel.tasks if isinstance(t, FleetTask)}
+        self.assertEqual(fleet_tasks, {'deploy', 'rollback', 'stage', 'activate'})
+
+    def test_refresh_facts(self):
+        self.assertFalse(Mendel(config=self.mock_config, hosts='my-server-01').deployer.facts.refresh)
+        mendel = Mendel(config=self.mock_config, hosts='my-server-01', refresh_facts=True)
+        self.assertTrue(mendel.deployer.facts.refresh)
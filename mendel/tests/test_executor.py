@@ -0,0 +1,75 @@
+from unittest import TestCase
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from fabric import Config
+
+from fabric.tasks import ConnectionCall
+from fabric.tasks import Task
+from invoke import Call
+from invoke import Collection
+
+from mendel.executor import ConnectionPool
+from mendel.executor import FleetCall
+from mendel.executor import FleetTask
+from mendel.executor import MendelExecutor
+
+
+def deploy(c):
+    pass
+
+
+def tail(c):
+    pass
+
+
+class MendelExecutorTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        core = MagicMock(remainder='')
+        core[0].args.hosts.value = 'host-01,host-02'
+        self.executor = MendelExecutor(Collection(), core=core)
+
+    def test_fleet_task_gets_one_call(self):
+        calls = self.executor.expand_calls([Call(task=FleetTask(body=deploy))])
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(isinstance(calls[0], FleetCall))
+        self.assertEqual([kwargs['host'] for kwargs in calls[0].init_kwargs], ['host-01', 'host-02'])
+
+    def test_regular_task_gets_call_per_host(self):
+        calls = self.executor.expand_calls([Call(task=Task(body=tail))])
+        self.assertEqual(len(calls), 2)
+        self.assertTrue(all(isinstance(c, ConnectionCall) and not isinstance(c, FleetCall) for c in calls))
+        self.assertEqual([c.init_kwargs['host'] for c in calls], ['host-01', 'host-02'])
+
+    def test_fleet_context_is_group(self):
+        call = self.executor.expand_calls([Call(task=FleetTask(body=deploy))])[0]
+        group = call.make_context(MagicMock())
+        self.assertEqual([c.host for c in group], ['host-01', 'host-02'])
+
+    def test_connections_are_shared_between_tasks(self):
+        calls = self.executor.expand_calls([Call(task=FleetTask(body=deploy)), Call(task=Task(body=tail))])
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(all(c.pool is self.executor.connections for c in calls))
+        config = Config()
+        group = calls[0].make_context(config)
+        self.assertIs(calls[1].make_context(config), group[0])
+        self.assertIs(calls[2].make_context(config), group[1])
+
+    def test_connections_are_closed_after_execute(self):
+        connection = MagicMock()
+        self.executor.connections.connections[('host', 'host-01')] = connection
+        with patch('invoke.executor.Executor.execute'):
+            self.executor.execute()
+        connection.close.assert_called_once_with()
+        self.assertEqual(self.executor.connections.connections, {})
+
+
+class ConnectionPoolTests(TestCase):
+    def test_same_kwargs_same_connection(self):
+        pool = ConnectionPool()
+        config = Config()
+        connection = pool.get(config, dict(host='host-01', user='kevin', port=22))
+        self.assertIs(pool.get(config, dict(host='host-01', user='kevin', port=22)), connection)
+        self.assertIsNot(pool.get(config, dict(host='host-01', user='root', port=22)), connection)
+        self.assertIsNot(pool.get(config, dict(host='host-02', user='kevin', port=22)), connection)
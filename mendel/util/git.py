@@ -0,0 +1,149 @@
+"""
+Look up which commit the local repository is at without running git for every question.
+HEAD is read straight out of the .git dir (loose refs, packed-refs and worktrees included); when that isn't
+possible, git is run once. Either way it's worked out once per repository per process, and shared.
+"""
+import os
+import re
+import threading
+
+SHORT_HASH_LENGTH = 7
+
+_cache = {}
+_lock = threading.Lock()
+
+
+class GitMetadataError(Exception):
+    """
+    raised when the commit the local repository is at can't be determined
+    """
+    pass
+
+
+class GitMetadata(object):
+    """
+    Which commit a local repository is at
+    """
+
+    def __init__(self, head):
+        super().__init__()
+        self.head = head
+
+    @property
+    def short_hash(self):
+        return self.head[:SHORT_HASH_LENGTH]
+
+    def __repr__(self):
+        return "GitMetadata: %s" % self.head
+
+
+def git_metadata(connection, path='.'):
+    """
+    :param connection: Connection, used to run git locally if the .git dir can't be read
+    :param path: str path to (somewhere inside) the local repository
+    :return: GitMetadata, the same one for every call about the same repository
+    :raises GitMetadataError: if it's not a git repository, or HEAD doesn't point at a commit
+    """
+    key = os.path.realpath(path)
+    with _lock:
+        if key not in _cache:
+            _cache[key] = _read_git_dir(key) or _ask_git(connection, key)
+        return _cache[key]
+
+
+def _read_git_dir(path):
+    """
+    :return: GitMetadata, or None if the .git dir couldn't be found or made sense of
+    """
+    if 'GIT_DIR' in os.environ:
+        # git would be looking somewhere other than where we'd look
+        return None
+    git_dir = _find_git_dir(path)
+    if not git_dir:
+        return None
+    try:
+        common_dir = _common_dir(git_dir)
+        head = _read(os.path.join(git_dir, 'HEAD'))
+        if head.startswith('ref:'):
+            head = _resolve_ref(git_dir, common_dir, head[len('ref:'):].strip())
+    except (IOError, OSError):
+        return None
+    if not head or not _is_hash(head):
+        return None
+    return GitMetadata(head)
+
+
+def _ask_git(connection, path):
+    """
+    :return: GitMetadata, according to a single run of git
+    """
+    result = connection.local(f'git -C {path} rev-parse HEAD', hide='both', warn=True)
+    lines = result.stdout.split()
+    if result.failed or not lines:
+        raise GitMetadataError(f'unable to find the current commit of {path}')
+    return GitMetadata(lines[0])
+
+
+def _find_git_dir(path):
+    """
+    :return: str path to the .git dir of the repository `path` is in, or None
+    """
+    while True:
+        candidate = os.path.join(path, '.git')
+        if os.path.isdir(candidate):
+            return candidate
+        if os.path.isfile(candidate):
+            # a worktree or submodule: .git is a file pointing at the real git dir
+            content = _read(candidate)
+            if not content.startswith('gitdir:'):
+                return None
+            return os.path.normpath(os.path.join(path, content[len('gitdir:'):].strip()))
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _common_dir(git_dir):
+    """
+    :return: str path to the dir holding the refs shared by all of a repository's worktrees
+    """
+    commondir_file = os.path.join(git_dir, 'commondir')
+    if os.path.isfile(commondir_file):
+        return os.path.normpath(os.path.join(git_dir, _read(commondir_file)))
+    return git_dir
+
+
+def _resolve_ref(git_dir, common_dir, ref, depth=0):
+    """
+    :return: str hash the ref points at, or None
+    """
+    if depth > 5:
+        return None
+    for directory in (git_dir, common_dir):
+        ref_file = os.path.join(directory, ref)
+        if os.path.isfile(ref_file):
+            value = _read(ref_file)
+            if value.startswith('ref:'):
+                return _resolve_ref(git_dir, common_dir, value[len('ref:'):].strip(), depth + 1)
+            return value
+
+    packed_refs = os.path.join(common_dir, 'packed-refs')
+    if os.path.isfile(packed_refs):
+        with open(packed_refs) as f:
+            for line in f:
+                if line.startswith(('#', '^')):
+                    continue
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == ref:
+                    return parts[0]
+    return None
+
+
+def _read(path):
+    with open(path) as f:
+        return f.read().strip()
+
+
+def _is_hash(value):
+    return re.match(r'^([0-9a-f]{40}|[0-9a-f]{64})$', value) is not None
@@ -1,3 +1,9 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
 def str_to_bool(val):
     """Convert a string representation of truth to true (1) or false (0).
 
@@ -11,4 +17,54 @@ def str_to_bool(val):
     elif val in ('n', 'no', 'f', 'false', 'off', '0'):
         return False
     else:
-        raise ValueError("invalid truth value %r" % (val,))
\ No newline at end of file
+        raise ValueError("invalid truth value %r" % (val,))
+
+
+def sha256_of(path):
+    """
+    :param path: str path to a local file
+    :return: str hex sha256 digest of the file
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def mendel_dir(*args):
+    """
+    :param args: str path components
+    :return: str path under the directory mendel keeps its local state in, ~/.mendel unless MENDEL_HOME is set
+    """
+    return os.path.join(os.environ.get('MENDEL_HOME') or os.path.expanduser('~/.mendel'), *args)
+
+
+def load_json_cache(path):
+    """
+    :param path: str path to a local json file
+    :return: what's in the file, or an empty dict if it isn't there or can't be read
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_json_cache(path, data):
+    """
+    Write a local json file atomically (a temp file moved into place), so a reader never sees half of it.
+    It's only a cache, so failing to write it is not an error.
+    :param path: str path to the file
+    :param data: json serializable data
+    :return: nothing
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + os.path.basename(path) + '-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    except (IOError, OSError):
+        pass
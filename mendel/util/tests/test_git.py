@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+import pytest
+from invoke import Result
+
+from mendel.deployer.tests.helpers import MockConnection
+from mendel.util.git import GitMetadataError
+from mendel.util.git import git_metadata
+
+HEAD = 'f333c776c8cf9d56a4604ff29640326f50f00c19'
+OTHER = 'be07d4d1fa4b0be07d4d1fa4b0be07d4d1fa4b0b'
+
+
+class GitMetadataTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.repo = os.path.join(self.tmp_dir, 'repo')
+        self.git_dir = os.path.join(self.repo, '.git')
+        os.makedirs(os.path.join(self.git_dir, 'refs', 'heads'))
+        # a connection with nothing to give, so any git command would raise
+        self.connection = MockConnection(run=[])
+        cache = patch.dict('mendel.util.git._cache', clear=True)
+        cache.start()
+        self.addCleanup(cache.stop)
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(content)
+
+    def test_loose_ref(self):
+        self._write(os.path.join(self.git_dir, 'HEAD'), 'ref: refs/heads/feature/x\n')
+        self._write(os.path.join(self.git_dir, 'refs', 'heads', 'feature', 'x'), HEAD + '\n')
+        git = git_metadata(self.connection, self.repo)
+        self.assertEqual(git.head, HEAD)
+        self.assertEqual(git.short_hash, 'f333c77')
+
+    def test_packed_ref(self):
+        self._write(os.path.join(self.git_dir, 'HEAD'), 'ref: refs/heads/master\n')
+        self._write(os.path.join(self.git_dir, 'packed-refs'),
+                    '# pack-refs with: peeled fully-peeled sorted\n'
+                    f'{OTHER} refs/heads/other\n'
+                    f'{HEAD} refs/heads/master\n'
+                    f'^{OTHER}\n')
+        self.assertEqual(git_metadata(self.connection, self.repo).head, HEAD)
+
+    def test_detached_head_from_subdir(self):
+        self._write(os.path.join(self.git_dir, 'HEAD'), HEAD + '\n')
+        subdir = os.path.join(self.repo, 'src', 'main')
+        os.makedirs(subdir)
+        git = git_metadata(self.connection, subdir)
+        self.assertEqual(git.head, HEAD)
+
+    def test_worktree(self):
+        self._write(os.path.join(self.git_dir, 'packed-refs'), f'{HEAD} refs/heads/release\n')
+        worktree_git_dir = os.path.join(self.git_dir, 'worktrees', 'wt')
+        self._write(os.path.join(worktree_git_dir, 'HEAD'), 'ref: refs/heads/release\n')
+        self._write(os.path.join(worktree_git_dir, 'commondir'), '../..\n')
+        worktree = os.path.join(self.tmp_dir, 'wt')
+        self._write(os.path.join(worktree, '.git'), f'gitdir: {worktree_git_dir}\n')
+        git = git_metadata(self.connection, worktree)
+        self.assertEqual(git.head, HEAD)
+
+    def test_cached(self):
+        self._write(os.path.join(self.git_dir, 'HEAD'), HEAD + '\n')
+        git = git_metadata(self.connection, self.repo)
+        self._write(os.path.join(self.git_dir, 'HEAD'), OTHER + '\n')
+        self.assertIs(git_metadata(self.connection, self.repo), git)
+
+    def test_falls_back_to_git(self):
+        # HEAD points at a branch with no commits yet, which we leave to git to explain
+        self._write(os.path.join(self.git_dir, 'HEAD'), 'ref: refs/heads/master\n')
+        connection = MockConnection(run=Result(f'{HEAD}\n'))
+        git = git_metadata(connection, self.repo)
+        self.assertEqual(git.head, HEAD)
+
+    def test_not_a_repository(self):
+        connection = MockConnection(run=Result('fatal: not a git repository', exited=128))
+        with pytest.raises(GitMetadataError):
+            git_metadata(connection, os.path.join(self.tmp_dir, 'elsewhere'))
+
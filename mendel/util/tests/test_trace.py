@@ -0,0 +1,71 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+
+import pytest
+from invoke import Result
+
+from mendel.deployer.tests.helpers import MockConnection
+from mendel.util.trace import Tracer
+from mendel.util.trace import trace_connection
+
+
+class TracerTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tracer = Tracer()
+        self.tracer.enable()
+
+    def test_disabled_records_nothing(self):
+        tracer = Tracer()
+        with tracer.span('build') as args:
+            args['bytes'] = 10
+        self.assertEqual(tracer.events, [])
+
+    def test_slowest_are_innermost(self):
+        with self.tracer.span('install', host='prod-01'):
+            with self.tracer.span('untar', host='prod-01'):
+                time.sleep(0.02)
+            with self.tracer.span('symlink', host='prod-01'):
+                pass
+        with self.tracer.span('install', host='prod-02'):
+            time.sleep(0.01)
+        with pytest.raises(ValueError):
+            with self.tracer.span('restart', host='prod-02'):
+                raise ValueError('nope')
+        slowest = self.tracer.slowest(2)
+        self.assertEqual([(e['name'], e['args']['host']) for e in slowest], [('untar', 'prod-01'),
+                                                                            ('install', 'prod-02')])
+        restart = next(e for e in self.tracer.events if e['name'] == 'restart')
+        self.assertEqual(restart['args']['error'], 'ValueError: nope')
+
+    def test_chrome_trace(self):
+        with self.tracer.span('build'):
+            pass
+        with self.tracer.span('upload', host='prod-01', bytes=1024):
+            pass
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp_dir, 'trace.json')
+            self.tracer.write(path)
+            with open(path) as f:
+                trace = json.load(f)
+        finally:
+            shutil.rmtree(tmp_dir)
+        lanes = {e['args']['name']: e['tid'] for e in trace['traceEvents'] if e['ph'] == 'M'}
+        self.assertEqual(set(lanes), {'mendel', 'prod-01'})
+        upload = next(e for e in trace['traceEvents'] if e['name'] == 'upload')
+        self.assertEqual((upload['ph'], upload['tid'], upload['args']['bytes']), ('X', lanes['prod-01'], 1024))
+        self.assertEqual(len(trace['otherData']['slowest']), 2)
+
+    def test_trace_connection(self):
+        connection = trace_connection(MockConnection(host='prod-01', run=Result('ok'), sudo=Result('done')),
+                                      tracer=self.tracer)
+        self.assertEqual(connection.run('echo ok').stdout, 'ok')
+        connection.sudo('systemctl restart myservice')
+        self.assertEqual([(e['name'], e['cat'], e['args']['host']) for e in self.tracer.events],
+                         [('run echo ok', 'run', 'prod-01'), ('sudo systemctl restart myservice', 'sudo', 'prod-01')])
+        self.assertEqual(self.tracer.events[1]['args']['stdout_bytes'], 4)
@@ -1,6 +1,11 @@
+import os
+import shutil
+import tempfile
 from unittest import TestCase
 
 
+from mendel.util.misc import load_json_cache
+from mendel.util.misc import save_json_cache
 from mendel.util.misc import str_to_bool
 
 
@@ -11,3 +16,27 @@ class MendelConfigValidationTests(TestCase):
             self.assertTrue(str_to_bool(val))
         for val in ("n", "no", "f", "false", "off", "0", " NO "):
             self.assertFalse(str_to_bool(val))
+
+
+class JsonCacheTests(TestCase):
+    def setUp(self) -> None:
+        super().setUp()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'state', 'cache.json')
+
+    def tearDown(self) -> None:
+        super().tearDown()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_save_and_load(self):
+        self.assertEqual(load_json_cache(self.path), {})
+        save_json_cache(self.path, {'a': 1})
+        self.assertEqual(load_json_cache(self.path), {'a': 1})
+        # nothing is left behind but the cache itself
+        self.assertEqual(os.listdir(os.path.dirname(self.path)), ['cache.json'])
+
+    def test_unreadable_cache_is_empty(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.assertEqual(load_json_cache(self.path), {})
@@ -0,0 +1,177 @@
+"""
+Time where a mendel run spends its time: the phases of a deploy, every command and upload on every host, and
+tracking calls. Spans are written out in Chrome's trace event format (open the file in chrome://tracing or
+https://ui.perfetto.dev), one lane per host, and the slowest of them are summarized at the end of the run.
+
+Tracing is off unless `mendel --trace out.json` turns it on, and spans cost next to nothing while it's off.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from mendel.util.colors import blue
+
+TRACED_METHODS = ('run', 'sudo', 'put', 'local')
+MAX_COMMAND_LENGTH = 2000
+
+
+class Tracer(object):
+    """
+        with tracer.span('upload', host=connection.host) as args:
+            ...
+            args['bytes'] = 1024
+
+    Spans are recorded as complete ('X') events, in microseconds since the tracer was enabled.
+    Spans without a host go in the `mendel` lane.
+    """
+    PROCESS_ID = 1
+
+    def __init__(self):
+        super().__init__()
+        self.enabled = False
+        self.events = []
+        self._start = time.time()
+        self._lanes = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+        self._start = time.time()
+
+    @contextmanager
+    def span(self, name, category='phase', host=None, **args):
+        """
+        Time the body of the with statement
+        :param name: str name of the span
+        :param category: str kind of span, e.g. `phase`, `run` or `tracking`
+        :param host: str host the span is for, if any
+        :param args: anything else worth knowing about the span. more can be added to the dict it yields
+        :return: dict of the span's args
+        """
+        if not self.enabled:
+            yield args
+            return
+        start = time.time()
+        try:
+            yield args
+        except BaseException as e:
+            args['error'] = f'{e.__class__.__name__}: {e}'
+            raise
+        finally:
+            self.add(name, category, start, time.time() - start, host=host, **args)
+
+    def add(self, name, category, start, duration, host=None, **args):
+        """
+        Record a span that's already over
+        :param name: str name of the span
+        :param category: str kind of span
+        :param start: float time the span started
+        :param duration: float seconds the span took
+        :param host: str host the span is for, if any
+        :param args: anything else worth knowing about the span
+        :return: nothing
+        """
+        lane = str(host or 'mendel')
+        with self._lock:
+            if lane not in self._lanes:
+                self._lanes[lane] = len(self._lanes) + 1
+            self.events.append(dict(name=name, cat=category, ph='X', pid=self.PROCESS_ID, tid=self._lanes[lane],
+                                    ts=int((start - self._start) * 1000000), dur=int(duration * 1000000),
+                                    args=dict(args, host=lane)))
+
+    def slowest(self, count=10):
+        """
+        :param count: int number of spans
+        :return: list of the `count` longest spans, longest first. Phases contain other spans, so only spans
+                 without any inside them count, e.g. the commands of an install, not the install.
+        """
+        with self._lock:
+            events = sorted(self.events, key=lambda e: (e['tid'], e['ts'], -e['dur']))
+        leaves = []
+        for i, event in enumerate(events):
+            end = event['ts'] + event['dur']
+            inside = False
+            for other in events[i + 1:]:
+                if other['tid'] != event['tid'] or other['ts'] >= end:
+                    break
+                if other['ts'] + other['dur'] <= end:
+                    inside = True
+                    break
+            if not inside:
+                leaves.append(event)
+        return sorted(leaves, key=lambda e: e['dur'], reverse=True)[:count]
+
+    def chrome_trace(self, count=10):
+        """
+        :param count: int number of the slowest spans to summarize
+        :return: dict in Chrome's trace event format, with the slowest spans in `otherData`
+        """
+        with self._lock:
+            lanes = sorted(self._lanes.items(), key=lambda lane: lane[1])
+            events = list(self.events)
+        names = [dict(name='thread_name', ph='M', pid=self.PROCESS_ID, tid=tid, args=dict(name=lane))
+                 for lane, tid in lanes]
+        slowest = [dict(name=e['name'], host=e['args']['host'], seconds=round(e['dur'] / 1000000.0, 3))
+                   for e in self.slowest(count)]
+        return dict(traceEvents=names + events, displayTimeUnit='ms', otherData=dict(slowest=slowest))
+
+    def write(self, path, count=10):
+        """
+        :param path: str path to write the trace to
+        :param count: int number of the slowest spans to summarize
+        :return: nothing
+        """
+        with open(os.path.expanduser(path), 'w') as f:
+            json.dump(self.chrome_trace(count), f)
+
+    def print_summary(self, count=10):
+        """
+        Print the slowest spans, and how fast bytes were sent in any that sent some
+        :param count: int number of spans
+        :return: nothing
+        """
+        print(blue(f'{count} slowest steps:'))
+        for event in self.slowest(count):
+            seconds = event['dur'] / 1000000.0
+            line = f'  {seconds:8.2f}s  [{event["args"]["host"]}] {event["name"]}'
+            if event['args'].get('bytes') and seconds:
+                line += f' ({event["args"]["bytes"] / 1024 / 1024 / seconds:.1f}MB/s)'
+            print(line)
+
+
+tracer = Tracer()
+
+
+def trace_connection(connection, tracer=tracer):
+    """
+    Record a span for every command run on, and file put to, a Connection
+    :param connection: Connection
+    :param tracer: Tracer
+    :return: the same Connection
+    """
+    for method_name in TRACED_METHODS:
+        if hasattr(connection, method_name):
+            setattr(connection, method_name,
+                    _traced(connection, method_name, getattr(connection, method_name), tracer))
+    return connection
+
+
+def _traced(connection, method_name, method, tracer):
+    def traced(*args, **kwargs):
+        if not tracer.enabled:
+            return method(*args, **kwargs)
+        what = str(args[0] if args else kwargs.get('command') or kwargs.get('local') or '')
+        name = f'{method_name} {" ".join(what.split())[:60]}'
+        # local commands run here, whichever host's connection ran them
+        host = None if method_name == 'local' else connection.host
+        with tracer.span(name, category=method_name, host=host, command=what[:MAX_COMMAND_LENGTH]) as span_args:
+            result = method(*args, **kwargs)
+            if method_name == 'put':
+                span_args['bytes'] = os.path.getsize(what) if os.path.isfile(what) else None
+            else:
+                span_args['exited'] = getattr(result, 'exited', None)
+                span_args['stdout_bytes'] = len(getattr(result, 'stdout', '') or '')
+        return result
+    return traced